@@ -0,0 +1,312 @@
+"""
+凭证缓存 - 在进程内保存 OpenSearch 等服务的认证信息，并在过期前后台刷新
+
+配置 CREDENTIALS_CACHE_KEY 后，启动时优先读取本地加密缓存，不需要等待一次 Secrets Manager 调用；
+未配置时每个进程启动都会同步获取一次。凭证来源可替换：默认从 AWS Secrets Manager 获取，
+也可以从本地 JSON 文件读取（本地开发和测试）。
+
+OpenSearch 客户端使用 AsyncOpenSearchAuth / OpenSearchAuth 作为 http_auth，每次请求时从提供者读取凭证，
+后台刷新的新凭证对已创建的客户端立即生效。
+
+配置项（环境变量）：
+- CREDENTIALS_SOURCE: 凭证来源，secretsmanager（默认）或 file:<JSON 文件路径>
+- OPENSEARCH_SECRET_NAME / AWS_REGION: Secrets Manager 中的密钥名称和所在区域
+- CREDENTIALS_TTL: 凭证的有效期（秒），到期前后台重新获取
+- CREDENTIALS_REFRESH_MARGIN: 提前多少秒开始刷新
+- CREDENTIALS_CACHE_PATH: 本地加密缓存文件路径，多个进程共享
+- CREDENTIALS_CACHE_KEY: 加密本地缓存使用的口令；未配置或未安装 cryptography 时不写本地缓存
+  （口令经 PBKDF2-HMAC-SHA256 和随机盐派生出加密密钥，盐与密文一起保存在缓存文件中）
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = Exception
+
+logger = logging.getLogger('emr_assistant')
+
+# 由口令派生缓存加密密钥的 PBKDF2 迭代次数
+KDF_ITERATIONS = 390000
+# 后台刷新失败后的首次重试间隔和最长重试间隔（秒），每次失败间隔翻倍
+REFRESH_RETRY_DELAY = 5.0
+REFRESH_RETRY_MAX_DELAY = 300.0
+
+
+class SecretsManagerSource:
+    """从 AWS Secrets Manager 获取 JSON 格式的密钥"""
+
+    def __init__(self, secret_name: str, region_name: str = 'us-east-1'):
+        self.secret_name = secret_name
+        self.region_name = region_name
+
+    @property
+    def name(self) -> str:
+        return f"secretsmanager:{self.region_name}:{self.secret_name}"
+
+    def fetch(self) -> Dict[str, Any]:
+        import boto3
+
+        client = boto3.session.Session().client(service_name='secretsmanager', region_name=self.region_name)
+        response = client.get_secret_value(SecretId=self.secret_name)
+        if 'SecretString' not in response:
+            raise ValueError("Secret value is not a string")
+        return json.loads(response['SecretString'])
+
+
+class FileSource:
+    """从本地 JSON 文件读取凭证，例如 {"username": "admin", "password": "admin"}"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @property
+    def name(self) -> str:
+        return f"file:{self.path}"
+
+    def fetch(self) -> Dict[str, Any]:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+
+def source_from_env():
+    """根据 CREDENTIALS_SOURCE 创建凭证来源"""
+    source = os.getenv('CREDENTIALS_SOURCE', 'secretsmanager')
+    if source.startswith('file:'):
+        return FileSource(source[len('file:'):])
+    if source != 'secretsmanager':
+        raise ValueError(f"不支持的 CREDENTIALS_SOURCE: {source}（可选 secretsmanager、file:<路径>）")
+    return SecretsManagerSource(
+        os.getenv('OPENSEARCH_SECRET_NAME', 'opensearch_credentials'),
+        os.getenv('AWS_REGION', 'us-east-1')
+    )
+
+
+class CredentialsProvider:
+    """
+    带缓存的凭证提供者
+
+    - get() 返回内存中的凭证；首次调用时依次尝试本地加密缓存和凭证来源
+    - 后台线程在凭证到期前 CREDENTIALS_REFRESH_MARGIN 秒重新获取，失败时保留旧凭证并稍后重试
+    - 凭证来源不可用且本地缓存已过期时，使用过期的缓存并记录警告
+    """
+
+    def __init__(self, source=None, ttl: float = None, refresh_margin: float = None,
+                 cache_path: str = None, cache_key: str = None):
+        self.source = source or source_from_env()
+        self.ttl = ttl if ttl is not None else float(os.getenv('CREDENTIALS_TTL', 3600))
+        self.refresh_margin = refresh_margin if refresh_margin is not None else float(os.getenv('CREDENTIALS_REFRESH_MARGIN', 300))
+        self.cache_path = cache_path or os.getenv('CREDENTIALS_CACHE_PATH', os.path.join('cache', 'credentials.enc'))
+
+        cache_key = cache_key if cache_key is not None else os.getenv('CREDENTIALS_CACHE_KEY')
+        self._cache_key: Optional[bytes] = None
+        # (盐, 迭代次数) -> Fernet，密钥派生较慢，同一缓存文件只派生一次
+        self._fernets: Dict[tuple, Any] = {}
+        self._salt: Optional[bytes] = None
+        if cache_key and Fernet is not None:
+            self._cache_key = cache_key.encode('utf-8')
+        elif cache_key:
+            logger.warning("⚠️ 未安装 cryptography，凭证不会写入本地缓存")
+        else:
+            logger.info("🔑 未配置 CREDENTIALS_CACHE_KEY，凭证不写入本地缓存，每次启动都会从凭证来源获取")
+
+        self._value: Optional[Dict[str, Any]] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        self.fetches = 0
+        self.cache_loads = 0
+        self.failures = 0
+
+    def get(self) -> Dict[str, Any]:
+        """返回当前凭证，首次调用时加载"""
+        with self._lock:
+            if self._value is None:
+                self._load()
+            value = self._value
+        self._start_refresher()
+        return value
+
+    def _load(self):
+        """在持有锁的情况下完成首次加载"""
+        cached = self._read_cache()
+        if cached is not None and cached[1] > time.time():
+            self._value, self._expires_at = cached
+            self.cache_loads += 1
+            logger.info(f"🔑 从本地缓存加载凭证 ({self.source.name})")
+            return
+        try:
+            value = self.source.fetch()
+        except Exception as e:
+            self.failures += 1
+            if cached is None:
+                raise
+            # 凭证来源暂时不可用时使用过期的缓存，后台继续重试
+            logger.warning(f"⚠️ 获取凭证失败，使用已过期的本地缓存: {str(e)}")
+            self._value, self._expires_at = cached
+            self.cache_loads += 1
+            return
+        self._set(value)
+
+    def _set(self, value: Dict[str, Any]):
+        """在持有锁的情况下保存新获取的凭证"""
+        self._value = value
+        self._expires_at = time.time() + self.ttl
+        self.fetches += 1
+        logger.info(f"🔑 已获取凭证 ({self.source.name})")
+        self._write_cache(value, self._expires_at)
+
+    def refresh(self):
+        """立即重新获取凭证（例如认证失败后）；获取期间 get() 继续返回旧凭证"""
+        value = self.source.fetch()
+        with self._lock:
+            self._set(value)
+
+    def _start_refresher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='credentials-refresher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        retry_delay = REFRESH_RETRY_DELAY
+        while True:
+            with self._lock:
+                wait = self._expires_at - self.refresh_margin - time.time()
+            if self._stop.wait(max(wait, 0)):
+                return
+            try:
+                self.refresh()
+                retry_delay = REFRESH_RETRY_DELAY
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                logger.warning(f"⚠️ 刷新凭证失败，{retry_delay:.0f} 秒后重试: {str(e)}")
+                if self._stop.wait(retry_delay):
+                    return
+                retry_delay = min(retry_delay * 2, REFRESH_RETRY_MAX_DELAY)
+
+    def _fernet(self, salt: bytes, iterations: int):
+        """由口令和盐派生 Fernet 密钥"""
+        fernet = self._fernets.get((salt, iterations))
+        if fernet is None:
+            key = hashlib.pbkdf2_hmac('sha256', self._cache_key, salt, iterations)
+            fernet = self._fernets[(salt, iterations)] = Fernet(base64.urlsafe_b64encode(key))
+        return fernet
+
+    def _read_cache(self) -> Optional[tuple]:
+        if self._cache_key is None or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, 'rb') as f:
+                envelope = json.loads(f.read())
+            salt = base64.b64decode(envelope['salt'])
+            fernet = self._fernet(salt, int(envelope['iterations']))
+            payload = json.loads(fernet.decrypt(envelope['token'].encode('ascii')))
+            # 之后写缓存时沿用同一个盐，其他进程不需要重新派生密钥
+            self._salt = salt
+            if payload.get('source') != self.source.name:
+                return None
+            return payload['value'], float(payload['expires_at'])
+        except (InvalidToken, ValueError, KeyError, TypeError, OSError) as e:
+            logger.warning(f"⚠️ 读取本地凭证缓存失败（口令不匹配或文件损坏）: {e!r}")
+            return None
+
+    def _write_cache(self, value: Dict[str, Any], expires_at: float):
+        if self._cache_key is None:
+            return
+        try:
+            directory = os.path.dirname(self.cache_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            if self._salt is None:
+                self._salt = os.urandom(16)
+            token = self._fernet(self._salt, KDF_ITERATIONS).encrypt(json.dumps({
+                "source": self.source.name,
+                "value": value,
+                "expires_at": expires_at,
+            }).encode('utf-8'))
+            envelope = json.dumps({
+                "kdf": "pbkdf2-sha256",
+                "iterations": KDF_ITERATIONS,
+                "salt": base64.b64encode(self._salt).decode('ascii'),
+                "token": token.decode('ascii'),
+            }).encode('utf-8')
+            # 先写临时文件（仅当前用户可读写）再替换，多个进程同时刷新时不会读到写了一半的文件
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(envelope)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.warning(f"⚠️ 写入本地凭证缓存失败: {str(e)}")
+
+    def close(self):
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "source": self.source.name,
+                "loaded": self._value is not None,
+                "expires_in": round(self._expires_at - time.time()) if self._value is not None else None,
+                "local_cache": self._cache_key is not None,
+                "fetches": self.fetches,
+                "cache_loads": self.cache_loads,
+                "failures": self.failures,
+            }
+
+
+def _basic_auth_header(provider: CredentialsProvider) -> str:
+    credentials = provider.get()
+    token = base64.b64encode(f"{credentials['username']}:{credentials['password']}".encode('utf-8')).decode('ascii')
+    return f"Basic {token}"
+
+
+class AsyncOpenSearchAuth:
+    """AsyncOpenSearch（AIOHttpConnection）的 http_auth：每次请求时按当前凭证生成 Basic 认证头"""
+
+    def __init__(self, provider: CredentialsProvider):
+        self.provider = provider
+
+    def __call__(self, method: str, url: str, query_string: Optional[str] = None, body: Any = None) -> Dict[str, str]:
+        return {"Authorization": _basic_auth_header(self.provider)}
+
+
+class OpenSearchAuth:
+    """OpenSearch（RequestsHttpConnection）的 http_auth，作为 requests 的认证对象使用"""
+
+    def __init__(self, provider: CredentialsProvider):
+        self.provider = provider
+
+    def __call__(self, request):
+        request.headers['Authorization'] = _basic_auth_header(self.provider)
+        return request
+
+
+_providers: Dict[str, CredentialsProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def get_credentials_provider(source=None) -> CredentialsProvider:
+    """返回进程内共享的凭证提供者（同一凭证来源只创建一个）"""
+    source = source or source_from_env()
+    with _providers_lock:
+        provider = _providers.get(source.name)
+        if provider is None:
+            provider = _providers[source.name] = CredentialsProvider(source)
+        return provider
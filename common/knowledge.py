@@ -0,0 +1,86 @@
+"""
+知识库相关的共享工具 - 问答应用和 MCP Server 共用
+
+- normalize_query: 缓存键使用的问题文本规范化
+- read_index_version_file: 读取知识库索引版本标记，索引重建后各缓存据此失效
+- extract_query_entities: 识别问题中的 EMR 版本和组件（检索预过滤和回答缓存共用）
+"""
+
+import os
+import re
+import unicodedata
+from typing import List, Optional, Tuple
+
+EMR_COMPONENTS = (
+    'hive', 'spark', 'flink', 'hbase', 'hadoop', 'hdfs', 'yarn', 'tez', 'presto', 'trino', 'iceberg', 'hudi',
+    'delta', 'livy', 'oozie', 'zeppelin', 'jupyterhub', 'sqoop', 'zookeeper', 'pig', 'phoenix', 'hue', 'kafka',
+)
+
+_COMPONENT_PATTERN = re.compile(r'(?<![a-z])(' + '|'.join(EMR_COMPONENTS) + r')(?![a-z])')
+# 带 emr 前缀的版本号（允许省略补丁号，如 "emr 6.10"、"emr-6.10.0"）；版本号后可以紧跟句号
+_EMR_RELEASE_PATTERN = re.compile(r'emr[\s\-_]*(?:release\s*)?v?(\d\.\d{1,2})(?:\.(\d{1,2}))?(?!\.?\d)')
+# 不带前缀的 5.x ~ 7.x 版本号，排除紧跟在组件名后面的组件版本（如 "phoenix 5.1.3"）
+_BARE_RELEASE_PATTERN = re.compile(r'(?<![\d.])([5-7]\.\d{1,2})(?:\.(\d{1,2}))?(?!\.?\d)')
+_COMPONENT_VERSION_PREFIX = re.compile(r'(?:' + '|'.join(EMR_COMPONENTS) + r')\s*v?$')
+# 不带前缀的完整版本号（x.y.z）只在问题提到 EMR 或升级时才视为 EMR 版本，避免把其他软件的版本号当作 EMR 版本
+_RELEASE_CONTEXT_PATTERN = re.compile(r'emr|升级|迁移|upgrad|migrat')
+# 版本区间的写法（"from X to Y"、"X 升级到 Y"、"X vs Y"、"X → Y"），区间另一端常省略 emr 前缀和补丁号
+_RANGE_CONTEXT_PATTERN = re.compile(r'(?<![a-z])(?:from|to|vs)(?![a-z])|升级到|迁移到|→|->')
+
+
+def normalize_query(text: str) -> str:
+    """规范化问题文本：全角转半角、统一大小写、合并空白、去掉结尾标点"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = " ".join(text.split())
+    return re.sub(r'[\s\?\!\.。？！~]+$', '', text)
+
+
+def read_index_version_file() -> Optional[str]:
+    """
+    读取知识库索引版本标记文件（KNOWLEDGE_INDEX_VERSION_FILE）
+
+    重建索引的任务在完成后写入新的版本号；文件为空时使用修改时间作为版本
+    """
+    path = os.getenv('KNOWLEDGE_INDEX_VERSION_FILE')
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        version = f.read().strip()
+    return version or str(os.path.getmtime(path))
+
+
+def _release_range(major_minor: str, patch: Optional[str]) -> Tuple[int, int]:
+    """版本号编码为 major * 1000000 + minor * 1000 + patch；省略补丁号时返回整个系列的范围"""
+    major, minor = (int(part) for part in major_minor.split('.'))
+    base = major * 1000000 + minor * 1000
+    if patch is None:
+        return base, base + 999
+    return base + int(patch), base + int(patch)
+
+
+def extract_query_entities(query: str) -> Tuple[List[Tuple[int, int]], List[str]]:
+    """
+    从问题中识别 EMR 版本和组件
+
+    Returns:
+        (按出现顺序的版本号范围 (gte, lte) 列表；组件名称列表)
+    """
+    text = normalize_query(query)
+    ranges = []
+    spans = []
+    for match in _EMR_RELEASE_PATTERN.finditer(text):
+        ranges.append(_release_range(match.group(1), match.group(2)))
+        spans.append(match.span(1))
+    # 已出现带 emr 前缀的版本或版本区间写法时，不带前缀的 major.minor（如 "emr 6.10 to 6.11" 中的 6.11）也视为 EMR 版本
+    accept_short = bool(ranges) or bool(_RANGE_CONTEXT_PATTERN.search(text))
+    accept_full = accept_short or bool(_RELEASE_CONTEXT_PATTERN.search(text))
+    for match in _BARE_RELEASE_PATTERN.finditer(text):
+        if not (accept_short if match.group(2) is None else accept_full):
+            continue
+        if any(start <= match.start() < end for start, end in spans):
+            continue
+        if _COMPONENT_VERSION_PREFIX.search(text[:match.start()]):
+            continue
+        ranges.append(_release_range(match.group(1), match.group(2)))
+    components = list(dict.fromkeys(_COMPONENT_PATTERN.findall(text)))
+    return list(dict.fromkeys(ranges)), components
@@ -0,0 +1,190 @@
+"""
+准入控制 - 限制聊天接口的全局并发和单用户并发
+
+超过全局并发上限的请求进入有上限的等待队列，排队期间可以获取当前位置（用于 SSE 状态事件）；
+队列已满、同一用户的请求数超过上限或排队超时的请求会被拒绝，避免进程在过载时反复抖动。
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger('emr_assistant')
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class AdmissionTicket:
+    """一个请求的准入凭证，处理结束后必须调用 release()"""
+
+    def __init__(self, controller: 'AdmissionController', user_id: str):
+        self.controller = controller
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.released = False
+        # 获得执行槽位或队列位置变化时置位
+        self._changed = asyncio.Event()
+
+    @property
+    def position(self) -> int:
+        """在等待队列中的位置（从 1 开始），已准入时为 0"""
+        return self.controller._position(self)
+
+    async def wait(self, timeout: Optional[float] = None) -> AsyncIterator[int]:
+        """
+        等待获得执行槽位
+
+        Yields:
+            排队期间每次位置变化时产生当前位置；已准入时直接结束
+
+        Raises:
+            AdmissionRejected: 排队超时
+        """
+        timeout = self.controller.queue_timeout if timeout is None else timeout
+        deadline = self.enqueued_at + timeout
+        last_position = None
+        try:
+            while not self.granted:
+                position = self.position
+                if position != last_position:
+                    last_position = position
+                    yield position
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.controller.rejected += 1
+                    metrics.incr("admission.rejected.timeout")
+                    raise AdmissionRejected('timeout', f"排队超时（超过 {timeout:.0f} 秒），请稍后重试")
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # 超时、取消或调用方提前结束迭代时退出队列
+            if not self.granted:
+                self.release()
+            raise
+        metrics.observe("admission.wait", (time.monotonic() - self.enqueued_at) * 1000)
+
+    async def acquire(self, timeout: Optional[float] = None):
+        """等待获得执行槽位，不关心排队位置"""
+        async for _ in self.wait(timeout):
+            pass
+
+    def release(self):
+        """释放执行槽位或退出等待队列（可重复调用）"""
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    聊天请求的准入控制
+
+    配置项（环境变量）：
+    - CHAT_MAX_CONCURRENT: 同时处理的请求数上限
+    - CHAT_MAX_QUEUE: 等待队列长度上限，超出时直接拒绝
+    - CHAT_MAX_PER_USER: 同一用户处理中和排队中的请求数上限（同一用户共用一个会话文件）
+    - CHAT_QUEUE_TIMEOUT: 单个请求在队列中等待的最长秒数
+    """
+
+    def __init__(self, max_concurrent: int = None, max_queue: int = None,
+                 max_per_user: int = None, queue_timeout: float = None):
+        self.max_concurrent = max_concurrent if max_concurrent is not None else int(os.getenv('CHAT_MAX_CONCURRENT', 8))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('CHAT_MAX_QUEUE', 32))
+        self.max_per_user = max_per_user if max_per_user is not None else int(os.getenv('CHAT_MAX_PER_USER', 1))
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv('CHAT_QUEUE_TIMEOUT', 120))
+
+        self._running = 0
+        self._waiters: deque = deque()
+        self._per_user: Dict[str, int] = {}
+
+        self.admitted = 0
+        self.rejected = 0
+
+    def enqueue(self, user_id: str) -> AdmissionTicket:
+        """
+        登记一个请求，有空闲槽位时立即准入，否则进入等待队列
+
+        Raises:
+            AdmissionRejected: 用户请求数超限或等待队列已满
+        """
+        if self.max_per_user > 0 and self._per_user.get(user_id, 0) >= self.max_per_user:
+            self.rejected += 1
+            metrics.incr("admission.rejected.user_busy")
+            raise AdmissionRejected('user_busy', "您还有正在处理的问题，请等待完成后再提问")
+
+        ticket = AdmissionTicket(self, user_id)
+        if self._running < self.max_concurrent and not self._waiters:
+            self._grant(ticket)
+        elif len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            metrics.incr("admission.rejected.queue_full")
+            raise AdmissionRejected('queue_full', "服务繁忙，请稍后重试")
+        else:
+            self._waiters.append(ticket)
+            metrics.incr("admission.queued")
+            logger.info(f"⏳ 请求进入等待队列 (用户 {user_id}，位置 {len(self._waiters)})")
+
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        return ticket
+
+    def _grant(self, ticket: AdmissionTicket):
+        self._running += 1
+        self.admitted += 1
+        ticket.granted = True
+        ticket._changed.set()
+
+    def _position(self, ticket: AdmissionTicket) -> int:
+        if ticket.granted:
+            return 0
+        try:
+            return self._waiters.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def _release(self, ticket: AdmissionTicket):
+        count = self._per_user.get(ticket.user_id, 0) - 1
+        if count > 0:
+            self._per_user[ticket.user_id] = count
+        else:
+            self._per_user.pop(ticket.user_id, None)
+
+        if ticket.granted:
+            self._running -= 1
+        else:
+            try:
+                self._waiters.remove(ticket)
+            except ValueError:
+                pass
+
+        while self._waiters and self._running < self.max_concurrent:
+            self._grant(self._waiters.popleft())
+        # 通知其余等待者位置已变化
+        for waiter in self._waiters:
+            waiter._changed.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._running,
+            "queued": len(self._waiters),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_per_user": self.max_per_user,
+            "queue_timeout": self.queue_timeout,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,194 @@
+"""
+Agent 缓存 - 按 user_id 缓存活跃会话的 Agent，后续提问无需重建模型和重新加载会话历史
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger('emr_assistant')
+
+
+class _CachedAgent:
+    """缓存条目"""
+
+    __slots__ = ('agent', 'session_manager', 'tools_version', 'size_bytes', 'last_used')
+
+    def __init__(self, agent, session_manager, tools_version):
+        self.agent = agent
+        self.session_manager = session_manager
+        self.tools_version = tools_version
+        self.size_bytes = 0
+        self.last_used = time.monotonic()
+
+
+def estimate_agent_size(agent) -> int:
+    """估算 Agent 会话历史占用的内存（按消息序列化后的字节数）"""
+    try:
+        return len(json.dumps(getattr(agent, 'messages', []), ensure_ascii=False, default=str).encode('utf-8'))
+    except Exception:
+        return 0
+
+
+class AgentCache:
+    """
+    按 user_id 缓存 Agent 的 LRU
+
+    - 借出（checkout）期间条目从缓存中移除，保证同一个 Agent 不会被并发使用
+    - 归还（checkin）时重新估算大小，超过内存预算或数量上限时按 LRU 淘汰
+    - 空闲超过 idle_ttl 的 Agent 由后台线程定期淘汰（访问缓存时也会检查）
+    - 淘汰时将 Agent 状态同步到会话存储，之后的请求会从会话文件恢复
+
+    checkout / checkin 会估算会话大小（序列化消息）并同步被淘汰的会话（写文件），都是阻塞调用，
+    在事件循环中应通过 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, max_bytes: int = None, max_agents: int = None, idle_ttl: int = None,
+                 reap_interval: int = None):
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('AGENT_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+        self.max_agents = max_agents if max_agents is not None else int(os.getenv('AGENT_CACHE_MAX_AGENTS', 200))
+        self.idle_ttl = idle_ttl if idle_ttl is not None else int(os.getenv('AGENT_CACHE_IDLE_TTL', 1800))
+        self.reap_interval = reap_interval if reap_interval is not None else int(os.getenv('AGENT_CACHE_REAP_INTERVAL', 60))
+        self.enabled = self.max_agents > 0
+
+        self._stop_event = threading.Event()
+        self._reaper = None
+        self._entries: "OrderedDict[str, _CachedAgent]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def start(self):
+        """启动后台线程，定期淘汰空闲超时的 Agent（没有请求时也能释放内存并写回会话存储）"""
+        if not self.enabled or (self._reaper and self._reaper.is_alive()):
+            return
+        self._stop_event.clear()
+        self._reaper = threading.Thread(target=self._run, name='agent-cache-reaper', daemon=True)
+        self._reaper.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.reap_interval):
+            try:
+                with self._lock:
+                    expired = self._pop_expired()
+                self._flush(expired)
+            except Exception as e:
+                logger.error(f"❌ Agent 缓存维护失败: {str(e)}")
+
+    def checkout(self, user_id: str, tools_version: Any = None):
+        """
+        取出用户的缓存 Agent
+
+        Args:
+            user_id: 用户ID
+            tools_version: 当前工具目录版本，与缓存条目不一致时视为失效
+
+        Returns:
+            缓存的 Agent，不存在时返回 None
+        """
+        if not self.enabled or not user_id:
+            return None
+
+        with self._lock:
+            evicted = self._pop_expired()
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self._total_bytes -= entry.size_bytes
+                if tools_version is not None and entry.tools_version != tools_version:
+                    evicted.append((user_id, entry))
+                    entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        self._flush(evicted)
+        return entry.agent if entry else None
+
+    def checkin(self, user_id: str, agent, session_manager=None, tools_version: Any = None):
+        """归还（或首次放入）用户的 Agent"""
+        if not self.enabled or not user_id or agent is None:
+            return
+
+        entry = _CachedAgent(agent, session_manager or getattr(agent, '_session_manager', None), tools_version)
+        entry.size_bytes = estimate_agent_size(agent)
+
+        with self._lock:
+            evicted = self._pop_expired()
+            previous = self._entries.pop(user_id, None)
+            if previous is not None:
+                self._total_bytes -= previous.size_bytes
+                if previous.agent is not agent:
+                    evicted.append((user_id, previous))
+            self._entries[user_id] = entry
+            self._total_bytes += entry.size_bytes
+
+            # 超过数量上限或内存预算时，从最久未使用的一端淘汰
+            while self._entries and (len(self._entries) > self.max_agents or self._total_bytes > self.max_bytes):
+                old_user_id, old_entry = self._entries.popitem(last=False)
+                self._total_bytes -= old_entry.size_bytes
+                evicted.append((old_user_id, old_entry))
+
+        self._flush(evicted)
+
+    def discard(self, user_id: str):
+        """丢弃用户的缓存 Agent，不写回会话存储（用于清除会话）"""
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self._total_bytes -= entry.size_bytes
+
+    def _pop_expired(self):
+        """在持有锁的情况下取出空闲超时的条目"""
+        expired = []
+        now = time.monotonic()
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if now - entry.last_used < self.idle_ttl:
+                break
+            self._entries.popitem(last=False)
+            self._total_bytes -= entry.size_bytes
+            expired.append((user_id, entry))
+        return expired
+
+    def _flush(self, evicted):
+        """将被淘汰的 Agent 状态同步到会话存储"""
+        for user_id, entry in evicted:
+            self.evictions += 1
+            session_manager = entry.session_manager
+            if session_manager is not None and hasattr(session_manager, 'sync_agent'):
+                try:
+                    session_manager.sync_agent(entry.agent)
+                except Exception as e:
+                    logger.error(f"⚠️ 淘汰 Agent 时同步会话失败 (session_id: {user_id}): {str(e)}")
+            logger.debug(f"🧹 已从缓存淘汰用户 {user_id} 的 Agent")
+
+    def close(self):
+        """停止后台线程并淘汰所有缓存的 Agent（服务停止时调用）"""
+        self._stop_event.set()
+        with self._lock:
+            evicted = list(self._entries.items())
+            self._entries.clear()
+            self._total_bytes = 0
+        self._flush(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "agents": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "max_agents": self.max_agents,
+                "idle_ttl": self.idle_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
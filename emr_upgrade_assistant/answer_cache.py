@@ -0,0 +1,288 @@
+"""
+回答缓存 - 对重复出现的 EMR 升级问题直接返回已生成的回答
+
+先按规范化后的问题文本精确匹配，未命中时计算问题的向量，与缓存中问题的向量比较，
+相似度超过阈值即视为命中。缓存条目记录生成时知识库索引的版本，索引重建后全部失效。
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from metrics import metrics
+
+# 与 MCP Server 共用的工具位于项目根目录的 common 包中
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.knowledge import extract_query_entities, normalize_query, read_index_version_file
+
+logger = logging.getLogger('emr_assistant')
+
+
+class CachedAnswer:
+    """缓存条目"""
+
+    __slots__ = ('query', 'answer', 'embedding', 'entities', 'index_version', 'created_at', 'hits', 'similarity')
+
+    def __init__(self, query: str, answer: str, embedding, index_version: Optional[str]):
+        self.query = query
+        self.answer = answer
+        # 归一化后的问题向量（numpy float32），没有向量时为 None
+        self.embedding = embedding
+        self.entities = query_entities(query)
+        self.index_version = index_version
+        self.created_at = time.time()
+        self.hits = 0
+        # 最近一次命中时的相似度（精确匹配为 1.0）
+        self.similarity = 1.0
+
+
+def query_entities(query: str) -> Tuple[Tuple[Tuple[int, int], ...], Tuple[str, ...]]:
+    """问题中提到的 EMR 版本和组件，语义命中时必须与缓存条目完全一致"""
+    ranges, components = extract_query_entities(query)
+    return tuple(sorted(ranges)), tuple(sorted(components))
+
+
+def _normalize(vector: List[float]):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class BedrockEmbedder:
+    """使用 Bedrock Titan Embeddings 计算问题向量"""
+
+    def __init__(self, model_id: str = None, dimensions: int = None, region_name: str = None):
+        self.model_id = model_id or os.getenv('ANSWER_CACHE_EMBEDDING_MODEL', 'amazon.titan-embed-text-v2:0')
+        self.dimensions = dimensions or int(os.getenv('ANSWER_CACHE_EMBEDDING_DIMS', 1024))
+        self.region_name = region_name or os.getenv('BEDROCK_REGION', 'us-east-1')
+        self._client = None
+
+    def __call__(self, text: str) -> List[float]:
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('bedrock-runtime', region_name=self.region_name)
+        response = self._client.invoke_model(
+            modelId=self.model_id,
+            body=json.dumps({"inputText": text, "dimensions": self.dimensions, "normalize": True})
+        )
+        return json.loads(response['body'].read())['embedding']
+
+
+class AnswerCache:
+    """
+    问题 -> 回答的语义缓存
+
+    配置项（环境变量）：
+    - ANSWER_CACHE_ENABLED: 是否启用（默认 true）
+    - ANSWER_CACHE_SIMILARITY: 向量相似度阈值，超过该值视为同一个问题
+    - ANSWER_CACHE_TTL: 回答的有效期（秒）
+    - ANSWER_CACHE_MAX_ENTRIES: 最多缓存的回答数量，超出时淘汰最久未命中的条目
+    - ANSWER_CACHE_MIN_QUERY_CHARS: 参与缓存的问题最短长度，过短的问题通常依赖上下文
+
+    语义匹配需要安装 numpy：缓存问题的向量按行归一化为 float32 矩阵，一次矩阵乘法得到全部相似度；
+    未安装时只做精确匹配。
+    - KNOWLEDGE_INDEX_VERSION_FILE: 知识库索引版本标记文件，版本变化时清空缓存
+    - KNOWLEDGE_INDEX_CHECK_INTERVAL: 检查索引版本的最短间隔（秒）
+    """
+
+    def __init__(self, embedder: Optional[Callable[[str], List[float]]] = None,
+                 index_version_source: Optional[Callable[[], Optional[str]]] = None):
+        self.enabled = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+        self.similarity_threshold = float(os.getenv('ANSWER_CACHE_SIMILARITY', 0.95))
+        self.ttl = int(os.getenv('ANSWER_CACHE_TTL', 86400))
+        self.max_entries = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 500))
+        self.min_query_chars = int(os.getenv('ANSWER_CACHE_MIN_QUERY_CHARS', 8))
+        self.index_check_interval = int(os.getenv('KNOWLEDGE_INDEX_CHECK_INTERVAL', 30))
+
+        self.embedder = embedder if embedder is not None else BedrockEmbedder()
+        self.index_version_source = index_version_source or read_index_version_file
+
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        # (键列表, 条目列表, 向量矩阵) 快照，条目变化时置空，下次语义匹配时重建
+        self._matrix: Optional[tuple] = None
+        self._lock = threading.Lock()
+        self.index_version: Optional[str] = None
+        self._index_checked_at = 0.0
+        self._index_version_loaded = False
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _cacheable(self, normalized: str) -> bool:
+        return self.enabled and len(normalized) >= self.min_query_chars
+
+    def _check_index_version(self):
+        """索引版本变化时清空缓存（按间隔检查，避免每次都读取标记）"""
+        now = time.monotonic()
+        if self._index_version_loaded and now - self._index_checked_at < self.index_check_interval:
+            return
+        self._index_checked_at = now
+        try:
+            version = self.index_version_source()
+        except Exception as e:
+            logger.warning(f"⚠️ 读取知识库索引版本失败: {str(e)}")
+            return
+        if not self._index_version_loaded:
+            self._index_version_loaded = True
+            self.index_version = version
+        elif version != self.index_version:
+            self.invalidate(version, reason=f"知识库索引版本变化 ({self.index_version} -> {version})")
+
+    def _embed(self, text: str) -> Optional[List[float]]:
+        try:
+            return self.embedder(text)
+        except Exception as e:
+            logger.warning(f"⚠️ 计算问题向量失败，仅使用精确匹配: {str(e)}")
+            metrics.incr("answer_cache.embedding_error")
+            return None
+
+    def _is_valid(self, entry: CachedAnswer, now: float) -> bool:
+        return entry.index_version == self.index_version and now - entry.created_at < self.ttl
+
+    def lookup_exact(self, query: str) -> Optional[CachedAnswer]:
+        """只在内存中查找规范化后完全相同的问题，不计算向量，未命中时不计入 misses"""
+        normalized = normalize_query(query)
+        if not self._cacheable(normalized):
+            return None
+
+        self._check_index_version()
+        with self._lock:
+            entry = self._entries.get(normalized)
+            if entry is not None and not self._is_valid(entry, time.time()):
+                self._entries.pop(normalized, None)
+                self._matrix = None
+                entry = None
+            if entry is None:
+                return None
+            entry.similarity = 1.0
+            return self._hit(normalized, entry)
+
+    def embed(self, query: str) -> Optional[List[float]]:
+        """计算问题向量（阻塞调用），可与 Agent 启动阶段并发执行；不参与缓存的问题返回 None"""
+        normalized = normalize_query(query)
+        if np is None or not self._cacheable(normalized):
+            return None
+        return self._embed(normalized)
+
+    def lookup_similar(self, query: str, embedding: Optional[List[float]]) -> Optional[CachedAnswer]:
+        """使用已计算的问题向量查找语义相同的问题（只在内存中比较）"""
+        normalized = normalize_query(query)
+        if not self._cacheable(normalized):
+            return None
+
+        self._check_index_version()
+        if embedding is not None and np is not None:
+            with self._lock:
+                snapshot = self._vector_snapshot()
+            if snapshot is not None:
+                keys, entries, matrix = snapshot
+                # 矩阵乘法在锁外进行，不阻塞 store() 和 lookup_exact()
+                scores = matrix @ _normalize(embedding)
+                # 向量相似但版本或组件不同的问题（如 "emr 6.10 升级 spark" 与 "emr 6.12 升级 spark"）不能共用回答
+                entities = query_entities(query)
+                now = time.time()
+                for i in np.argsort(-scores):
+                    if scores[i] < self.similarity_threshold:
+                        break
+                    entry = entries[i]
+                    if entry.entities != entities:
+                        continue
+                    with self._lock:
+                        if self._entries.get(keys[i]) is entry and self._is_valid(entry, now):
+                            entry.similarity = float(scores[i])
+                            return self._hit(keys[i], entry)
+
+        self.misses += 1
+        metrics.incr("answer_cache.miss")
+        return None
+
+    def lookup(self, query: str) -> Tuple[Optional[CachedAnswer], Optional[List[float]]]:
+        """
+        查找问题的缓存回答：先精确匹配，未命中时计算向量再做语义匹配
+
+        Returns:
+            (命中的条目或 None, 问题向量) 元组；问题向量可在生成回答后传给 store() 复用
+        """
+        entry = self.lookup_exact(query)
+        if entry is not None:
+            return entry, None
+        embedding = self.embed(query)
+        return self.lookup_similar(query, embedding), embedding
+
+    def _vector_snapshot(self) -> Optional[tuple]:
+        """在持有锁的情况下返回带向量的条目及其向量矩阵，没有时返回 None"""
+        if self._matrix is None:
+            items = [(key, entry) for key, entry in self._entries.items() if entry.embedding is not None]
+            if not items:
+                return None
+            keys, entries = zip(*items)
+            self._matrix = (keys, entries, np.vstack([entry.embedding for entry in entries]))
+        return self._matrix
+
+    def _hit(self, key: str, entry: CachedAnswer) -> CachedAnswer:
+        """在持有锁的情况下记录命中"""
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        self.hits += 1
+        metrics.incr("answer_cache.hit")
+        logger.info(f"🎯 回答缓存命中 (相似度 {entry.similarity:.3f}): {entry.query[:50]}")
+        return entry
+
+    def store(self, query: str, answer: str, embedding: Optional[List[float]] = None):
+        """
+        缓存问题的回答
+
+        只应缓存不依赖用户个人上下文（历史记忆、会话历史）生成的回答
+        """
+        normalized = normalize_query(query)
+        if not answer or not self._cacheable(normalized):
+            return
+
+        self._check_index_version()
+        vector = _normalize(embedding) if embedding is not None and np is not None else None
+        with self._lock:
+            self._entries.pop(normalized, None)
+            self._entries[normalized] = CachedAnswer(query, answer, vector, self.index_version)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+        logger.debug(f"💾 已缓存问题的回答: {query[:50]}")
+
+    def invalidate(self, index_version: Optional[str] = None, reason: str = "手动清空"):
+        """清空缓存；指定 index_version 时同时更新当前索引版本"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._matrix = None
+            if index_version is not None:
+                self.index_version = index_version
+        self.invalidations += 1
+        metrics.incr("answer_cache.invalidation")
+        logger.info(f"🧹 回答缓存已清空 ({reason})，共 {count} 条")
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "semantic": np is not None,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "similarity_threshold": self.similarity_threshold,
+                "ttl": self.ttl,
+                "index_version": self.index_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
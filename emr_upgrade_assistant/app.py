@@ -7,6 +7,9 @@ from quart import Quart, render_template, request, jsonify, Response, session
 import sys
 import json
 import asyncio
+import re
+import time
+from contextlib import aclosing
 from typing import Dict, Any
 from dotenv import load_dotenv
 import uuid
@@ -16,11 +19,24 @@ from logging.handlers import RotatingFileHandler
 
 # 根据官方文档导入 Strands Agents 和 MCP 相关模块
 from mcp import stdio_client, StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
 from strands import Agent
 from strands.session.file_session_manager import FileSessionManager
 from strands.tools.mcp import MCPClient
-from mem0_integration import create_mem0_integration
-from mem0_tools import mem0_tools
+from mcp_pool import MCPPoolManager
+from tool_catalog import ToolCatalog
+from tool_memo import ToolMemoStore
+from metrics import metrics
+from agent_cache import AgentCache
+from sse_protocol import SSEEncoder, placeholder_event, resolve_protocol
+from stream_registry import StreamRegistry
+from admission import AdmissionController, AdmissionRejected
+from answer_cache import AnswerCache
+from memory_writer import MemoryWriter
+from event_mux import multiplex_events, HEARTBEAT, SLOW, DEADLINE
+from mem0_integration import create_mem0_integration, mem0_status, memory_vector_cache, embedding_cache
+from mem0_tools import mem0_tools, set_current_user_mem0
 from strands.models import BedrockModel
 
 # 创建日志目录
@@ -66,6 +82,10 @@ def setup_logger():
 # 初始化日志记录器
 logger = setup_logger()
 
+def _is_otel_context_error(error: BaseException) -> bool:
+    """判断是否为可以忽略的 OpenTelemetry 上下文错误"""
+    return isinstance(error, ValueError) and "was created in a different Context" in str(error)
+
 # 尝试导入会话管理模块，如果不可用则使用兼容模式
 try:
     from strands.session.file_session_manager import FileSessionManager
@@ -106,11 +126,27 @@ class EMRUpgradeAssistant:
         try:
             # 不在初始化时创建 mem0 实例，而是在每次请求时创建
             self.mem0 = None
+            self.mcp_pools = None
+            self.tool_catalog = None
+            # 按 user_id 缓存活跃会话的 Agent（LRU + 内存预算 + 空闲过期）
+            self.agent_cache = AgentCache()
+            self.agent_cache.start()
+            # 重复问题的语义回答缓存，知识库索引重建后失效
+            self.answer_cache = AnswerCache()
+            # 长期记忆在后台批量写入，不占用请求的响应时间
+            self.memory_writer = MemoryWriter()
+            self.memory_writer.start()
             
             logger.info("🚀 开始初始化 EMR 升级助手...")
 
             self.bedrock_region = os.getenv('BEDROCK_REGION', 'us-east-1')
             self.bedorck_model = os.getenv('BEDROCK_MODEL_ID', 'us-east-1')
+            self.bedrock_prompt_cache = os.getenv('BEDROCK_PROMPT_CACHE', 'true').lower() == 'true'
+
+            # 流式响应的心跳间隔、软超时（只提示）和硬超时（中止生成），单位：秒
+            self.heartbeat_interval = float(os.getenv('STREAM_HEARTBEAT_INTERVAL', 5))
+            self.stream_soft_timeout = float(os.getenv('STREAM_SOFT_TIMEOUT', 240))
+            self.stream_hard_timeout = float(os.getenv('STREAM_HARD_TIMEOUT', 300))
             
             # 根据官方文档配置 MCP 客户端
             # 参考: https://strandsagents.com/latest/user-guide/concepts/tools/mcp-tools/
@@ -128,25 +164,35 @@ class EMRUpgradeAssistant:
             else:
                 logger.info("⚠️ 会话管理不可用，将使用兼容模式")
             
-            # 创建多个 MCP 客户端
-            # 1. 主 MCP 服务器
-            self.mcp_client = MCPClient(lambda: stdio_client(
-                StdioServerParameters(
-                    command="uv",
-                    args=["--directory", mcp_server_dir, "run", "app.py"]
-                )
-            ))
+            # 创建多个 MCP 客户端连接池，请求从池中借用已初始化的会话，避免每次请求都启动子进程
+            self.mcp_pools = MCPPoolManager()
+
+            # 1. 主 MCP 服务器：配置了 MCP_MAIN_SERVER_URL 时连接共享的知识库检索服务，否则以子进程方式启动
+            main_server_url = os.getenv('MCP_MAIN_SERVER_URL')
+            if main_server_url:
+                if main_server_url.rstrip('/').endswith('/sse'):
+                    self.mcp_pools.register('main', lambda: MCPClient(lambda: sse_client(main_server_url)))
+                else:
+                    self.mcp_pools.register('main', lambda: MCPClient(lambda: streamablehttp_client(main_server_url)))
+                logger.info(f"📡 主 MCP 服务器: {main_server_url}")
+            else:
+                self.mcp_pools.register('main', lambda: MCPClient(lambda: stdio_client(
+                    StdioServerParameters(
+                        command="uv",
+                        args=["--directory", mcp_server_dir, "run", "app.py"]
+                    )
+                )))
             
             # 2. langgraph-crawler MCP 服务器 - 用于网页搜索和内容抓取
-            self.langgraph_crawler_client = MCPClient(lambda: stdio_client(
+            self.mcp_pools.register('crawler', lambda: MCPClient(lambda: stdio_client(
                 StdioServerParameters(
                     command="npx",
                     args=["-y", "@langgraph-js/crawler-mcp@latest"]
                 )
-            ))
+            )))
             
             # 3. AWS Documentation MCP 服务器 - 用于查询 AWS 文档
-            self.aws_docs_client = MCPClient(lambda: stdio_client(
+            self.mcp_pools.register('aws_docs', lambda: MCPClient(lambda: stdio_client(
                 StdioServerParameters(
                     command="uvx",
                     args=["awslabs.aws-documentation-mcp-server@latest"],
@@ -155,7 +201,22 @@ class EMRUpgradeAssistant:
                         "AWS_DOCUMENTATION_PARTITION": "aws"
                     }
                 )
-            ))
+            )))
+
+            # 后台预热连接池并定期回收空闲客户端
+            self.mcp_pools.start()
+
+            # 工具目录缓存：合并好的 MCP 工具 + mem0 工具，按 TTL 或服务器重启在后台刷新
+            self.tool_catalog = ToolCatalog(
+                self.mcp_pools,
+                servers=['main', 'crawler', 'aws_docs'],
+                static_tools=mem0_tools,
+                required=['main'],
+                # 网页抓取、网络搜索和 AWS 文档工具的结果按参数缓存，多个 worker 共享
+                tool_memo=ToolMemoStore(),
+                memo_servers=['crawler', 'aws_docs']
+            )
+            self.tool_catalog.start()
             
             logger.info("✅ MCP 客户端初始化成功")
             logger.debug(f"📡 MCP Server 目录: {mcp_server_dir}")
@@ -199,7 +260,8 @@ class EMRUpgradeAssistant:
 1. 如果需要最新的信息，请使用 mcp_langgraph_crawler_web_search_tool 工具搜索互联网上的最新信息
 2. 如果需要查看特定网页的内容，请使用 mcp_langgraph_crawler_crawl_tool 工具抓取跟 Apache 社区官方相关的网页内容，包括不限于 [hive/spark/flink/hbase/hadoop/sqoop/tez/iceberg].apache.org issues.apache.org，stackoverflow.com
 3. 如果需要查询 AWS 官方文档，请使用 AWS 文档工具（如 aws_docs_search）获取准确的 AWS 服务信息
-4. 如果需要本地知识库信息，请使用 search_context 工具检索相关信息
+4. 如果需要本地知识库信息，请使用 search_context 工具检索相关信息；问题涉及多个组件或多个子问题时，使用 search_context_batch 工具一次检索所有子问题
+5. 如果需要查询某个 EMR 版本包含的组件版本，或对比两个 EMR 版本之间的组件版本变化，优先使用 emr_release_components 和 emr_release_diff 工具，结果准确且速度快
 
 然后基于检索结果提供专业的回答。
 
@@ -294,15 +356,10 @@ class EMRUpgradeAssistant:
         if current_chunk.strip():
             chunks.append(current_chunk)
         
-        accumulated = ""
-        
         for chunk in chunks:
-            accumulated += chunk
-            
             yield {
                 "type": "content",
                 "content": chunk,
-                "accumulated": accumulated,
                 "timestamp": datetime.now().isoformat()
             }
             
@@ -318,7 +375,7 @@ class EMRUpgradeAssistant:
         """
         try:
             logger.debug(f"🔧 [简化版] 开始处理查询: {user_query}")
-            logger.debug(f"🔧 [简化版] MCP Client 状态: {self.mcp_client is not None}")
+            logger.debug(f"🔧 [简化版] MCP 连接池状态: {self.mcp_pools is not None}")
             
             # 直接返回一个测试响应
             test_response = f"收到您的问题：{user_query}\n\n这是一个测试响应，用于验证流式输出是否正常工作。"
@@ -365,12 +422,228 @@ class EMRUpgradeAssistant:
                 # 重新抛出其他 ValueError
                 raise
 
+    @staticmethod
+    def _elapsed_ms(start: float) -> float:
+        """返回从 start 到现在经过的毫秒数"""
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    async def _run_phase(self, phase_timings: Dict[str, float], phase: str, func, *args):
+        """在线程池中执行一个阻塞的启动阶段，并记录其耗时"""
+        start = time.perf_counter()
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            phase_timings[phase] = self._elapsed_ms(start)
+
+    def _record_phase_timings(self, phase_timings: Dict[str, float]):
+        """将各阶段耗时写入全局指标，并计算并发带来的节省"""
+        for phase, value in phase_timings.items():
+            metrics.observe(f"phase.{phase}", value)
+        sequential = sum(phase_timings.get(p, 0.0) for p in ('tools', 'memory', 'model', 'embedding', 'agent'))
+        phase_timings['sequential_estimate'] = round(sequential, 1)
+        logger.info(f"⏱️ 启动阶段耗时(ms): {phase_timings}")
+
+    def _create_bedrock_model(self):
+        """创建 BedrockModel，失败时返回 None 以便回退到默认模型"""
+        logger.debug("🔧 开始创建 BedrockModel...")
+        try:
+            model_config = {}
+            if self.bedrock_prompt_cache:
+                # 在 system prompt 和工具定义之后设置缓存检查点，静态前缀每个缓存窗口只计费和处理一次
+                model_config['cache_prompt'] = 'default'
+                model_config['cache_tools'] = 'default'
+            bedrock_model = BedrockModel(
+                model_id=self.bedorck_model,
+                region_name=self.bedrock_region,
+                temperature=0.3,
+                **model_config
+            )
+            logger.debug("✅ BedrockModel 创建成功")
+            return bedrock_model
+        except Exception as bedrock_error:
+            import traceback
+            logger.error(f"❌ BedrockModel 创建失败: {str(bedrock_error)}")
+            logger.error(f"BedrockModel 错误堆栈:\n{traceback.format_exc()}")
+            return None
+
+    def _cached_answer_events(self, cached):
+        """将缓存的回答按段落拆分为与实时生成相同格式的 content 事件，并标记 cached"""
+        yield {
+            "type": "status",
+            "message": "[找到相同问题的已有回答]",
+            "cached": True,
+            "similarity": round(cached.similarity, 4),
+            "timestamp": datetime.now().isoformat()
+        }
+        for chunk in re.split(r'(?<=\n)', cached.answer):
+            if chunk:
+                yield {
+                    "type": "content",
+                    "content": chunk,
+                    "cached": True,
+                    "timestamp": datetime.now().isoformat()
+                }
+
+    async def _serve_cached_answer(self, cached, user_id: str, user_query: str, agent, session_manager,
+                                   cacheable: bool, user_mem0):
+        """
+        返回缓存的回答，并像正常生成一样记录这一轮对话
+
+        回答先发送给客户端；之后把这一轮写入用户的会话历史并放入长期记忆写入队列，后续追问能看到这轮问答
+        """
+        for event in self._cached_answer_events(cached):
+            yield event
+
+        try:
+            self._append_turn(agent, f"用户问题: {user_query}", cached.answer)
+            if cacheable:
+                await asyncio.to_thread(self.agent_cache.checkin, user_id, agent, session_manager, self.tool_catalog.version)
+        except Exception as session_error:
+            logger.error(f"⚠️ 缓存回答写入会话历史失败: {str(session_error)}")
+
+        if user_mem0.enabled:
+            self.memory_writer.submit(
+                user_id,
+                user_mem0,
+                user_query=user_query,
+                response=cached.answer,
+                metadata={
+                    "user_id": user_id,
+                    "response_length": len(cached.answer),
+                    "cached": True
+                }
+            )
+
+    def _append_turn(self, agent, user_message: str, answer: str):
+        """把一轮问答追加到 Agent 的会话历史；带会话管理器的 Agent 通过消息事件同时持久化"""
+        append = getattr(agent, '_append_message', None) or agent.messages.append
+        append({"role": "user", "content": [{"text": user_message}]})
+        append({"role": "assistant", "content": [{"text": answer}]})
+
+    def _load_memory_context(self, user_id: str, user_query: str):
+        """创建用户的 mem0 实例并检索与查询相关的历史上下文"""
+        user_mem0 = create_mem0_integration(user_id)
+        historical_context = user_mem0.get_context_for_query(user_query)
+        return user_mem0, historical_context
+
+    def _create_agent(self, user_id: str, all_tools, bedrock_model):
+        """
+        创建 Agent，优先使用 BedrockModel 和会话管理器，失败时逐级回退
+
+        Returns:
+            (agent, session_manager, cacheable) 元组，只有完整配置的 Agent 才允许缓存
+        """
+        session_manager = None
+        # 系统指令只作为 system prompt 传入一次，不再拼接到每轮用户消息中
+        system_prompt = self._get_instructions()
+        try:
+            if bedrock_model is None:
+                raise RuntimeError("BedrockModel 创建失败")
+            
+            # 根据会话管理可用性决定如何创建 Agent
+            if SESSION_MANAGEMENT_AVAILABLE:
+                # 创建 Strands 会话管理器 - 用于短期记忆
+                logger.debug(f"🔄 为用户 {user_id} 创建会话管理器")
+                try:
+                    session_manager = FileSessionManager(
+                        session_id=user_id,
+                        storage_dir=self.sessions_dir
+                    )
+                    logger.debug(f"✅ 会话管理器创建成功: session_id={user_id}")
+                except Exception as session_error:
+                    import traceback
+                    logger.error(f"❌ 会话管理器创建失败: {str(session_error)}")
+                    logger.error(f"会话管理器错误堆栈:\n{traceback.format_exc()}")
+                    raise  # 重新抛出异常
+                
+                # 创建 Agent 时使用会话管理器
+                logger.debug("🔧 开始创建带会话管理的 Agent...")
+                try:
+                    agent = Agent(
+                        tools=all_tools,
+                        callback_handler=None,
+                        session_manager=session_manager,  # 添加会话管理器
+                        model=bedrock_model,
+                        system_prompt=system_prompt
+                    )
+                    logger.debug("✅ 成功创建使用 Agent 并配置会话管理")
+                except Exception as agent_error:
+                    import traceback
+                    logger.error(f"❌ 创建带会话管理的 Agent 失败: {str(agent_error)}")
+                    logger.error(f"Agent 创建错误堆栈:\n{traceback.format_exc()}")
+                    raise  # 重新抛出异常
+            else:
+                # 不使用会话管理器创建 Agent
+                logger.debug("🔧 开始创建不带会话管理的 Agent...")
+                try:
+                    agent = Agent(
+                        tools=all_tools,
+                        callback_handler=None,
+                        model=bedrock_model,
+                        system_prompt=system_prompt
+                    )
+                    logger.debug("✅ 成功创建使用 Agent (无会话管理)")
+                except Exception as agent_error:
+                    import traceback
+                    logger.error(f"❌ 创建不带会话管理的 Agent 失败: {str(agent_error)}")
+                    logger.error(f"Agent 创建错误堆栈:\n{traceback.format_exc()}")
+                    raise  # 重新抛出异常
+            return agent, session_manager, True
+        except Exception as model_error:
+            import traceback
+            logger.error(f"⚠️ 使用 Claude 4.0 Sonnet 创建 Agent 失败: {str(model_error)}")
+            logger.error(f"详细错误堆栈:\n{traceback.format_exc()}")
+            logger.error("尝试使用默认模型创建 Agent")
+            
+            # 根据会话管理可用性决定如何创建 Agent
+            try:
+                if SESSION_MANAGEMENT_AVAILABLE:
+                    # 创建会话管理器但使用默认模型
+                    logger.debug(f"🔄 为用户 {user_id} 创建备用会话管理器")
+                    try:
+                        session_manager = FileSessionManager(
+                            session_id=user_id,
+                            storage_dir=self.sessions_dir
+                        )
+                        logger.debug(f"✅ 备用会话管理器创建成功")
+                    except Exception as session_error:
+                        import traceback
+                        logger.error(f"❌ 备用会话管理器创建失败: {str(session_error)}")
+                        logger.error(f"备用会话管理器错误堆栈:\n{traceback.format_exc()}")
+                        raise  # 重新抛出异常
+                    
+                    logger.debug("🔧 开始创建带会话管理的备用 Agent...")
+                    agent = Agent(
+                        tools=all_tools, 
+                        callback_handler=None,
+                        session_manager=session_manager,  # 添加会话管理器
+                        system_prompt=system_prompt
+                    )
+                    logger.debug("✅ 成功创建带会话管理的备用 Agent")
+                else:
+                    # 不使用会话管理器创建 Agent
+                    logger.debug("🔧 开始创建不带会话管理的备用 Agent...")
+                    agent = Agent(
+                        tools=all_tools, 
+                        callback_handler=None,
+                        system_prompt=system_prompt
+                    )
+                    logger.debug("✅ 成功创建不带会话管理的备用 Agent")
+            except Exception as fallback_error:
+                import traceback
+                logger.error(f"❌ 创建备用 Agent 失败: {str(fallback_error)}")
+                logger.error(f"备用 Agent 错误堆栈:\n{traceback.format_exc()}")
+                # 最后的尝试 - 创建一个没有任何额外配置的基本 Agent
+                logger.error("🔄 最后尝试创建基本 Agent...")
+                agent = Agent(system_prompt=system_prompt)
+        return agent, session_manager, False
+
     async def process_query_stream(self, user_query: str, user_id: str = None):
         """
         流式处理用户查询 - 使用 Strands Agent 真正的流式响应
         保证 LLM 内容和 MCP Server 工具内容都能流式返回到页面，并在后台打印。
         """
-        if not self.mcp_client:
+        if not self.tool_catalog:
             yield {
                 "type": "error",
                 "error": "MCP 客户端未正确初始化，请检查安装和配置",
@@ -381,223 +654,146 @@ class EMRUpgradeAssistant:
         try:
             logger.debug(f"📝 开始流式处理用户查询: {user_query}")
             
-            # 获取主MCP服务器的工具
-            with self.mcp_client:
-                mcp_tools = self.mcp_client.list_tools_sync()
-                logger.debug(f"🔧 获取到 {len(mcp_tools)} 个主MCP工具")
-            
-            # 获取langgraph-crawler MCP服务器的工具
-            crawler_tools = []
-            try:
-                with self.langgraph_crawler_client:
-                    crawler_tools = self.langgraph_crawler_client.list_tools_sync()
-                    logger.debug(f"🔧 获取到 {len(crawler_tools)} 个langgraph-crawler工具")
-            except Exception as crawler_error:
-                logger.error(f"⚠️ 获取langgraph-crawler工具失败: {str(crawler_error)}")
+            phase_timings = {}
+            startup_start = time.perf_counter()
             
-            # 获取AWS文档MCP服务器的工具
-            aws_docs_tools = []
-            try:
-                with self.aws_docs_client:
-                    aws_docs_tools = self.aws_docs_client.list_tools_sync()
-                    logger.debug(f"🔧 获取到 {len(aws_docs_tools)} 个AWS文档工具")
-            except Exception as aws_docs_error:
-                logger.error(f"⚠️ 获取AWS文档工具失败: {str(aws_docs_error)}")
+            # 活跃会话直接复用缓存的 Agent，跳过模型/Agent 构建和会话历史加载
+            # 问题向量（用于语义缓存）与启动阶段并发计算，缓存未命中时不增加启动耗时
+            # 借出和归还可能淘汰其他用户的 Agent 并同步会话文件，在线程中执行，不阻塞事件循环
+            agent = await asyncio.to_thread(self.agent_cache.checkout, user_id, self.tool_catalog.version)
+            if agent is not None:
+                logger.debug(f"♻️ 复用用户 {user_id} 的缓存 Agent")
+                metrics.incr("agent_cache.hit")
+                session_manager, cacheable = None, True
+                phases = [self._run_phase(phase_timings, 'memory', self._load_memory_context, user_id, user_query)]
+                # 已有会话历史时回答依赖上下文，不使用也不写入回答缓存，不需要计算问题向量
+                if not getattr(agent, 'messages', None):
+                    phases.append(self._run_phase(phase_timings, 'embedding', self.answer_cache.embed, user_query))
+                results = await asyncio.gather(*phases)
+                user_mem0, historical_context = results[0]
+                query_embedding = results[1] if len(results) > 1 else None
+            else:
+                metrics.incr("agent_cache.miss")
+                # 并发执行启动阶段：工具目录、mem0 实例 + 历史上下文、BedrockModel 构建
+                # 启动耗时取决于最慢的依赖，而不是所有依赖耗时之和
+                all_tools, (user_mem0, historical_context), bedrock_model, query_embedding = await asyncio.gather(
+                    self._run_phase(phase_timings, 'tools', self.tool_catalog.get_tools),
+                    self._run_phase(phase_timings, 'memory', self._load_memory_context, user_id, user_query),
+                    self._run_phase(phase_timings, 'model', self._create_bedrock_model),
+                    self._run_phase(phase_timings, 'embedding', self.answer_cache.embed, user_query),
+                )
+                logger.debug(f"🔧 从工具目录获取到 {len(all_tools)} 个工具")
+                
+                agent_start = time.perf_counter()
+                agent, session_manager, cacheable = self._create_agent(user_id, all_tools, bedrock_model)
+                phase_timings['agent'] = self._elapsed_ms(agent_start)
+            phase_timings['startup'] = self._elapsed_ms(startup_start)
+            self._record_phase_timings(phase_timings)
+            yield {
+                "type": "timing",
+                "phases": dict(phase_timings),
+                "timestamp": datetime.now().isoformat()
+            }
             
-            # 合并所有工具
-            all_tools = mcp_tools + mem0_tools + crawler_tools + aws_docs_tools
-            logger.debug(f"🔧 总共获取到 {len(all_tools)} 个工具: {len(mcp_tools)}个主MCP工具 + {len(mem0_tools)}个mem0工具 + {len(crawler_tools)}个crawler工具 + {len(aws_docs_tools)}个AWS文档工具")
+            # 只有不依赖用户个人上下文（历史记忆、会话历史）的问题才使用和写入回答缓存，缓存的回答可能来自其他用户
+            context_free = not historical_context and not getattr(agent, 'messages', None)
+            if context_free:
+                # 先精确匹配，再用已计算好的向量做语义匹配（只在内存中比较）
+                cached = self.answer_cache.lookup_exact(user_query)
+                if cached is None:
+                    cached = await asyncio.to_thread(self.answer_cache.lookup_similar, user_query, query_embedding)
+                if cached is not None:
+                    async for event in self._serve_cached_answer(cached, user_id, user_query, agent,
+                                                                 session_manager, cacheable, user_mem0):
+                        yield event
+                    return
             
-            # 使用主MCP客户端的上下文管理器
-            with self.mcp_client:
+            if hasattr(agent, 'model') and hasattr(agent.model, 'config'):
+                logger.debug(f"🔧 使用模型配置: {agent.model.config}")
+            else:
+                logger.warning("⚠️ 无法获取模型配置信息")
+            # 绑定到当前请求的任务上下文，之后创建的 Agent 流式任务和工具线程都会继承该绑定
+            set_current_user_mem0(user_mem0)
+            # 系统指令已作为 Agent 的 system prompt，每轮只发送历史上下文和用户问题
+            if historical_context:
+                full_query = f"{historical_context}\n\n用户问题: {user_query}"
+                logger.debug(f"📚 添加了历史上下文，长度: {len(historical_context)}")
+            else:
+                full_query = f"用户问题: {user_query}"
+            logger.debug(f"🔧 开始 Strands Agent 流式调用...")
+            accumulated_response = ""
+            stream_failed = False
+            async def async_stream():
+                nonlocal accumulated_response, stream_failed
                 try:
-                    logger.debug("🔧 开始创建 BedrockModel...")
+                    # 获取流式响应迭代器
                     try:
-                        bedrock_model = BedrockModel(
-                            model_id=self.bedorck_model,
-                            region_name=self.bedrock_region,
-                            temperature=0.3,
-                        )
-                        logger.debug("✅ BedrockModel 创建成功")
-                    except Exception as bedrock_error:
+                        stream_iterator = agent.stream_async(full_query)
+                        logger.debug("✅ 成功获取流式响应迭代器")
+                    except Exception as stream_error:
+                        logger.error(f"❌ 获取流式响应迭代器失败: {str(stream_error)}")
                         import traceback
-                        logger.error(f"❌ BedrockModel 创建失败: {str(bedrock_error)}")
-                        logger.error(f"BedrockModel 错误堆栈:\n{traceback.format_exc()}")
-                        raise  # 重新抛出异常
+                        logger.error(f"流式响应迭代器错误堆栈:\n{traceback.format_exc()}")
+                        raise
                     
-                    # 根据会话管理可用性决定如何创建 Agent
-                    if SESSION_MANAGEMENT_AVAILABLE:
-                        # 创建 Strands 会话管理器 - 用于短期记忆
-                        logger.debug(f"🔄 为用户 {user_id} 创建会话管理器")
-                        try:
-                            session_manager = FileSessionManager(
-                                session_id=user_id,
-                                storage_dir=self.sessions_dir
-                            )
-                            logger.debug(f"✅ 会话管理器创建成功: session_id={user_id}")
-                        except Exception as session_error:
-                            import traceback
-                            logger.error(f"❌ 会话管理器创建失败: {str(session_error)}")
-                            logger.error(f"会话管理器错误堆栈:\n{traceback.format_exc()}")
-                            raise  # 重新抛出异常
+                    # Agent 事件与独立的计时器合并：按墙钟时间执行软超时（提示）和硬超时（中止）。
+                    # aclosing 保证硬超时 break 时立即取消计时器、消费任务和 Agent 流，而不是等待生成器被回收
+                    async with aclosing(multiplex_events(
+                        stream_iterator,
+                        heartbeat_interval=self.heartbeat_interval,
+                        soft_timeout=self.stream_soft_timeout,
+                        hard_timeout=self.stream_hard_timeout,
+                        ignore_error=_is_otel_context_error
+                    )) as mux_events:
+                        async for kind, event in mux_events:
+                            if kind == HEARTBEAT:
+                                # 连接保活由订阅方（StreamSession.subscribe）的心跳负责，计时器心跳只用于检查软超时
+                                continue
                         
-                        # 创建 Agent 时使用会话管理器
-                        logger.debug("🔧 开始创建带会话管理的 Agent...")
-                        try:
-                            agent = Agent(
-                                tools=all_tools,
-                                callback_handler=None,
-                                session_manager=session_manager,  # 添加会话管理器
-                                model=bedrock_model
-                            )
-                            logger.debug("✅ 成功创建使用 Agent 并配置会话管理")
-                        except Exception as agent_error:
-                            import traceback
-                            logger.error(f"❌ 创建带会话管理的 Agent 失败: {str(agent_error)}")
-                            logger.error(f"Agent 创建错误堆栈:\n{traceback.format_exc()}")
-                            raise  # 重新抛出异常
-                    else:
-                        # 不使用会话管理器创建 Agent
-                        logger.debug("🔧 开始创建不带会话管理的 Agent...")
-                        try:
-                            agent = Agent(
-                                tools=all_tools,
-                                callback_handler=None,
-                                model=bedrock_model
-                            )
-                            logger.debug("✅ 成功创建使用 Agent (无会话管理)")
-                        except Exception as agent_error:
-                            import traceback
-                            logger.error(f"❌ 创建不带会话管理的 Agent 失败: {str(agent_error)}")
-                            logger.error(f"Agent 创建错误堆栈:\n{traceback.format_exc()}")
-                            raise  # 重新抛出异常
-                except Exception as model_error:
-                    import traceback
-                    logger.error(f"⚠️ 使用 Claude 4.0 Sonnet 创建 Agent 失败: {str(model_error)}")
-                    logger.error(f"详细错误堆栈:\n{traceback.format_exc()}")
-                    logger.error("尝试使用默认模型创建 Agent")
-                    
-                    # 根据会话管理可用性决定如何创建 Agent
-                    try:
-                        if SESSION_MANAGEMENT_AVAILABLE:
-                            # 创建会话管理器但使用默认模型
-                            logger.debug(f"🔄 为用户 {user_id} 创建备用会话管理器")
-                            try:
-                                session_manager = FileSessionManager(
-                                    session_id=user_id,
-                                    storage_dir=self.sessions_dir
-                                )
-                                logger.debug(f"✅ 备用会话管理器创建成功")
-                            except Exception as session_error:
-                                import traceback
-                                logger.error(f"❌ 备用会话管理器创建失败: {str(session_error)}")
-                                logger.error(f"备用会话管理器错误堆栈:\n{traceback.format_exc()}")
-                                raise  # 重新抛出异常
-                            
-                            logger.debug("🔧 开始创建带会话管理的备用 Agent...")
-                            agent = Agent(
-                                tools=all_tools, 
-                                callback_handler=None,
-                                session_manager=session_manager  # 添加会话管理器
-                            )
-                            logger.debug("✅ 成功创建带会话管理的备用 Agent")
-                        else:
-                            # 不使用会话管理器创建 Agent
-                            logger.debug("🔧 开始创建不带会话管理的备用 Agent...")
-                            agent = Agent(
-                                tools=all_tools, 
-                                callback_handler=None
-                            )
-                            logger.debug("✅ 成功创建不带会话管理的备用 Agent")
-                    except Exception as fallback_error:
-                        import traceback
-                        logger.error(f"❌ 创建备用 Agent 失败: {str(fallback_error)}")
-                        logger.error(f"备用 Agent 错误堆栈:\n{traceback.format_exc()}")
-                        # 最后的尝试 - 创建一个没有任何额外配置的基本 Agent
-                        logger.error("🔄 最后尝试创建基本 Agent...")
-                        agent = Agent()
-                if hasattr(agent, 'model') and hasattr(agent.model, 'config'):
-                    logger.debug(f"🔧 使用模型配置: {agent.model.config}")
-                else:
-                    logger.warn("⚠️ 无法获取模型配置信息")
-                user_mem0 = create_mem0_integration(user_id)
-                from mem0_tools import set_current_user_mem0
-                set_current_user_mem0(user_mem0)
-                historical_context = user_mem0.get_context_for_query(user_query)
-                system_instructions = self._get_instructions()
-                if historical_context:
-                    full_query = f"{system_instructions}\n\n{historical_context}\n\n用户问题: {user_query}"
-                    logger.debug(f"📚 添加了历史上下文，长度: {len(historical_context)}")
-                else:
-                    full_query = f"{system_instructions}\n\n用户问题: {user_query}"
-                logger.debug(f"🔧 开始 Strands Agent 流式调用...")
-                accumulated_response = ""
-                async def async_stream():
-                    nonlocal accumulated_response
-                    try:
-                        # 设置超时时间（秒）
-                        timeout_seconds = 240  # 增加到240秒
-                        
-                        # 获取流式响应迭代器
-                        try:
-                            stream_iterator = agent.stream_async(full_query)
-                            logger.debug("✅ 成功获取流式响应迭代器")
-                        except Exception as stream_error:
-                            logger.error(f"❌ 获取流式响应迭代器失败: {str(stream_error)}")
-                            import traceback
-                            logger.error(f"流式响应迭代器错误堆栈:\n{traceback.format_exc()}")
-                            raise
-                        
-                        # 初始化心跳计数器
-                        heartbeat_counter = 0
-                        last_heartbeat_time = datetime.now()
+                            if kind == SLOW:
+                                # 超过软超时，发送状态消息但不中断
+                                logger.warning(f"⚠️ 流式响应处理时间较长 ({event:.0f}秒)")
+                                yield {
+                                    "type": "status",
+                                    "message": f"[处理时间较长，可能是网络搜索或分析复杂问题导致，请耐心等待...]",
+                                    "timestamp": datetime.now().isoformat()
+                                }
+                                continue
                         
-                        # 处理流式响应
-                        while True:
-                            # 每5秒发送一次心跳，保持连接活跃
-                            current_time = datetime.now()
-                            if (current_time - last_heartbeat_time).total_seconds() >= 5:
+                            if kind == DEADLINE:
+                                # 超过硬超时，停止生成
+                                stream_failed = True
+                                logger.error(f"❌ 流式响应超时 ({event:.0f}秒)，已停止生成")
                                 yield {
-                                    "type": "heartbeat",
-                                    "timestamp": current_time.isoformat()
+                                    "type": "error",
+                                    "error": f"处理超时（超过 {self.stream_hard_timeout} 秒），请简化问题后重试",
+                                    "timestamp": datetime.now().isoformat()
                                 }
-                                last_heartbeat_time = current_time
-                                heartbeat_counter += 1
-                            
-                            # 等待流式响应或超时
+                                break
+                        
                             try:
-                                # 使用asyncio.wait_for设置超时，但增加超时时间
-                                try:
-                                    event = await asyncio.wait_for(stream_iterator.__anext__(), timeout=10.0)
-                                except ValueError as ve:
-                                    if "was created in a different Context" in str(ve):
-                                        # 忽略 OpenTelemetry 上下文错误并继续
-                                        logger.debug(f"忽略 OpenTelemetry 上下文错误: {str(ve)}")
-                                        continue
-                                    else:
-                                        # 重新抛出其他 ValueError
-                                        raise
-                                
                                 # 处理事件
                                 # LLM 内容流式返回
                                 if "data" in event:
                                     content = event["data"]
                                     if content:
+                                        if not accumulated_response:
+                                            # 记录首个 token 的到达时间（从请求开始计算）
+                                            metrics.observe("phase.first_token", self._elapsed_ms(startup_start))
                                         accumulated_response += content
                                         logger.debug(f"📝 LLM流式内容: {content}")
                                         yield {
                                             "type": "content",
                                             "content": content,
-                                            "accumulated": accumulated_response,
                                             "timestamp": datetime.now().isoformat()
                                         }
-                                
+                            
                                 # 工具调用事件
                                 if "current_tool_use" in event and event["current_tool_use"].get("name"):
                                     tool_name = event["current_tool_use"]["name"]
                                     tool_input = event["current_tool_use"].get("input", {})
                                     logger.debug(f"🔧 工具调用: {tool_name}, 输入: {tool_input}")
-                                    
+                                
                                     # 对网络搜索工具添加特殊处理
                                     if "web_search" in tool_name.lower() or "crawl" in tool_name.lower():
                                         yield {
@@ -611,12 +807,12 @@ class EMRUpgradeAssistant:
                                             "message": f"[使用工具: {tool_name}]",
                                             "timestamp": datetime.now().isoformat()
                                         }
-                                
+                            
                                 # MCP Server 工具返回内容
                                 if "tool_response" in event and event["tool_response"]:
                                     tool_name = event.get("current_tool_use", {}).get("name", "未知工具")
                                     logger.debug(f"🟢 工具 {tool_name} 返回结果")
-                                    
+                                
                                     # 对于网络搜索工具，通知前端搜索完成
                                     if "web_search" in tool_name.lower() or "crawl" in tool_name.lower():
                                         yield {
@@ -624,25 +820,7 @@ class EMRUpgradeAssistant:
                                             "message": f"[网络搜索完成，正在分析结果]",
                                             "timestamp": datetime.now().isoformat()
                                         }
-                                
-                            except StopAsyncIteration:
-                                # 流结束
-                                logger.debug("✅ 流式响应完成")
-                                break
-                                
-                            except asyncio.TimeoutError:
-                                # 超时但不中断流程，继续等待
-                                logger.debug(f"⏱️ 等待流式响应中... ({heartbeat_counter * 10}秒)")
-                                
-                                # 如果超过总超时时间，发送状态消息但不中断
-                                if heartbeat_counter * 10 > timeout_seconds:
-                                    logger.warning(f"⚠️ 流式响应处理时间较长 ({timeout_seconds}秒)")
-                                    yield {
-                                        "type": "status",
-                                        "message": f"[处理时间较长，可能是网络搜索或分析复杂问题导致，请耐心等待...]",
-                                        "timestamp": datetime.now().isoformat()
-                                    }
-                            
+                        
                             except Exception as event_error:
                                 # 处理单个事件的错误，但不中断整个流程
                                 logger.error(f"❌ 处理事件时出错: {str(event_error)}")
@@ -651,39 +829,54 @@ class EMRUpgradeAssistant:
                                     "message": f"[处理过程中遇到问题，但仍在继续...]",
                                     "timestamp": datetime.now().isoformat()
                                 }
-                    except Exception as e:
-                        logger.error(f"❌ 异步流式调用失败: {str(e)}")
-                        import traceback
-                        logger.error(f"错误堆栈: {traceback.format_exc()}")
-                        yield {
-                            "type": "error",
-                            "error": f"处理查询时出错: {str(e)}",
-                            "timestamp": datetime.now().isoformat()
+                    
+                    logger.debug("✅ 流式响应完成")
+                except Exception as e:
+                    stream_failed = True
+                    logger.error(f"❌ 异步流式调用失败: {str(e)}")
+                    import traceback
+                    logger.error(f"错误堆栈: {traceback.format_exc()}")
+                    yield {
+                        "type": "error",
+                        "error": f"处理查询时出错: {str(e)}",
+                        "timestamp": datetime.now().isoformat()
+                    }
+            async for chunk in async_stream():
+                yield chunk
+            # 正常完成的 Agent 放回缓存，供该用户的后续提问复用；出错的 Agent 丢弃，下次从会话存储恢复
+            if cacheable and not stream_failed:
+                await asyncio.to_thread(self.agent_cache.checkin, user_id, agent, session_manager, self.tool_catalog.version)
+            if context_free and accumulated_response and not stream_failed:
+                self.answer_cache.store(user_query, accumulated_response, query_embedding)
+            if accumulated_response and user_mem0.enabled:
+                try:
+                    # 放入长期记忆 (mem0) 写入队列，由后台线程批量写入
+                    self.memory_writer.submit(
+                        user_id,
+                        user_mem0,
+                        user_query=user_query,
+                        response=accumulated_response,
+                        metadata={
+                            "user_id": user_id,
+                            "response_length": len(accumulated_response)
                         }
-                async for chunk in async_stream():
-                    yield chunk
-                if accumulated_response:
-                    try:
-                        # 保存到长期记忆 (mem0)
-                        user_mem0.add_memory(
-                            message="EMR升级咨询对话",
-                            user_query=user_query,
-                            response=accumulated_response,
-                            metadata={
-                                "user_id": user_id,
-                                "response_length": len(accumulated_response)
-                            }
-                        )
-                        logger.debug(f"💾 对话长期记忆已保存到 mem0 {user_id}")
-                        
-                        # 短期记忆处理
-                        if SESSION_MANAGEMENT_AVAILABLE:
-                            # 短期记忆由 Strands 会话管理器自动处理
-                            logger.debug(f"💾 对话短期记忆已由 Strands 会话管理器自动保存 (session_id: {user_id})")
-                        else:
-                            logger.debug(f"⚠️ Strands 会话管理不可用，短期记忆未保存")
-                    except Exception as mem_error:
-                        logger.error(f"⚠️ 保存记忆失败: {str(mem_error)}")
+                    )
+                    logger.debug(f"💾 对话已加入长期记忆写入队列 {user_id}")
+                    
+                    # 短期记忆处理
+                    if SESSION_MANAGEMENT_AVAILABLE:
+                        # 短期记忆由 Strands 会话管理器自动处理
+                        logger.debug(f"💾 对话短期记忆已由 Strands 会话管理器自动保存 (session_id: {user_id})")
+                    else:
+                        logger.debug(f"⚠️ Strands 会话管理不可用，短期记忆未保存")
+                except Exception as mem_error:
+                    logger.error(f"⚠️ 保存记忆失败: {str(mem_error)}")
+        except asyncio.CancelledError:
+            # 客户端断开后生成被取消：Agent 和进行中的工具调用随之终止，不写入长期记忆，
+            # Agent 状态可能不完整，不放回缓存
+            metrics.incr("requests.cancelled")
+            logger.info(f"🛑 用户 {user_id} 的查询已取消，跳过记忆保存")
+            raise
         except Exception as e:
             logger.error(f"❌ 流式处理查询时出错: {str(e)}")
             yield {
@@ -703,7 +896,7 @@ class EMRUpgradeAssistant:
         Returns:
             包含回答和相关信息的字典
         """
-        if not self.mcp_client:
+        if not self.tool_catalog:
             return {
                 "success": False,
                 "error": "MCP 客户端未正确初始化，请检查安装和配置",
@@ -713,41 +906,54 @@ class EMRUpgradeAssistant:
         try:
             logger.info(f"📝 处理用户查询: {user_query}")
             
-            # 根据官方文档，必须在 MCP 客户端的上下文管理器中使用 Agent
-            with self.mcp_client:
-                # 获取 MCP 服务器提供的工具
-                tools = self.mcp_client.list_tools_sync()
-                logger.debug(f"🔧 获取到 {len(tools)} 个 MCP 工具")
-                
-                # 在上下文管理器中创建 Agent
-                # 根据 Strands Agents API，Agent 初始化不接受 instructions 参数
-                agent = Agent(tools=tools)
-                
-                # 构建包含系统指令的完整查询
-                system_instructions = self._get_instructions()
-                full_query = f"{system_instructions}\n\n用户问题: {user_query}"
-                
-                # 使用 Agent 处理查询
-                response = agent(full_query)
-                
-                logger.debug("✅ Strands Agent 处理完成")
-                
-                # 根据官方文档，响应格式可能是字符串或对象
-                if isinstance(response, str):
-                    answer = response
-                    tools_used = []
-                else:
-                    answer = getattr(response, 'content', str(response))
-                    tools_used = getattr(response, 'tools_used', [])
-                
+            cached, query_embedding = await asyncio.to_thread(self.answer_cache.lookup, user_query)
+            if cached is not None:
                 return {
                     "success": True,
-                    "answer": answer,
-                    "tools_used": tools_used,
+                    "answer": cached.answer,
+                    "tools_used": [],
                     "query": user_query,
+                    "cached": True,
                     "timestamp": datetime.now().isoformat()
                 }
             
+            # 从工具目录缓存获取主 MCP 服务器的工具，调用时自动从连接池借用已启动的客户端
+            tools = self.tool_catalog.get_server_tools('main')
+            logger.debug(f"🔧 获取到 {len(tools)} 个 MCP 工具")
+            
+            # 创建 Agent，系统指令通过 system_prompt 传入
+            agent = Agent(tools=tools, system_prompt=self._get_instructions())
+            
+            full_query = f"用户问题: {user_query}"
+            
+            # 使用 Agent 处理查询（异步调用，客户端断开时请求被取消会传递到 Agent 和工具调用）
+            response = await agent.invoke_async(full_query)
+            
+            logger.debug("✅ Strands Agent 处理完成")
+            
+            # 根据官方文档，响应格式可能是字符串或对象
+            if isinstance(response, str):
+                answer = response
+                tools_used = []
+            else:
+                answer = getattr(response, 'content', str(response))
+                tools_used = getattr(response, 'tools_used', [])
+            
+            # 同步接口的 Agent 不带会话历史和记忆上下文，回答可以直接缓存
+            self.answer_cache.store(user_query, answer, query_embedding)
+            
+            return {
+                "success": True,
+                "answer": answer,
+                "tools_used": tools_used,
+                "query": user_query,
+                "timestamp": datetime.now().isoformat()
+            }
+        
+        except asyncio.CancelledError:
+            metrics.incr("requests.cancelled")
+            logger.info(f"🛑 用户 {user_id} 的同步查询已取消")
+            raise
         except Exception as e:
             logger.error(f"❌ 处理查询时出错: {str(e)}")
             return {
@@ -759,6 +965,15 @@ class EMRUpgradeAssistant:
 # 初始化助手
 emr_assistant = EMRUpgradeAssistant()
 
+# 可恢复流式响应的注册表（回放缓冲区）
+stream_registry = StreamRegistry()
+
+# 聊天接口的准入控制（全局并发、等待队列和单用户并发上限）
+admission = AdmissionController()
+
+# 正在处理的 /chat-sync 请求，(user_id, 问题) -> [任务, 等待的请求数]，用于合并重复提交
+_sync_inflight: Dict[Any, list] = {}
+
 @app.route('/')
 async def index():
     """主页 - 生成并存储用户ID"""
@@ -771,18 +986,140 @@ async def index():
     
     return await render_template('index.html')
 
+def _sse_headers(encoder: SSEEncoder, stream) -> Dict[str, str]:
+    """流式响应的公共响应头"""
+    return {
+        'Cache-Control': 'no-cache, no-store, must-revalidate',
+        'Connection': 'keep-alive',
+        'X-Accel-Buffering': 'no',  # 禁用Nginx缓冲
+        'X-SSE-Protocol': str(encoder.protocol),
+        'X-Stream-Id': stream.stream_id,
+        'Transfer-Encoding': 'chunked'  # 使用分块传输编码
+    }
+
+def _stream_response(stream, encoder: SSEEncoder, last_event_id: int = 0) -> Response:
+    """
+    订阅流的回放缓冲区并以 SSE 形式返回
+
+    连接断开只会结束订阅，后台的生成任务继续运行，客户端可以携带 Last-Event-ID 重新连接
+    """
+    async def generate_stream():
+        import sys
+        import os
+        
+        # 强制禁用 Python 的输出缓冲
+        os.environ['PYTHONUNBUFFERED'] = '1'
+        
+        try:
+            logger.debug(f"🔄 开始生成流式响应 (流 {stream.stream_id}, 协议 v{encoder.protocol}, 从序号 {last_event_id} 之后开始)...")
+            
+            # 立即发送心跳和填充数据，强制建立连接
+            yield encoder.encode({'type': 'heartbeat'}, transient=True)
+            
+            # 发送填充数据，强制 Flask 立即发送响应头
+            padding = " " * 1024  # 1KB 填充数据
+            yield encoder.comment(f"padding {padding}")
+            
+            logger.debug("📡 心跳和填充数据已发送，开始订阅流事件...")
+            
+            chunk_count = 0
+            # 客户端断开时 Quart 会关闭本生成器；aclosing 保证订阅立即结束，
+            # 注册表在宽限期内无人重连时取消后台生成
+            async with aclosing(stream.subscribe(last_event_id)) as events:
+                async for seq, chunk in events:
+                    if seq is None:
+                        yield encoder.encode(chunk, transient=True)
+                        continue
+                
+                    chunk_count += 1
+                    logger.debug(f"发送第 {seq} 个数据块: {chunk}")
+                
+                    # 立即发送数据，确保每个块都有完整的 SSE 格式
+                    yield encoder.encode(chunk, seq=seq)
+                
+                    if encoder.legacy:
+                        # 兼容模式下添加小的填充数据确保立即传输
+                        yield encoder.comment(f"chunk-{seq}")
+                
+                    # 强制刷新缓冲区
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+            
+            logger.debug(f"✅ 流式响应完成，共发送 {chunk_count} 个数据块")
+            
+        except Exception as e:
+            import traceback
+            logger.error(f"❌ 流式响应错误: {str(e)}")
+            logger.error(f"错误堆栈: {traceback.format_exc()}")
+            yield encoder.encode({'type': 'error', 'error': str(e)}, transient=True)
+    
+    return Response(
+        generate_stream(), 
+        content_type='text/event-stream',
+        headers=_sse_headers(encoder, stream)
+    )
+
+def _request_key(user_query: str) -> str:
+    """重复提交判断使用的问题标识（忽略空白差异）"""
+    return " ".join(user_query.split())
+
+def _rejected_response(error: AdmissionRejected):
+    """未准入请求的响应"""
+    logger.warning(f"🚦 请求未被准入 ({error.reason}): {str(error)}")
+    return jsonify({
+        'success': False,
+        'error': str(error),
+        'reason': error.reason
+    }), 429
+
+async def _admitted_stream(ticket, user_query: str, user_id: str):
+    """排队等待执行槽位（期间发送排队位置），获得槽位后开始流式处理"""
+    async for position in ticket.wait():
+        yield {
+            "type": "status",
+            "message": f"[当前请求较多，正在排队（第 {position} 位），请稍候...]",
+            "queue_position": position,
+            "timestamp": datetime.now().isoformat()
+        }
+    async for event in emr_assistant.process_query_stream(user_query, user_id):
+        yield event
+
+async def _run_sync_query(ticket, user_query: str, user_id: str):
+    try:
+        await ticket.acquire()
+        return await emr_assistant.process_query(user_query, user_id)
+    finally:
+        ticket.release()
+
+def _parse_last_event_id(value) -> int:
+    """解析 Last-Event-ID，无效时从头开始回放"""
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+def _resume_stream(stream_id: str, user_id: str, protocol, last_event_id):
+    """重新连接到已有的流，返回 Response 或 (错误响应, 状态码)"""
+    stream = stream_registry.get(stream_id)
+    if stream is None or stream.user_id != user_id:
+        return jsonify({
+            'success': False,
+            'error': '流不存在或已过期'
+        }), 404
+    
+    encoder = SSEEncoder(resolve_protocol(protocol))
+    # 旧协议依赖 accumulated 字段，只能从头回放
+    after_seq = 0 if encoder.legacy else _parse_last_event_id(last_event_id)
+    logger.info(f"🔁 重新连接流 {stream_id}，从序号 {after_seq} 之后回放")
+    return _stream_response(stream, encoder, after_seq)
+
 @app.route('/chat', methods=['POST'])
 async def chat_stream():
-    """处理聊天请求 - 流式响应"""
+    """处理聊天请求 - 流式响应（携带 stream_id 时重新连接到已有的流）"""
     try:
         data = await request.get_json()
         user_query = data.get('query', '').strip()
-        
-        if not user_query:
-            return jsonify({
-                'success': False,
-                'error': '请输入您的问题'
-            }), 400
+        protocol = data.get('protocol', request.args.get('protocol'))
         
         # 从会话中获取用户ID，如果不存在则创建一个新的
         user_id = session.get('user_id')
@@ -793,89 +1130,47 @@ async def chat_stream():
         else:
             logger.debug(f"使用现有用户会话ID: {user_id}")
         
-        # 返回流式响应 - 强制实时传输，添加填充数据
-        async def generate_stream():
-            import sys
-            import os
-            
-            # 强制禁用 Python 的输出缓冲
-            os.environ['PYTHONUNBUFFERED'] = '1'
-            
-            try:
-                logger.debug("🔄 开始生成流式响应...")
-                
-                # 立即发送心跳和填充数据，强制建立连接
-                heartbeat = json.dumps({'type': 'heartbeat'})
-                yield f"data: {heartbeat}\n\n"
-                
-                # 发送填充数据，强制 Flask 立即发送响应头
-                padding = " " * 1024  # 1KB 填充数据
-                yield f": padding {padding}\n\n"
-                
-                logger.debug("📡 心跳和填充数据已发送，开始处理查询...")
-                
-                # 先发送一个初始内容，确保前端能立即显示
-                initial_content = {
-                    "type": "content",
-                    "content": "正在思考您的问题...\n\n",
-                    "accumulated": "正在思考您的问题...\n\n",
-                    "timestamp": datetime.now().isoformat()
-                }
-                yield f"data: {json.dumps(initial_content, ensure_ascii=False)}\n\n"
-                yield f": initial-content\n\n"
-                
-                # 使用完整的 Strands Agent 流式处理
-                chunk_count = 0
-                async for chunk in emr_assistant.process_query_stream(user_query, user_id):
-                    chunk_count += 1
-                    logger.debug(f"生成第 {chunk_count} 个数据块: {chunk}")
-                    
-                    # 确保 JSON 序列化不会失败
-                    try:
-                        chunk_data = json.dumps(chunk, ensure_ascii=False)
-                    except Exception as json_err:
-                        print(f"JSON 序列化失败: {str(json_err)}, 尝试简化数据")
-                        # 如果序列化失败，尝试简化数据
-                        simplified_chunk = {
-                            "type": chunk.get("type", "content"),
-                            "content": str(chunk.get("content", "")),
-                            "timestamp": datetime.now().isoformat()
-                        }
-                        chunk_data = json.dumps(simplified_chunk, ensure_ascii=False)
-                    
-                    # 立即发送数据，确保每个块都有完整的 SSE 格式
-                    yield f"data: {chunk_data}\n\n"
-                    
-                    # 添加小的填充数据确保立即传输
-                    yield f": chunk-{chunk_count}\n\n"
-                    
-                    # 强制刷新缓冲区
-                    sys.stdout.flush()
-                    sys.stderr.flush()
-                
-                # 发送结束信号
-                end_data = json.dumps({'type': 'end'})
-                yield f"data: {end_data}\n\n"
-                
-                print(f"✅ 流式响应完成，共发送 {chunk_count} 个数据块")
-                
-            except Exception as e:
-                import traceback
-                logger.error(f"❌ 流式响应错误: {str(e)}")
-                print(f"错误堆栈: {traceback.format_exc()}")
-                error_data = json.dumps({'type': 'error', 'error': str(e)})
-                yield f"data: {error_data}\n\n"
+        # 断线重连：重新附着到仍在运行的生成过程或回放已完成的结果，不会重新运行 Agent
+        if data.get('stream_id'):
+            last_event_id = request.headers.get('Last-Event-ID', data.get('last_event_id'))
+            return _resume_stream(data['stream_id'], user_id, protocol, last_event_id)
         
-        return Response(
-            generate_stream(), 
-            content_type='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no',  # 禁用Nginx缓冲
-                'Transfer-Encoding': 'chunked'  # 使用分块传输编码
-            }
-        )
+        if not user_query:
+            return jsonify({
+                'success': False,
+                'error': '请输入您的问题'
+            }), 400
+        
+        # 协议版本：默认 v2（仅增量 + 序号），旧版页面可通过 protocol=1 使用兼容格式
+        encoder = SSEEncoder(resolve_protocol(protocol))
+        
+        # 重复提交（例如双击发送）的相同问题附着到正在运行的流，不再启动新的 Agent
+        key = _request_key(user_query)
+        existing = stream_registry.find_active(user_id, key)
+        if existing is not None:
+            metrics.incr("admission.coalesced")
+            logger.info(f"🔗 合并重复提交到流 {existing.stream_id}")
+            return _stream_response(existing, encoder)
+        
+        try:
+            ticket = admission.enqueue(user_id)
+        except AdmissionRejected as e:
+            return _rejected_response(e)
+        
+        # Agent 在后台任务中运行，事件写入回放缓冲区；先写入初始提示，确保前端能立即显示
+        try:
+            stream = await stream_registry.start(
+                user_id,
+                _admitted_stream(ticket, user_query, user_id),
+                preamble=[placeholder_event("正在思考您的问题...")],
+                key=key
+            )
+        except BaseException:
+            ticket.release()
+            raise
+        # 生成任务结束（完成、失败或取消）时释放执行槽位
+        stream.task.add_done_callback(lambda _: ticket.release())
+        return _stream_response(stream, encoder)
         
     except Exception as e:
         import traceback
@@ -886,6 +1181,19 @@ async def chat_stream():
             'error': f'服务器错误: {str(e)}'
         }), 500
 
+@app.route('/chat/stream/<stream_id>')
+async def resume_chat_stream(stream_id):
+    """断线重连 - 兼容 EventSource，自动使用浏览器发送的 Last-Event-ID 请求头"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({
+            'success': False,
+            'error': '没有活动的会话'
+        }), 400
+    
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    return _resume_stream(stream_id, user_id, request.args.get('protocol'), last_event_id)
+
 @app.route('/chat-sync', methods=['POST'])
 async def chat_sync():
     """处理聊天请求 - 同步响应（备用）"""
@@ -908,11 +1216,36 @@ async def chat_sync():
         else:
             logger.debug(f"使用现有用户会话ID: {user_id}")
         
-        # 处理查询
-        result = await emr_assistant.process_query(user_query, user_id)
+        # 相同用户的相同问题共享一次处理，其余请求等待同一个结果
+        key = (user_id, _request_key(user_query))
+        inflight = _sync_inflight.get(key)
+        if inflight is None:
+            try:
+                ticket = admission.enqueue(user_id)
+            except AdmissionRejected as e:
+                return _rejected_response(e)
+            inflight = _sync_inflight[key] = [asyncio.create_task(_run_sync_query(ticket, user_query, user_id)), 0]
+            inflight[0].add_done_callback(lambda _: _sync_inflight.pop(key, None))
+        else:
+            metrics.incr("admission.coalesced")
+            logger.info(f"🔗 合并重复提交的同步请求 (用户 {user_id})")
+        
+        # 处理查询；所有等待的请求都断开后才取消处理
+        task = inflight[0]
+        inflight[1] += 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if inflight[1] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            inflight[1] -= 1
         
         return jsonify(result)
         
+    except AdmissionRejected as e:
+        return _rejected_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -959,6 +1292,9 @@ async def clear_session():
                 'error': '没有活动的会话'
             }), 400
         
+        # 丢弃缓存的 Agent，避免清除后仍使用内存中的旧会话历史
+        emr_assistant.agent_cache.discard(user_id)
+        
         # 检查会话管理是否可用
         if not SESSION_MANAGEMENT_AVAILABLE:
             # 即使会话管理不可用，也生成新的会话ID
@@ -1176,20 +1512,91 @@ async def clear_memories():
 @app.route('/health')
 async def health():
     """健康检查"""
-    try:
-        # 创建一个临时的 mem0 实例来检查状态
-        temp_mem0 = create_mem0_integration()
-        mem0_enabled = temp_mem0.enabled
-    except:
-        mem0_enabled = False
+    # 读取共享 mem0 客户端的状态，不创建新的实例
+    mem0 = mem0_status()
     
     return jsonify({
         'status': 'healthy',
         'service': 'EMR Upgrade Assistant',
-        'mem0_enabled': mem0_enabled,
+        'mem0_enabled': mem0['enabled'] and mem0['memory_ready'],
+        'mem0': mem0,
+        'mcp_pools': emr_assistant.mcp_pools.stats() if emr_assistant.mcp_pools else {},
+        'tool_catalog': emr_assistant.tool_catalog.stats() if emr_assistant.tool_catalog else {},
+        'agent_cache': emr_assistant.agent_cache.stats(),
+        'streams': stream_registry.stats(),
+        'admission': admission.stats(),
+        'answer_cache': emr_assistant.answer_cache.stats(),
+        'memory_writer': emr_assistant.memory_writer.stats(),
+        'memory_vectors': memory_vector_cache.stats(),
+        'embedding_cache': embedding_cache.stats(),
+        'tool_memo': emr_assistant.tool_catalog.tool_memo.stats() if emr_assistant.tool_catalog and emr_assistant.tool_catalog.tool_memo else {},
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/metrics')
+async def get_metrics():
+    """获取运行指标（各阶段耗时、计数器）"""
+    return jsonify({
+        'success': True,
+        'metrics': metrics.snapshot(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/admin/tools/refresh', methods=['POST'])
+async def refresh_tool_catalog():
+    """强制刷新 MCP 工具目录缓存"""
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if admin_token and request.headers.get('X-Admin-Token') != admin_token:
+        return jsonify({'success': False, 'error': '无权限'}), 403
+
+    if not emr_assistant.tool_catalog:
+        return jsonify({'success': False, 'error': '工具目录未初始化'}), 503
+
+    try:
+        data = await request.get_json(silent=True) or {}
+        servers = data.get('servers') or None
+        catalog = await asyncio.to_thread(emr_assistant.tool_catalog.refresh, servers)
+        logger.info(f"🔄 工具目录已强制刷新: {catalog['total_tools']} 个工具")
+        return jsonify({
+            'success': True,
+            'catalog': catalog,
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'刷新工具目录失败: {str(e)}'
+        }), 500
+
+@app.route('/admin/answer-cache/invalidate', methods=['POST'])
+async def invalidate_answer_cache():
+    """清空回答缓存（知识库索引重建后调用，可同时指定新的索引版本）"""
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if admin_token and request.headers.get('X-Admin-Token') != admin_token:
+        return jsonify({'success': False, 'error': '无权限'}), 403
+
+    data = await request.get_json(silent=True) or {}
+    index_version = data.get('index_version')
+    count = emr_assistant.answer_cache.invalidate(
+        index_version, reason=f"管理接口 (索引版本 {index_version})" if index_version else "管理接口"
+    )
+    return jsonify({
+        'success': True,
+        'invalidated': count,
+        'answer_cache': emr_assistant.answer_cache.stats(),
         'timestamp': datetime.now().isoformat()
     })
 
+@app.after_serving
+async def shutdown():
+    """服务停止时写完长期记忆队列、淘汰缓存的 Agent 并关闭 MCP 连接池中的子进程"""
+    if emr_assistant.tool_catalog:
+        emr_assistant.tool_catalog.stop()
+    await asyncio.to_thread(emr_assistant.memory_writer.close)
+    await asyncio.to_thread(emr_assistant.agent_cache.close)
+    if emr_assistant.mcp_pools:
+        emr_assistant.mcp_pools.close()
+
 @app.errorhandler(404)
 async def not_found(error):
     return jsonify({'error': 'Not found'}), 404
@@ -0,0 +1,163 @@
+"""
+向量缓存 - 按"模型 + 文本"的哈希缓存 Titan Embeddings 的结果
+
+同一段文本（重复的问题、重复提取的记忆、检索和写入时使用的相同内容）只计算一次向量。
+结果以定长 float32 行保存在 SQLite 文件中（WAL 模式），同一台机器上的多个 worker 进程共享。
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from typing import Any, Dict, List, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger('emr_assistant')
+
+
+def embedding_key(model_id: str, text: str) -> str:
+    return hashlib.sha256(f"{model_id}\0{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    基于 SQLite 的向量缓存
+
+    配置项（环境变量）：
+    - EMBEDDING_CACHE_ENABLED: 是否启用（默认 true）
+    - EMBEDDING_CACHE_PATH: SQLite 文件路径，多个 worker 指向同一个文件即可共享
+    - EMBEDDING_CACHE_MAX_ENTRIES: 最多缓存的向量数，超出时删除最早写入的向量
+    """
+
+    def __init__(self, path: str = None, max_entries: int = None):
+        self.enabled = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+        self.path = path or os.getenv('EMBEDDING_CACHE_PATH', os.path.join('cache', 'embeddings.sqlite3'))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 200000))
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+        if self.enabled:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory, exist_ok=True)
+                conn = self._connect()
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS embeddings (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        key TEXT NOT NULL UNIQUE,
+                        dims INTEGER NOT NULL,
+                        vector BLOB NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                """)
+                conn.commit()
+            except Exception as e:
+                logger.error(f"❌ 向量缓存初始化失败，已禁用: {str(e)}")
+                self.enabled = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, model_id: str, text: str) -> Optional[List[float]]:
+        vector = None
+        try:
+            row = self._connect().execute(
+                "SELECT dims, vector FROM embeddings WHERE key = ?", (embedding_key(model_id, text),)
+            ).fetchone()
+            if row is not None:
+                values = array('f')
+                values.frombytes(row[1])
+                if len(values) == row[0]:
+                    vector = values.tolist()
+        except Exception as e:
+            logger.warning(f"⚠️ 读取向量缓存失败: {str(e)}")
+
+        with self._lock:
+            if vector is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.incr("embedding_cache.hit" if vector is not None else "embedding_cache.miss")
+        return vector
+
+    def put(self, model_id: str, text: str, vector: List[float]):
+        try:
+            values = array('f', vector)
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, dims, vector, created_at) VALUES (?, ?, ?, ?)",
+                (embedding_key(model_id, text), len(values), values.tobytes(), time.time())
+            )
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % 1000 == 0
+            if evict:
+                # 每写入一批检查一次数量，超出上限时删除最早写入的向量
+                conn.execute(
+                    "DELETE FROM embeddings WHERE id <= (SELECT MAX(id) FROM embeddings) - ?",
+                    (self.max_entries,)
+                )
+            conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ 写入向量缓存失败: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "enabled": self.enabled,
+                "path": self.path,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+        if self.enabled:
+            try:
+                stats["entries"] = self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            except Exception as e:
+                stats["error"] = str(e)
+        return stats
+
+
+class CachedEmbedder:
+    """
+    mem0 embedder 的缓存包装，接口与被包装的 embedder 相同
+
+    Titan Embeddings 的结果与 memory_action（add / search / update）无关，因此只按模型和文本缓存
+    """
+
+    def __init__(self, embedder, store: EmbeddingStore, model_id: str):
+        self._embedder = embedder
+        self._store = store
+        self._model_id = model_id
+
+    def embed(self, text, memory_action: Optional[str] = None):
+        if not isinstance(text, str):
+            return self._embedder.embed(text, memory_action)
+        vector = self._store.get(self._model_id, text)
+        if vector is not None:
+            return vector
+        vector = self._embedder.embed(text, memory_action)
+        self._store.put(self._model_id, text, vector)
+        return vector
+
+    def __getattr__(self, name):
+        # config 等其他属性直接使用被包装的 embedder
+        return getattr(self._embedder, name)
@@ -0,0 +1,103 @@
+"""
+事件多路复用 - 将 Agent 事件流与独立的心跳/状态计时器合并
+
+Agent 事件由单独的任务消费，计时器任务按固定间隔产生心跳，与 Agent 是否产生事件无关；
+整个过程受真实的墙钟截止时间约束，不会对迭代器重复调用 __anext__。
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Optional, Tuple
+
+logger = logging.getLogger('emr_assistant')
+
+# 多路复用产生的事件类型
+EVENT = 'event'          # 来自源迭代器的事件
+HEARTBEAT = 'heartbeat'  # 计时器心跳，payload 为已用时间（秒）
+SLOW = 'slow'            # 超过软超时，payload 为已用时间（秒），只产生一次
+DEADLINE = 'deadline'    # 超过硬超时，payload 为已用时间（秒），随后结束
+
+
+async def multiplex_events(source: AsyncIterator[Any],
+                           heartbeat_interval: float = 5.0,
+                           soft_timeout: Optional[float] = None,
+                           hard_timeout: Optional[float] = None,
+                           ignore_error: Optional[Callable[[BaseException], bool]] = None,
+                           ) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    合并源事件流和心跳计时器
+
+    Args:
+        source: 源事件的异步迭代器（例如 agent.stream_async()）
+        heartbeat_interval: 心跳间隔（秒）
+        soft_timeout: 软超时（秒），超过后产生一次 SLOW 事件，不中断处理
+        hard_timeout: 硬超时（秒），超过后产生 DEADLINE 事件并取消源迭代
+        ignore_error: 判断源迭代器抛出的异常是否可以忽略
+
+    Yields:
+        (kind, payload) 元组；源迭代器抛出的其他异常会在此处重新抛出
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def pump():
+        iterator = source.__aiter__()
+        try:
+            while True:
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    if ignore_error and ignore_error(e):
+                        logger.debug(f"忽略事件流错误: {str(e)}")
+                        continue
+                    raise
+                await queue.put((EVENT, item))
+        except Exception as e:
+            await queue.put((None, e))
+        finally:
+            await queue.put((None, done))
+
+    async def tick():
+        slow_sent = False
+        while True:
+            await asyncio.sleep(heartbeat_interval)
+            elapsed = loop.time() - start
+            queue.put_nowait((HEARTBEAT, elapsed))
+            if soft_timeout is not None and not slow_sent and elapsed >= soft_timeout:
+                slow_sent = True
+                queue.put_nowait((SLOW, elapsed))
+
+    pump_task = asyncio.create_task(pump())
+    tick_task = asyncio.create_task(tick())
+    try:
+        while True:
+            if hard_timeout is not None:
+                remaining = hard_timeout - (loop.time() - start)
+                try:
+                    kind, payload = await asyncio.wait_for(queue.get(), timeout=max(remaining, 0))
+                except asyncio.TimeoutError:
+                    yield DEADLINE, loop.time() - start
+                    return
+            else:
+                kind, payload = await queue.get()
+
+            if kind is None:
+                if payload is done:
+                    return
+                raise payload
+            yield kind, payload
+    finally:
+        tick_task.cancel()
+        pump_task.cancel()
+        await asyncio.gather(tick_task, pump_task, return_exceptions=True)
+        # 取消后关闭源迭代器，释放其持有的资源
+        aclose = getattr(source, 'aclose', None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:
+                pass
@@ -0,0 +1,382 @@
+"""
+MCP 客户端连接池 - 复用已初始化的 MCP 会话，避免每次请求都启动新的 stdio 子进程
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger('emr_assistant')
+
+
+class MCPPoolExhaustedError(RuntimeError):
+    """在等待超时后仍无法从连接池借到 MCP 客户端"""
+
+
+def _env_int(name: str, default: int) -> int:
+    """读取整数型环境变量，格式错误时回退到默认值"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        logger.warning(f"⚠️ 环境变量 {name} 不是合法的整数，使用默认值 {default}")
+        return default
+
+
+def _is_client_alive(client) -> bool:
+    """检查 MCP 客户端的后台会话线程是否仍在运行"""
+    thread = getattr(client, '_background_thread', None)
+    return thread is None or thread.is_alive()
+
+
+class _PooledClient:
+    """连接池中的一个条目，记录客户端、正在进行的调用数及其使用时间"""
+
+    __slots__ = ('client', 'created_at', 'last_used', 'in_use')
+
+    def __init__(self, client):
+        self.client = client
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.in_use = 0
+
+
+class MCPClientPool:
+    """
+    单个 MCP 服务器的客户端池
+
+    池中的每个客户端都已执行过 start()，即子进程已启动且 MCP 会话已初始化。
+    一个 MCP 会话可以同时处理多个请求（按请求 ID 区分响应），因此客户端是共享借用的：
+    每个客户端最多同时承载 max_concurrency 个调用，全部客户端都达到上限后才启动新的客户端，
+    达到 max_size 后才需要等待。一次 Agent 回合并发调用多个工具、多个用户同时提问时，
+    可同时进行的调用数为 max_size * max_concurrency。
+    空闲超过 idle_timeout 的客户端会被回收，但始终保留至少 min_size 个热连接。
+    """
+
+    def __init__(self, name: str, client_factory: Callable[[], Any],
+                 min_size: int = 1, max_size: int = 4,
+                 idle_timeout: int = 300, acquire_timeout: int = 30,
+                 max_concurrency: int = 8):
+        self.name = name
+        self.client_factory = client_factory
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.max_concurrency = max(1, max_concurrency)
+
+        self._entries: Dict[int, _PooledClient] = {}
+        # 已移出池但仍有调用在进行的客户端，最后一个调用归还时关闭
+        self._retired: Dict[int, _PooledClient] = {}
+        self._pending = 0  # 正在启动中的客户端数量（已占用名额）
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # 失效的客户端被替换时加一，工具目录据此判断服务端是否发生过重启（正常扩容不改变）
+        self.generation = 0
+        self.created_total = 0
+        self.discarded_total = 0
+
+    @property
+    def size(self) -> int:
+        """当前池中客户端总数（含启动中）"""
+        return len(self._entries) + self._pending
+
+    def _start_client(self) -> _PooledClient:
+        """创建并启动一个新的 MCP 客户端（在锁外调用）"""
+        start_time = time.monotonic()
+        client = self.client_factory()
+        client.start()
+        entry = _PooledClient(client)
+        logger.info(f"✅ MCP 连接池 [{self.name}] 启动新客户端，耗时 {time.monotonic() - start_time:.2f}秒")
+        return entry
+
+    def _stop_client(self, entry: _PooledClient):
+        """关闭一个 MCP 客户端（在锁外调用）"""
+        try:
+            entry.client.stop(None, None, None)
+        except Exception as e:
+            logger.warning(f"⚠️ MCP 连接池 [{self.name}] 关闭客户端失败: {str(e)}")
+
+    def _retire(self, entry: _PooledClient) -> bool:
+        """
+        在持有锁的情况下将失效的客户端移出池，之后由新客户端替换
+
+        Returns:
+            客户端没有正在进行的调用、可以立即关闭时返回 True；否则在最后一个调用归还时关闭
+        """
+        self._entries.pop(id(entry.client), None)
+        self.discarded_total += 1
+        self.generation += 1
+        self._cond.notify_all()
+        if entry.in_use > 0:
+            self._retired[id(entry.client)] = entry
+            return False
+        return True
+
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        借用一个已初始化的客户端（同一客户端可能同时借给其他调用）
+
+        Args:
+            timeout: 最长等待秒数，默认使用 acquire_timeout
+
+        Returns:
+            已启动的 MCPClient 实例，使用完毕后调用 release()
+        """
+        deadline = time.monotonic() + (self.acquire_timeout if timeout is None else timeout)
+        stale = []
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError(f"MCP 连接池 [{self.name}] 已关闭")
+
+                # 选择正在进行的调用最少的客户端；调用数相同时优先最近使用的，让其余客户端空闲后被回收
+                entry = None
+                for candidate in list(self._entries.values()):
+                    if not _is_client_alive(candidate.client):
+                        if self._retire(candidate):
+                            stale.append(candidate)
+                        continue
+                    if candidate.in_use >= self.max_concurrency:
+                        continue
+                    if (entry is None or candidate.in_use < entry.in_use
+                            or (candidate.in_use == entry.in_use and candidate.last_used > entry.last_used)):
+                        entry = candidate
+
+                if entry is not None:
+                    entry.in_use += 1
+                    entry.last_used = time.monotonic()
+                    break
+                # 所有客户端都已达到并发上限，池未满时启动新客户端
+                if self.size < self.max_size:
+                    self._pending += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise MCPPoolExhaustedError(
+                        f"MCP 连接池 [{self.name}] 已满 ({self.max_size} 个客户端，每个 {self.max_concurrency} 个并发调用)，"
+                        f"等待 {self.acquire_timeout} 秒后仍无可用客户端"
+                    )
+                self._cond.wait(remaining)
+
+        for dead in stale:
+            logger.warning(f"⚠️ MCP 连接池 [{self.name}] 丢弃已失效的客户端")
+            self._stop_client(dead)
+
+        if entry is not None:
+            return entry.client
+
+        # 在锁外启动新客户端，避免阻塞其他借用者
+        try:
+            entry = self._start_client()
+        except Exception:
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._pending -= 1
+            entry.in_use = 1
+            self._entries[id(entry.client)] = entry
+            self.created_total += 1
+        return entry.client
+
+    def release(self, client, discard: bool = False):
+        """
+        归还客户端
+
+        Args:
+            client: 由 acquire() 借出的客户端
+            discard: 为 True 时不再借出该客户端，其上正在进行的调用全部归还后关闭
+        """
+        with self._cond:
+            key = id(client)
+            entry = self._entries.get(key) or self._retired.get(key)
+            if entry is None:
+                return
+            entry.in_use = max(0, entry.in_use - 1)
+            entry.last_used = time.monotonic()
+
+            if key in self._retired:
+                if entry.in_use > 0:
+                    return
+                del self._retired[key]
+            elif self._closed or discard or not _is_client_alive(client):
+                if self._closed:
+                    self._entries.pop(key, None)
+                    if entry.in_use > 0:
+                        self._retired[key] = entry
+                        return
+                elif not self._retire(entry):
+                    return
+            else:
+                self._cond.notify()
+                return
+
+        self._stop_client(entry)
+
+    @contextmanager
+    def borrow(self, timeout: Optional[float] = None):
+        """以上下文管理器的方式借用客户端，退出时自动归还"""
+        client = self.acquire(timeout)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def warm_up(self):
+        """预先启动 min_size 个客户端"""
+        while True:
+            with self._cond:
+                if self._closed or self.size >= self.min_size:
+                    return
+                self._pending += 1
+            try:
+                entry = self._start_client()
+            except Exception as e:
+                with self._cond:
+                    self._pending -= 1
+                logger.error(f"❌ MCP 连接池 [{self.name}] 预热失败: {str(e)}")
+                return
+            with self._cond:
+                self._pending -= 1
+                self._entries[id(entry.client)] = entry
+                self.created_total += 1
+                self._cond.notify()
+
+    def evict_idle(self) -> int:
+        """回收空闲时间超过 idle_timeout 的客户端及已失效的空闲客户端，返回回收数量"""
+        now = time.monotonic()
+        evicted = []
+        with self._cond:
+            # 从最久未使用的客户端开始回收，只回收没有正在进行调用的客户端
+            idle = sorted((e for e in self._entries.values() if e.in_use == 0), key=lambda e: e.last_used)
+            for entry in idle:
+                if not _is_client_alive(entry.client):
+                    self._retire(entry)
+                elif self.size > self.min_size and now - entry.last_used >= self.idle_timeout:
+                    self._entries.pop(id(entry.client), None)
+                else:
+                    continue
+                evicted.append(entry)
+
+        for entry in evicted:
+            self._stop_client(entry)
+        if evicted:
+            logger.info(f"🧹 MCP 连接池 [{self.name}] 回收了 {len(evicted)} 个空闲客户端")
+        return len(evicted)
+
+    def close(self):
+        """关闭池中所有空闲客户端，正在使用的客户端在最后一个调用归还时关闭"""
+        with self._cond:
+            self._closed = True
+            idle = []
+            for entry in list(self._entries.values()):
+                self._entries.pop(id(entry.client), None)
+                if entry.in_use > 0:
+                    self._retired[id(entry.client)] = entry
+                else:
+                    idle.append(entry)
+            self._cond.notify_all()
+
+        for entry in idle:
+            self._stop_client(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回连接池状态"""
+        with self._cond:
+            return {
+                "size": self.size,
+                "idle": sum(1 for e in self._entries.values() if e.in_use == 0),
+                "in_flight": sum(e.in_use for e in self._entries.values()),
+                "retiring": len(self._retired),
+                "starting": self._pending,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "max_concurrency": self.max_concurrency,
+                "idle_timeout": self.idle_timeout,
+                "generation": self.generation,
+                "created_total": self.created_total,
+                "discarded_total": self.discarded_total,
+            }
+
+
+class MCPPoolManager:
+    """
+    进程级 MCP 连接池管理器
+
+    每个 MCP 服务器对应一个 MCPClientPool，池大小可以通过环境变量按服务器配置：
+    MCP_POOL_<NAME>_MIN_SIZE / MCP_POOL_<NAME>_MAX_SIZE / MCP_POOL_<NAME>_MAX_CONCURRENCY / MCP_POOL_<NAME>_IDLE_TIMEOUT，
+    未配置时使用全局的 MCP_POOL_MIN_SIZE / MCP_POOL_MAX_SIZE / MCP_POOL_MAX_CONCURRENCY / MCP_POOL_IDLE_TIMEOUT。
+    """
+
+    def __init__(self, reap_interval: int = None):
+        self.pools: Dict[str, MCPClientPool] = {}
+        self.reap_interval = reap_interval or _env_int('MCP_POOL_REAP_INTERVAL', 30)
+        self._stop_event = threading.Event()
+        self._reaper = None
+
+    def register(self, name: str, client_factory: Callable[[], Any]) -> MCPClientPool:
+        """注册一个 MCP 服务器的客户端工厂"""
+        prefix = f"MCP_POOL_{name.upper()}_"
+        pool = MCPClientPool(
+            name=name,
+            client_factory=client_factory,
+            min_size=_env_int(prefix + 'MIN_SIZE', _env_int('MCP_POOL_MIN_SIZE', 1)),
+            max_size=_env_int(prefix + 'MAX_SIZE', _env_int('MCP_POOL_MAX_SIZE', 4)),
+            idle_timeout=_env_int(prefix + 'IDLE_TIMEOUT', _env_int('MCP_POOL_IDLE_TIMEOUT', 300)),
+            acquire_timeout=_env_int(prefix + 'ACQUIRE_TIMEOUT', _env_int('MCP_POOL_ACQUIRE_TIMEOUT', 30)),
+            max_concurrency=_env_int(prefix + 'MAX_CONCURRENCY', _env_int('MCP_POOL_MAX_CONCURRENCY', 8)),
+        )
+        self.pools[name] = pool
+        logger.debug(f"🔧 注册 MCP 连接池 [{name}]: min={pool.min_size}, max={pool.max_size}, max_concurrency={pool.max_concurrency}, idle_timeout={pool.idle_timeout}秒")
+        return pool
+
+    def get(self, name: str) -> MCPClientPool:
+        return self.pools[name]
+
+    def acquire(self, name: str, timeout: Optional[float] = None):
+        return self.pools[name].acquire(timeout)
+
+    def release(self, name: str, client, discard: bool = False):
+        self.pools[name].release(client, discard)
+
+    def borrow(self, name: str, timeout: Optional[float] = None):
+        return self.pools[name].borrow(timeout)
+
+    def start(self):
+        """启动后台线程：先预热所有连接池，然后定期回收空闲客户端"""
+        if self._reaper and self._reaper.is_alive():
+            return
+        self._stop_event.clear()
+        self._reaper = threading.Thread(target=self._run, name='mcp-pool-reaper', daemon=True)
+        self._reaper.start()
+
+    def _run(self):
+        for pool in list(self.pools.values()):
+            if self._stop_event.is_set():
+                return
+            pool.warm_up()
+        while not self._stop_event.wait(self.reap_interval):
+            for pool in list(self.pools.values()):
+                try:
+                    pool.evict_idle()
+                    pool.warm_up()
+                except Exception as e:
+                    logger.error(f"❌ MCP 连接池 [{pool.name}] 维护失败: {str(e)}")
+
+    def close(self):
+        """停止后台线程并关闭所有连接池"""
+        self._stop_event.set()
+        for pool in self.pools.values():
+            pool.close()
+        logger.info("✅ MCP 连接池已全部关闭")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.stats() for name, pool in self.pools.items()}
@@ -4,12 +4,17 @@ Mem0 集成模块 - 实现上下文记忆存储和查询
 
 import os, sys
 import json
+import time
 import logging
+import threading
 from typing import Dict, List, Optional, Any
 from datetime import datetime
 from dotenv import load_dotenv
 from logging.handlers import RotatingFileHandler
 
+from memory_vectors import MemoryVectorCache
+from embedding_cache import EmbeddingStore, CachedEmbedder
+
 # 创建日志目录
 log_dir = 'logs'
 if not os.path.exists(log_dir):
@@ -67,9 +72,185 @@ except ImportError:
 
 # logger = logging.getLogger(__name__)
 
+# mem0 记忆索引，以及用于直接查询的 user_id / 创建时间字段
+MEM0_INDEX = os.getenv('MEM0_OPENSEARCH_INDEX', 'emr_assistant_memories')
+MEM0_USER_FIELD = os.getenv('MEM0_OPENSEARCH_USER_FIELD', 'payload.user_id.keyword')
+MEM0_TIME_FIELD = os.getenv('MEM0_OPENSEARCH_TIME_FIELD', 'payload.created_at')
+MEM0_VECTOR_FIELD = os.getenv('MEM0_OPENSEARCH_VECTOR_FIELD', 'vector_field')
+
+# 进程内按用户缓存的记忆向量（在加载环境变量之后创建）
+memory_vector_cache = MemoryVectorCache()
+# 进程间共享的 Titan Embeddings 结果缓存
+embedding_cache = EmbeddingStore()
+
+
+def _create_memory():
+    """创建 Mem0 记忆系统（失败时抛出异常）"""
+    embedding_model = "amazon.titan-embed-text-v2:0"
+    config = {
+        "llm": {
+            "provider": "aws_bedrock",
+            "config": {
+                "model": "us.anthropic.claude-3-5-sonnet-20241022-v2:0",  # 使用 Claude 4.0 (Sonnet)
+                "temperature": 0.1,
+                "max_tokens": 2000,
+                # "aws_access_key_id": os.environ.get("AWS_ACCESS_KEY_ID"),
+                # "aws_secret_access_key": os.environ.get("AWS_SECRET_ACCESS_KEY"),
+            }
+        },
+        "embedder": {
+            "provider": "aws_bedrock", 
+            "config": {
+                "model": embedding_model,
+                # "aws_access_key_id": os.environ.get("AWS_ACCESS_KEY_ID"),
+                # "aws_secret_access_key": os.environ.get("AWS_SECRET_ACCESS_KEY")
+            }
+        },
+        "vector_store": {
+            "provider": "opensearch",
+            "config": {
+                "host": os.getenv('MEM0_OPENSEARCH_HOST', 'localhost'),
+                "port": int(os.getenv('MEM0_OPENSEARCH_PORT', '9200')),
+                "http_auth": (
+                    os.getenv('MEM0_OPENSEARCH_USERNAME', 'admin'), 
+                    os.getenv('MEM0_OPENSEARCH_PASSWORD', 'admin')
+                ),
+                "use_ssl": os.getenv('MEM0_OPENSEARCH_USE_SSL', 'false').lower() == 'true',
+                "verify_certs": os.getenv('MEM0_OPENSEARCH_VERIFY_CERTS', 'false').lower() == 'true',
+                "collection_name": os.getenv('MEM0_OPENSEARCH_INDEX', 'emr_assistant_memories'),
+                "embedding_model_dims": 1024
+            }
+        },
+        "version": "v1.1"
+    }
+    
+    memory = Memory.from_config(config)
+    if embedding_cache.enabled:
+        # 相同文本的向量只计算一次，多个 worker 共享
+        memory.embedding_model = CachedEmbedder(memory.embedding_model, embedding_cache, embedding_model)
+    return memory
+
+
+def _create_opensearch_client():
+    """创建 OpenSearch 客户端（用于直接查询），并测试连接"""
+    client = OpenSearch(
+        hosts=[{
+            'host': os.getenv('MEM0_OPENSEARCH_HOST', 'localhost'),
+            'port': int(os.getenv('MEM0_OPENSEARCH_PORT', '9200'))
+        }],
+        http_auth=(
+            os.getenv('MEM0_OPENSEARCH_USERNAME', 'admin'),
+            os.getenv('MEM0_OPENSEARCH_PASSWORD', 'admin')
+        ),
+        use_ssl=os.getenv('MEM0_OPENSEARCH_USE_SSL', 'false').lower() == 'true',
+        verify_certs=os.getenv('MEM0_OPENSEARCH_VERIFY_CERTS', 'false').lower() == 'true',
+        ssl_show_warn=False,
+        # 客户端在所有请求线程间共享，连接池需要足够大
+        pool_maxsize=int(os.getenv('MEM0_OPENSEARCH_POOL_SIZE', 20))
+    )
+    
+    # 测试连接
+    info = client.info()
+    logger.info(f"✅ OpenSearch 连接成功: {info['version']['number']}")
+    return client
+
+
+class _SharedMem0Clients:
+    """
+    进程内共享的 Mem0 Memory 和 OpenSearch 客户端
+    
+    两者都不区分用户（用户隔离通过调用时传入 user_id 实现），因此每个进程只需创建一次；
+    Memory 和 OpenSearch 客户端各自记录失败时间，某一个初始化失败后在 MEM0_INIT_RETRY_INTERVAL 秒内不再重试，
+    避免每个请求都阻塞在连接上，之后单独重试失败的那一个
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.memory = None
+        self.opensearch_client = None
+        self.initialized_at = None
+        self.last_error = None
+        self._memory_failed_at = None
+        self._opensearch_failed_at = None
+        self.retry_interval = int(os.getenv('MEM0_INIT_RETRY_INTERVAL', 60))
+    
+    def _backing_off(self, failed_at: Optional[float]) -> bool:
+        return failed_at is not None and time.monotonic() - failed_at < self.retry_interval
+    
+    def get(self):
+        """返回 (memory, opensearch_client)，首次调用时创建，此前创建失败的客户端在重试间隔后重新创建"""
+        if self.memory is not None and (self.opensearch_client is not None or self._backing_off(self._opensearch_failed_at)):
+            return self.memory, self.opensearch_client
+        
+        with self._lock:
+            if self.memory is None:
+                if self._backing_off(self._memory_failed_at):
+                    return None, None
+                start_time = time.perf_counter()
+                try:
+                    memory = _create_memory()
+                    logger.info("Mem0 记忆系统初始化成功")
+                except Exception as e:
+                    logger.error(f"Mem0 初始化失败: {str(e)}")
+                    self.last_error = str(e)
+                    self._memory_failed_at = time.monotonic()
+                    return None, None
+                self.memory = memory
+                self.initialized_at = datetime.now().isoformat()
+                self.last_error = None
+                self._memory_failed_at = None
+                logger.info(f"✅ 共享 Mem0 客户端初始化完成，耗时 {time.perf_counter() - start_time:.2f}秒")
+            
+            if self.opensearch_client is None and not self._backing_off(self._opensearch_failed_at):
+                try:
+                    self.opensearch_client = _create_opensearch_client()
+                    self._opensearch_failed_at = None
+                except Exception as e:
+                    logger.error(f"❌ OpenSearch 连接失败，{self.retry_interval} 秒后重试: {str(e)}")
+                    self._opensearch_failed_at = time.monotonic()
+            
+            return self.memory, self.opensearch_client
+    
+    def status(self) -> Dict[str, Any]:
+        return {
+            "memory_ready": self.memory is not None,
+            "opensearch_connected": self.opensearch_client is not None,
+            "initialized_at": self.initialized_at,
+            "last_error": self.last_error,
+        }
+
+
+_shared_clients = _SharedMem0Clients()
+
+
+def mem0_enabled() -> bool:
+    """是否启用了 mem0（配置开启且依赖已安装）"""
+    return MEM0_AVAILABLE and os.getenv('MEM0_ENABLED', 'false').lower() == 'true'
+
+
+def mem0_status() -> Dict[str, Any]:
+    """共享 Mem0 客户端的状态（不会触发初始化）"""
+    return dict(_shared_clients.status(), enabled=mem0_enabled())
+
+
+def _merge_metadata(turns: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    合并一批对话的 metadata（一次 mem0.add 只能带一份 metadata）
+
+    各轮取值相同的字段保留原值，取值不同的字段按对话顺序保存为列表
+    """
+    merged: Dict[str, Any] = {}
+    values: Dict[str, List[Any]] = {}
+    for turn in turns:
+        for key, value in (turn.get("metadata") or {}).items():
+            values.setdefault(key, []).append(value)
+    for key, items in values.items():
+        merged[key] = items[0] if len(items) == len(turns) and all(item == items[0] for item in items) else items
+    return merged or None
+
 
 class Mem0Integration:
-    """Mem0 记忆存储集成类"""
+    """Mem0 记忆存储集成类（按用户的轻量句柄，Memory 和 OpenSearch 客户端在进程内共享）"""
     
     def __init__(self, user_id: Optional[str] = None):
         """初始化 Mem0 集成"""
@@ -91,82 +272,10 @@ class Mem0Integration:
             return
         
         if self.enabled:
-            self._initialize_mem0()
-            self._initialize_opensearch()
-    
-    def _initialize_mem0(self):
-        """初始化 Mem0 记忆系统"""
-        try:
-            config = {
-                "llm": {
-                    "provider": "aws_bedrock",
-                    "config": {
-                        "model": "us.anthropic.claude-3-5-sonnet-20241022-v2:0",  # 使用 Claude 4.0 (Sonnet)
-                        "temperature": 0.1,
-                        "max_tokens": 2000,
-                        # "aws_access_key_id": os.environ.get("AWS_ACCESS_KEY_ID"),
-                        # "aws_secret_access_key": os.environ.get("AWS_SECRET_ACCESS_KEY"),
-                    }
-                },
-                "embedder": {
-                    "provider": "aws_bedrock", 
-                    "config": {
-                        "model": "amazon.titan-embed-text-v2:0",
-                        # "aws_access_key_id": os.environ.get("AWS_ACCESS_KEY_ID"),
-                        # "aws_secret_access_key": os.environ.get("AWS_SECRET_ACCESS_KEY")
-                    }
-                },
-                "vector_store": {
-                    "provider": "opensearch",
-                    "config": {
-                        "host": os.getenv('MEM0_OPENSEARCH_HOST', 'localhost'),
-                        "port": int(os.getenv('MEM0_OPENSEARCH_PORT', '9200')),
-                        "http_auth": (
-                            os.getenv('MEM0_OPENSEARCH_USERNAME', 'admin'), 
-                            os.getenv('MEM0_OPENSEARCH_PASSWORD', 'admin')
-                        ),
-                        "use_ssl": os.getenv('MEM0_OPENSEARCH_USE_SSL', 'false').lower() == 'true',
-                        "verify_certs": os.getenv('MEM0_OPENSEARCH_VERIFY_CERTS', 'false').lower() == 'true',
-                        "collection_name": os.getenv('MEM0_OPENSEARCH_INDEX', 'emr_assistant_memories'),
-                        "embedding_model_dims": 1024
-                    }
-                },
-                "version": "v1.1"
-            }
-            
-            self.memory = Memory.from_config(config)
-            logger.info("Mem0 记忆系统初始化成功")
-            
-        except Exception as e:
-            logger.error(f"Mem0 初始化失败: {str(e)}")
-            self.enabled = False
-    
-    def _initialize_opensearch(self):
-        """初始化 OpenSearch 客户端（用于直接查询）"""
-        try:
-            self.opensearch_client = OpenSearch(
-                hosts=[{
-                    'host': os.getenv('MEM0_OPENSEARCH_HOST', 'localhost'),
-                    'port': int(os.getenv('MEM0_OPENSEARCH_PORT', '9200'))
-                }],
-                http_auth=(
-                    os.getenv('MEM0_OPENSEARCH_USERNAME', 'admin'),
-                    os.getenv('MEM0_OPENSEARCH_PASSWORD', 'admin')
-                ),
-                use_ssl=os.getenv('MEM0_OPENSEARCH_USE_SSL', 'false').lower() == 'true',
-                verify_certs=os.getenv('MEM0_OPENSEARCH_VERIFY_CERTS', 'false').lower() == 'true',
-                ssl_show_warn=False
-            )
-            
-            # 测试连接
-            info = self.opensearch_client.info()
-            logger.info(f"✅ OpenSearch 连接成功: {info['version']['number']}")
-            
-        except Exception as e:
-            logger.error(f"❌ OpenSearch 连接失败: {str(e)}")
-            self.opensearch_client = None
-    
-
+            # 使用进程内共享的客户端，每个实例只携带 user_id
+            self.memory, self.opensearch_client = _shared_clients.get()
+            if self.memory is None:
+                self.enabled = False
     
     def add_memory(self, message: str, user_query: str, response: str, metadata: Optional[Dict] = None) -> bool:
         """添加记忆到存储"""
@@ -174,37 +283,59 @@ class Mem0Integration:
             return False
         
         try:
-            # 清理用户查询和响应，移除换行符
-            clean_user_query = user_query[:100].replace('\n', ' ').replace('\r', ' ')
-            clean_response = response[:200].replace('\n', ' ').replace('\r', ' ')
-            
-            # 构建两轮对话格式
-            messages = [
-                {"role": "user", "content": f"I need help with Amazon EMR upgrade. {clean_user_query}"},
-                {"role": "assistant", "content": f"I can help you with EMR upgrade. {clean_response}"},
-                {"role": "user", "content": "Thank you for the information. This is very helpful."},
-                {"role": "assistant", "content": "You're welcome! I'll remember your EMR upgrade requirements for future assistance."}
-            ]
-            
-            result = self.memory.add(messages, user_id=self.user_id)
-            
-            # 检查结果是否有效
-            if isinstance(result, dict) and result.get('results') and len(result['results']) > 0:
-                print(f"{self.user_id} 记忆添加成功，提取了 {len(result['results'])} 条记忆")
-                return True
-            else:
-                print(f"{self.user_id} 记忆添加返回空结果")
-                return False
-            
+            return self.add_memories([{"user_query": user_query, "response": response, "metadata": metadata or {}}]) > 0
         except Exception as e:
             logger.error(f"{self.user_id} 添加记忆失败: {str(e)}")
             return False
     
+    def add_memories(self, turns: List[Dict[str, Any]]) -> int:
+        """
+        批量添加多轮对话到记忆存储（一次提取调用）
+        
+        Args:
+            turns: 对话列表，每项包含 user_query、response 和可选的 metadata
+            
+        Returns:
+            提取出的记忆条数；失败时抛出异常，由调用方决定是否重试
+        """
+        if not self.enabled or not self.memory or not turns:
+            return 0
+        
+        # 构建多轮对话格式，清理用户查询和响应中的换行符
+        messages = []
+        for turn in turns:
+            clean_user_query = turn["user_query"][:100].replace('\n', ' ').replace('\r', ' ')
+            clean_response = turn["response"][:200].replace('\n', ' ').replace('\r', ' ')
+            messages.append({"role": "user", "content": f"I need help with Amazon EMR upgrade. {clean_user_query}"})
+            messages.append({"role": "assistant", "content": f"I can help you with EMR upgrade. {clean_response}"})
+        messages.append({"role": "user", "content": "Thank you for the information. This is very helpful."})
+        messages.append({"role": "assistant", "content": "You're welcome! I'll remember your EMR upgrade requirements for future assistance."})
+        
+        result = self.memory.add(messages, user_id=self.user_id, metadata=_merge_metadata(turns))
+        
+        # 检查结果是否有效
+        if isinstance(result, dict) and result.get('results') and len(result['results']) > 0:
+            self._sync_vector_cache(result['results'])
+            print(f"{self.user_id} 记忆添加成功，{len(turns)} 轮对话提取了 {len(result['results'])} 条记忆")
+            return len(result['results'])
+        print(f"{self.user_id} 记忆添加返回空结果")
+        return 0
+    
     def search_memories(self, query: str, limit: int = 5) -> List[Dict]:
         """搜索相关记忆"""
         if not self.enabled or not self.memory:
             return []
         
+        # 记忆数量不多的用户在本地计算相似度，省去远程 kNN 检索
+        if self.opensearch_client is not None:
+            try:
+                memories = self._search_memories_locally(query, limit)
+                if memories is not None:
+                    logger.info(f"找到 {len(memories)} 条相关记忆 (本地向量缓存)")
+                    return memories
+            except Exception as e:
+                logger.warning(f"⚠️ 本地记忆检索失败，改为远程检索: {str(e)}")
+        
         try:
             memories = self.memory.search(query, user_id=self.user_id, limit=limit)
             logger.info(f"找到 {len(memories)} 条相关记忆")
@@ -219,6 +350,13 @@ class Mem0Integration:
         if not self.enabled or not self.memory:
             return []
         
+        # 优先在 OpenSearch 中排序并限制条数，只传输需要的记忆
+        if self.opensearch_client is not None:
+            try:
+                return self._search_recent_memories(limit)
+            except Exception as e:
+                logger.warning(f"⚠️ OpenSearch 查询最近记忆失败，改为读取全部记忆: {str(e)}")
+        
         try:
             # 根据官方文档，使用正确的 API
             all_memories = self.memory.get_all(user_id=self.user_id)
@@ -302,8 +440,19 @@ class Mem0Integration:
         if not self.enabled or not self.memory:
             return False
         
+        # 优先使用 delete_by_query 一次删除该用户的所有记忆
+        if self.opensearch_client is not None:
+            try:
+                memory_vector_cache.invalidate(self.user_id)
+                deleted = self._delete_user_memories()
+                logger.info(f"🗑️ 清除了 {deleted} 条用户记忆")
+                return True
+            except Exception as e:
+                logger.warning(f"⚠️ OpenSearch 批量删除记忆失败，改为逐条删除: {str(e)}")
+        
         try:
             # 获取所有记忆并删除
+            memory_vector_cache.invalidate(self.user_id)
             all_memories = self.memory.get_all(user_id=self.user_id)
             
             for memory in all_memories:
@@ -324,6 +473,13 @@ class Mem0Integration:
         if not self.enabled:
             return {"enabled": False, "total_memories": 0}
         
+        # 优先由 OpenSearch 计算数量和最早/最新时间，不传输记忆内容
+        if self.opensearch_client is not None:
+            try:
+                return self._aggregate_memory_stats()
+            except Exception as e:
+                logger.warning(f"⚠️ OpenSearch 统计记忆失败，改为读取全部记忆: {str(e)}")
+        
         try:
             all_memories = self.memory.get_all(user_id=self.user_id) if self.memory else []
             
@@ -367,6 +523,135 @@ class Mem0Integration:
         except Exception as e:
             logger.error(f"获取记忆统计失败: {str(e)}")
             return {"enabled": False, "error": str(e)}
+    
+    # ---- 直接查询 mem0 在 OpenSearch 中的索引 ----
+    # mem0 的 OpenSearch 向量库将记忆内容和 user_id、created_at 等元数据保存在文档的 payload 字段中
+    
+    def _user_filter(self) -> Dict[str, Any]:
+        return {"bool": {"filter": [{"term": {MEM0_USER_FIELD: self.user_id}}]}}
+    
+    @staticmethod
+    def _hit_to_memory(hit: Dict[str, Any]) -> Dict[str, Any]:
+        """将 OpenSearch 文档转换为与 memory.get_all() 相同的记忆格式"""
+        source = hit.get('_source', {})
+        payload = dict(source.get('payload') or {})
+        memory = {
+            "id": source.get('id', hit.get('_id')),
+            "memory": payload.pop('data', ''),
+        }
+        for key in ('hash', 'created_at', 'updated_at', 'user_id', 'agent_id', 'run_id'):
+            if key in payload:
+                memory[key] = payload.pop(key)
+        memory["metadata"] = payload
+        return memory
+    
+    def _search_recent_memories(self, limit: int) -> List[Dict]:
+        response = self.opensearch_client.search(
+            index=MEM0_INDEX,
+            body={
+                "size": limit,
+                "query": self._user_filter(),
+                "sort": [{MEM0_TIME_FIELD: {"order": "desc", "unmapped_type": "date"}}],
+                "_source": {"excludes": [MEM0_VECTOR_FIELD]}
+            }
+        )
+        return [self._hit_to_memory(hit) for hit in response['hits']['hits']]
+    
+    def _aggregate_memory_stats(self) -> Dict[str, Any]:
+        response = self.opensearch_client.search(
+            index=MEM0_INDEX,
+            body={
+                "size": 0,
+                "track_total_hits": True,
+                "query": self._user_filter(),
+                "aggs": {
+                    "earliest": {"min": {"field": MEM0_TIME_FIELD}},
+                    "latest": {"max": {"field": MEM0_TIME_FIELD}}
+                }
+            }
+        )
+        total = response['hits']['total']
+        stats = {
+            "enabled": True,
+            "total_memories": total['value'] if isinstance(total, dict) else total,
+            "user_id": self.user_id,
+            "opensearch_connected": True
+        }
+        aggregations = response.get('aggregations', {})
+        for key, name in (("earliest", "earliest_memory"), ("latest", "latest_memory")):
+            value = aggregations.get(key, {})
+            if value.get('value') is not None:
+                stats[name] = value.get('value_as_string') or str(value['value'])
+        return stats
+    
+    def _load_memory_vectors(self, max_vectors: int):
+        """加载用户的全部记忆和向量，记忆数超过 max_vectors 时返回 None"""
+        response = self.opensearch_client.search(
+            index=MEM0_INDEX,
+            body={
+                "size": max_vectors + 1,
+                "query": self._user_filter(),
+                "_source": ["id", "payload", MEM0_VECTOR_FIELD]
+            }
+        )
+        hits = response['hits']['hits']
+        if len(hits) > max_vectors:
+            return None
+        memories, vectors = [], []
+        for hit in hits:
+            vector = hit.get('_source', {}).get(MEM0_VECTOR_FIELD)
+            if vector:
+                memories.append(self._hit_to_memory(hit))
+                vectors.append(vector)
+        return memories, vectors
+    
+    def _search_memories_locally(self, query: str, limit: int) -> Optional[List[Dict]]:
+        """在本地向量缓存中检索，用户未被缓存（记忆过多或未启用）时返回 None"""
+        vectors = memory_vector_cache.get(self.user_id, self._load_memory_vectors)
+        if vectors is None:
+            return None
+        if not len(vectors):
+            return []
+        query_vector = self.memory.embedding_model.embed(query, "search")
+        return vectors.top_k(query_vector, limit)
+    
+    def _sync_vector_cache(self, results: List[Dict[str, Any]]):
+        """将 memory.add() 产生的新增/更新/删除同步到本地向量缓存"""
+        deleted_ids = [item['id'] for item in results if item.get('event') == 'DELETE']
+        upsert_ids = [item['id'] for item in results if item.get('event') in ('ADD', 'UPDATE')]
+        try:
+            upserts, upsert_vectors = [], []
+            if upsert_ids:
+                # mem0 写入时已经计算过向量，直接从 OpenSearch 读回，不再调用一次 Titan Embeddings
+                response = self.opensearch_client.search(
+                    index=MEM0_INDEX,
+                    body={
+                        "size": len(upsert_ids),
+                        "query": {"bool": {"filter": [{"terms": {"id": upsert_ids}}]}},
+                        "_source": ["id", "payload", MEM0_VECTOR_FIELD]
+                    }
+                )
+                for hit in response['hits']['hits']:
+                    vector = hit.get('_source', {}).get(MEM0_VECTOR_FIELD)
+                    if vector:
+                        upserts.append(self._hit_to_memory(hit))
+                        upsert_vectors.append(vector)
+                if len(upserts) < len(set(upsert_ids)):
+                    # 新写入的文档尚未刷新到可检索状态，下次检索时重新加载
+                    memory_vector_cache.invalidate(self.user_id)
+                    return
+            memory_vector_cache.apply_changes(self.user_id, upserts, upsert_vectors, deleted_ids)
+        except Exception as e:
+            logger.warning(f"⚠️ 同步本地记忆向量失败，下次检索时重新加载: {str(e)}")
+            memory_vector_cache.invalidate(self.user_id)
+    
+    def _delete_user_memories(self) -> int:
+        response = self.opensearch_client.delete_by_query(
+            index=MEM0_INDEX,
+            body={"query": self._user_filter()},
+            params={"refresh": "true", "conflicts": "proceed"}
+        )
+        return response.get('deleted', 0)
 
 
 # 工厂函数：为每次浏览器会话创建新的 Mem0 实例
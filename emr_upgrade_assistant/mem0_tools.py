@@ -5,18 +5,22 @@ Mem0 工具集 - 为 Strands Agent 提供记忆功能
 from strands import tool
 from typing import List, Dict, Any
 from mem0_integration import create_mem0_integration
-import threading
+import contextvars
 
-# 线程本地存储，用于存储当前用户的 mem0 实例
-_thread_local = threading.local()
+# 当前请求的用户 mem0 实例。
+# 所有请求共用一个事件循环线程，threading.local 会被并发的请求互相覆盖；
+# ContextVar 按 asyncio 任务隔离，创建任务和 asyncio.to_thread（Strands 在线程中执行同步工具）
+# 时都会复制当前上下文，因此工具调用中读取到的始终是发起该调用的请求的用户
+_current_user_mem0 = contextvars.ContextVar('current_user_mem0', default=None)
 
 def set_current_user_mem0(user_mem0):
-    """设置当前线程的用户 mem0 实例"""
-    _thread_local.user_mem0 = user_mem0
+    """设置当前请求（asyncio 任务上下文）的用户 mem0 实例"""
+    return _current_user_mem0.set(user_mem0)
 
 def get_current_user_mem0():
-    """获取当前线程的用户 mem0 实例"""
-    return getattr(_thread_local, 'user_mem0', None)
+    """获取当前请求的用户 mem0 实例"""
+    return _current_user_mem0.get()
+
 import logging
 
 logger = logging.getLogger(__name__)
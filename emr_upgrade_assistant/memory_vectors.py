@@ -0,0 +1,166 @@
+"""
+用户记忆向量缓存 - 在进程内保存每个用户的记忆文本和向量，检索相关记忆时在本地计算相似度
+
+大多数用户只有几十条记忆，每轮对话都到 OpenSearch 做一次 kNN 检索并不划算；
+首次使用时一次性加载该用户的全部记忆向量，之后随记忆的新增/更新/删除增量维护。
+记忆数量超过上限的用户不缓存，继续使用远程检索。
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger('emr_assistant')
+
+
+class UserMemoryVectors:
+    """单个用户的记忆及其向量矩阵（按行归一化，float32）"""
+
+    def __init__(self, memories: List[Dict[str, Any]], vectors: List[List[float]]):
+        self.memories = memories
+        self.matrix = self._normalize(np.asarray(vectors, dtype=np.float32)) if vectors else None
+        self.loaded_at = time.monotonic()
+
+    @staticmethod
+    def _normalize(matrix):
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def __len__(self) -> int:
+        return len(self.memories)
+
+    def top_k(self, query_vector: List[float], limit: int) -> List[Dict[str, Any]]:
+        """返回与查询向量最相似的 limit 条记忆（附带 score）"""
+        if self.matrix is None or not self.memories:
+            return []
+        query = self._normalize(np.asarray(query_vector, dtype=np.float32))[0]
+        scores = self.matrix @ query
+        limit = min(limit, len(scores))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [dict(self.memories[i], score=float(scores[i])) for i in top]
+
+    def with_changes(self, upserts: List[Dict[str, Any]], upsert_vectors: List[List[float]],
+                     deleted_ids: List[str]) -> 'UserMemoryVectors':
+        """返回应用了新增/更新/删除后的新对象（不修改当前对象，读取方无需加锁）"""
+        removed = set(deleted_ids) | {memory["id"] for memory in upserts}
+        keep = [i for i, memory in enumerate(self.memories) if memory["id"] not in removed]
+        memories = [self.memories[i] for i in keep] + list(upserts)
+        vectors = [self.matrix[i] for i in keep] if self.matrix is not None else []
+        vectors.extend(np.asarray(v, dtype=np.float32) for v in upsert_vectors)
+        return UserMemoryVectors(memories, vectors)
+
+
+class MemoryVectorCache:
+    """
+    按用户缓存记忆向量
+
+    配置项（环境变量）：
+    - MEMORY_VECTOR_CACHE_ENABLED: 是否启用（默认 true，需要安装 numpy）
+    - MEMORY_VECTOR_CACHE_MAX_USERS: 最多缓存的用户数，超出时按 LRU 淘汰
+    - MEMORY_VECTOR_CACHE_MAX_VECTORS: 单个用户可缓存的最大记忆数，超过则使用远程检索
+    - MEMORY_VECTOR_CACHE_TTL: 缓存的有效期（秒），过期后重新加载（覆盖其他进程写入的记忆）
+    """
+
+    def __init__(self):
+        self.enabled = np is not None and os.getenv('MEMORY_VECTOR_CACHE_ENABLED', 'true').lower() == 'true'
+        self.max_users = int(os.getenv('MEMORY_VECTOR_CACHE_MAX_USERS', 500))
+        self.max_vectors = int(os.getenv('MEMORY_VECTOR_CACHE_MAX_VECTORS', 2000))
+        self.ttl = int(os.getenv('MEMORY_VECTOR_CACHE_TTL', 1800))
+
+        # user_id -> UserMemoryVectors；记忆过多的用户对应 None（在有效期内不再尝试加载）
+        self._entries: "OrderedDict[str, Optional[UserMemoryVectors]]" = OrderedDict()
+        self._too_large_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.loads = 0
+        self.fallbacks = 0
+
+    def get(self, user_id: str, loader: Callable[[int], Optional[tuple]]) -> Optional[UserMemoryVectors]:
+        """
+        获取用户的记忆向量，未缓存时调用 loader 加载
+
+        Args:
+            loader: loader(max_vectors) 返回 (memories, vectors)，记忆数超过 max_vectors 时返回 None
+
+        Returns:
+            UserMemoryVectors；未启用或用户记忆过多时返回 None，调用方应使用远程检索
+        """
+        if not self.enabled:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            if user_id in self._entries:
+                entry = self._entries[user_id]
+                loaded_at = entry.loaded_at if entry is not None else self._too_large_at.get(user_id, 0)
+                if now - loaded_at < self.ttl:
+                    self._entries.move_to_end(user_id)
+                    if entry is None:
+                        self.fallbacks += 1
+                    else:
+                        self.hits += 1
+                    return entry
+                self._entries.pop(user_id)
+                self._too_large_at.pop(user_id, None)
+
+        loaded = loader(self.max_vectors)
+        entry = UserMemoryVectors(*loaded) if loaded is not None else None
+        with self._lock:
+            self.loads += 1
+            if entry is None:
+                self.fallbacks += 1
+                self._too_large_at[user_id] = now
+                logger.info(f"📚 用户 {user_id} 的记忆超过 {self.max_vectors} 条，使用远程检索")
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                old_user_id, _ = self._entries.popitem(last=False)
+                self._too_large_at.pop(old_user_id, None)
+        return entry
+
+    def apply_changes(self, user_id: str, upserts: List[Dict[str, Any]], upsert_vectors: List[List[float]],
+                      deleted_ids: List[str]):
+        """将新增/更新/删除的记忆同步到已缓存的用户（未缓存的用户忽略）"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            updated = entry.with_changes(upserts, upsert_vectors, deleted_ids)
+            if len(updated) > self.max_vectors:
+                self._entries.pop(user_id)
+                return
+            # 增量更新不改变加载时间，到期后仍会完整重新加载
+            updated.loaded_at = entry.loaded_at
+            self._entries[user_id] = updated
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._too_large_at.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "users": len(self._entries),
+                "vectors": sum(len(entry) for entry in self._entries.values() if entry is not None),
+                "max_users": self.max_users,
+                "max_vectors": self.max_vectors,
+                "hits": self.hits,
+                "loads": self.loads,
+                "fallbacks": self.fallbacks,
+            }
+
@@ -0,0 +1,200 @@
+"""
+长期记忆异步写入 - 对话结束后只把待写入的内容放入队列，由后台线程批量写入 mem0
+
+mem0 写入包含一次 LLM 记忆提取、向量计算和 OpenSearch 写入，耗时数秒；
+放到后台后不再占用事件循环，也不会延迟用户看到的响应结束。
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger('emr_assistant')
+
+
+class _UserQueue:
+    """单个用户待写入的对话"""
+
+    __slots__ = ('mem0', 'turns', 'attempts', 'not_before')
+
+    def __init__(self, mem0):
+        self.mem0 = mem0
+        self.turns: List[Dict[str, Any]] = []
+        # 队首批次已失败的次数，以及下一次重试的最早时间
+        self.attempts = 0
+        self.not_before = 0.0
+
+
+class MemoryWriter:
+    """
+    mem0 长期记忆的后台写入队列
+
+    - 队列有上限，满时丢弃新的对话并记录指标，不阻塞请求
+    - 同一用户积压的多轮对话合并为一次写入（一次记忆提取调用）
+    - 写入失败按指数退避重试，超过重试次数后丢弃
+    - 服务停止时在限定时间内写完队列中的剩余对话
+
+    配置项（环境变量）：
+    - MEMORY_WRITE_QUEUE_SIZE: 队列中最多等待写入的对话轮数
+    - MEMORY_WRITE_BATCH_SIZE: 每次写入合并的最大轮数
+    - MEMORY_WRITE_BATCH_DELAY: 对话入队后等待同一用户后续对话的秒数
+    - MEMORY_WRITE_MAX_RETRIES: 写入失败后的最大重试次数
+    - MEMORY_WRITE_RETRY_BACKOFF: 第一次重试前等待的秒数，之后每次翻倍
+    - MEMORY_WRITE_DRAIN_TIMEOUT: 服务停止时等待队列写完的最长秒数
+    """
+
+    def __init__(self):
+        self.max_queue = int(os.getenv('MEMORY_WRITE_QUEUE_SIZE', 1000))
+        self.batch_size = int(os.getenv('MEMORY_WRITE_BATCH_SIZE', 5))
+        self.batch_delay = float(os.getenv('MEMORY_WRITE_BATCH_DELAY', 2))
+        self.max_retries = int(os.getenv('MEMORY_WRITE_MAX_RETRIES', 3))
+        self.retry_backoff = float(os.getenv('MEMORY_WRITE_RETRY_BACKOFF', 2))
+        self.drain_timeout = float(os.getenv('MEMORY_WRITE_DRAIN_TIMEOUT', 30))
+
+        # 按首次入队顺序排列的用户队列
+        self._pending: "OrderedDict[str, _UserQueue]" = OrderedDict()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        """启动后台写入线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='memory-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id: str, user_mem0, user_query: str, response: str,
+               metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        提交一轮对话，立即返回
+
+        Returns:
+            是否已放入队列（队列已满或已停止时返回 False）
+        """
+        with self._cond:
+            if self._stopping or self._size >= self.max_queue:
+                self.dropped += 1
+                metrics.incr("memory_writer.dropped")
+                logger.warning(f"⚠️ 长期记忆写入队列已满，丢弃用户 {user_id} 的对话")
+                return False
+            queue = self._pending.get(user_id)
+            if queue is None:
+                queue = self._pending[user_id] = _UserQueue(user_mem0)
+            else:
+                queue.mem0 = user_mem0
+            queue.turns.append({
+                "user_query": user_query,
+                "response": response,
+                "metadata": metadata or {},
+                "enqueued_at": time.monotonic(),
+            })
+            self._size += 1
+            self.submitted += 1
+            self._cond.notify()
+        metrics.incr("memory_writer.submitted")
+        return True
+
+    def _next_batch(self, now: float):
+        """在持有锁的情况下取出下一个可以写入的批次"""
+        for user_id, queue in self._pending.items():
+            if not self._stopping:
+                if queue.not_before > now:
+                    continue
+                # 队列未满一批时稍等片刻，让同一用户连续的对话合并写入
+                if len(queue.turns) < self.batch_size and now - queue.turns[0]["enqueued_at"] < self.batch_delay:
+                    continue
+            batch = queue.turns[:self.batch_size]
+            del queue.turns[:self.batch_size]
+            attempts = queue.attempts
+            queue.attempts = 0
+            if not queue.turns:
+                del self._pending[user_id]
+            self._size -= len(batch)
+            return user_id, queue.mem0, batch, attempts
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping and not self._pending:
+                        return
+                    item = self._next_batch(time.monotonic())
+                    if item is not None:
+                        break
+                    self._cond.wait(timeout=0.5)
+            self._write(*item)
+
+    def _write(self, user_id: str, user_mem0, batch: List[Dict[str, Any]], attempts: int):
+        start_time = time.perf_counter()
+        try:
+            user_mem0.add_memories(batch)
+        except Exception as e:
+            attempts += 1
+            if attempts > self.max_retries:
+                with self._cond:
+                    self.failed += len(batch)
+                metrics.incr("memory_writer.failed", len(batch))
+                logger.error(f"❌ 用户 {user_id} 的长期记忆写入失败，已重试 {self.max_retries} 次，丢弃 {len(batch)} 轮对话: {str(e)}")
+                return
+            delay = self.retry_backoff * (2 ** (attempts - 1))
+            logger.warning(f"⚠️ 用户 {user_id} 的长期记忆写入失败，{delay:.0f} 秒后第 {attempts} 次重试: {str(e)}")
+            metrics.incr("memory_writer.retry")
+            with self._cond:
+                # 放回该用户队列的最前面，保持对话顺序
+                queue = self._pending.get(user_id)
+                if queue is None:
+                    queue = self._pending[user_id] = _UserQueue(user_mem0)
+                    self._pending.move_to_end(user_id, last=False)
+                queue.turns[0:0] = batch
+                queue.attempts = attempts
+                queue.not_before = time.monotonic() + delay
+                self._size += len(batch)
+            return
+
+        with self._cond:
+            self.written += len(batch)
+        metrics.incr("memory_writer.written", len(batch))
+        metrics.observe("memory_writer.write", (time.perf_counter() - start_time) * 1000)
+        logger.debug(f"💾 用户 {user_id} 的 {len(batch)} 轮对话已写入长期记忆")
+
+    def close(self, timeout: Optional[float] = None):
+        """停止接收新的对话，在 timeout 秒内写完队列中的剩余对话"""
+        timeout = self.drain_timeout if timeout is None else timeout
+        with self._cond:
+            self._stopping = True
+            pending = self._size
+            self._cond.notify_all()
+        if self._thread is None:
+            return
+        if pending:
+            logger.info(f"⏳ 正在写入队列中剩余的 {pending} 轮对话...")
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"❌ 长期记忆写入队列未能在 {timeout:.0f} 秒内写完，剩余 {self._size} 轮对话未保存")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queued": self._size,
+                "users": len(self._pending),
+                "max_queue": self.max_queue,
+                "batch_size": self.batch_size,
+                "submitted": self.submitted,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
@@ -0,0 +1,45 @@
+"""
+进程内运行指标 - 记录计数器和耗时统计，通过 /metrics 接口查看
+"""
+
+import threading
+from typing import Any, Dict
+
+
+class Metrics:
+    """线程安全的计数器和耗时统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: int = 1):
+        """计数器加 value"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value_ms: float):
+        """记录一次耗时（毫秒）"""
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+            timing["count"] += 1
+            timing["total_ms"] += value_ms
+            timing["max_ms"] = max(timing["max_ms"], value_ms)
+            timing["last_ms"] = value_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回当前所有指标"""
+        with self._lock:
+            timings = {}
+            for name, timing in self._timings.items():
+                timings[name] = dict(timing)
+                timings[name]["avg_ms"] = round(timing["total_ms"] / timing["count"], 1) if timing["count"] else 0.0
+                timings[name]["total_ms"] = round(timing["total_ms"], 1)
+            return {"counters": dict(self._counters), "timings": timings}
+
+
+# 进程级全局实例
+metrics = Metrics()
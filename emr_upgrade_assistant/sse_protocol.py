@@ -0,0 +1,103 @@
+"""
+/chat 流式响应的 SSE 事件协议
+
+- 协议 v2（默认）：每个事件带有协议版本 v 和单调递增的序号 seq（同时写入 SSE 的 id 字段），
+  content 事件只包含增量内容，客户端自行拼接
+- 协议 v1（兼容）：沿用旧格式，content 事件额外携带完整的 accumulated 字段，
+  供现有 templates/index.html 使用，需要在请求中显式指定 protocol=1
+"""
+
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+PROTOCOL_VERSION = 2
+LEGACY_PROTOCOL_VERSION = 1
+SUPPORTED_PROTOCOLS = (LEGACY_PROTOCOL_VERSION, PROTOCOL_VERSION)
+
+
+def resolve_protocol(value: Any) -> int:
+    """解析客户端请求的协议版本，无法识别时使用默认的 v2"""
+    try:
+        protocol = int(value)
+    except (TypeError, ValueError):
+        return PROTOCOL_VERSION
+    return protocol if protocol in SUPPORTED_PROTOCOLS else PROTOCOL_VERSION
+
+
+class SSEEncoder:
+    """将流式事件编码为 SSE 文本"""
+
+    def __init__(self, protocol: int = PROTOCOL_VERSION):
+        self.protocol = protocol
+        self.seq = 0
+        # 仅在兼容模式下维护，用于生成 accumulated 字段
+        self._accumulated = ""
+
+    @property
+    def legacy(self) -> bool:
+        return self.protocol == LEGACY_PROTOCOL_VERSION
+
+    def _dumps(self, payload: Dict[str, Any]) -> str:
+        """序列化事件，失败时退化为只包含基础字段的简化事件"""
+        try:
+            return json.dumps(payload, ensure_ascii=False)
+        except Exception:
+            simplified = {
+                key: payload[key] for key in ('v', 'seq', 'type') if key in payload
+            }
+            simplified["content"] = str(payload.get("content", ""))
+            simplified["timestamp"] = datetime.now().isoformat()
+            return json.dumps(simplified, ensure_ascii=False)
+
+    def encode(self, event: Dict[str, Any], seq: Optional[int] = None, transient: bool = False) -> str:
+        """
+        编码一个事件，返回完整的 SSE 消息
+
+        Args:
+            event: 事件内容
+            seq: 事件在流中的序号，默认使用编码器内部递增的序号
+            transient: 为 True 时不分配序号（心跳等不进入回放缓冲区的事件）
+        """
+        if not transient:
+            self.seq = seq if seq is not None else self.seq + 1
+
+        if self.legacy:
+            payload = dict(event)
+            if payload.pop("placeholder", False):
+                # 占位提示在旧协议中作为 content 发送，后续的 accumulated 会覆盖它
+                content = f"{payload.pop('message', '')}\n\n"
+                payload.update({"type": "content", "content": content, "accumulated": content})
+            elif payload.get("type") == "content":
+                self._accumulated += payload.get("content") or ""
+                payload["accumulated"] = self._accumulated
+            return f"data: {self._dumps(payload)}\n\n"
+
+        payload = {"v": self.protocol}
+        if not transient:
+            payload["seq"] = self.seq
+        payload.update(event)
+        payload.pop("placeholder", None)
+        if transient:
+            return f"data: {self._dumps(payload)}\n\n"
+        return f"id: {self.seq}\ndata: {self._dumps(payload)}\n\n"
+
+    @staticmethod
+    def comment(text: str) -> str:
+        """SSE 注释行，客户端会忽略，用于填充和保持连接"""
+        return f": {text}\n\n"
+
+
+def placeholder_event(message: str) -> Dict[str, Any]:
+    """
+    生成"正在思考"之类的占位事件
+
+    v2 中作为普通 status 事件发送，避免污染增量拼接的回答内容；
+    v1 中由编码器转换为 content 事件
+    """
+    return {
+        "type": "status",
+        "message": message,
+        "placeholder": True,
+        "timestamp": datetime.now().isoformat()
+    }
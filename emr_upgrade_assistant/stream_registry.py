@@ -0,0 +1,300 @@
+"""
+可恢复的流式响应 - 为每次 /chat 生成分配 stream_id 并缓存已产生的事件
+
+Agent 在后台任务中运行，事件写入有上限的回放缓冲区（超出上限时可溢出到磁盘）。
+SSE 连接只是缓冲区的订阅者：连接断开后，客户端携带 Last-Event-ID 重新连接即可
+接上仍在运行的生成过程，或回放已完成的结果，而不会重新运行 Agent。
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger('emr_assistant')
+
+# 不写入回放缓冲区的事件类型（由订阅方自行产生）
+TRANSIENT_EVENT_TYPES = ('heartbeat',)
+# 回放磁盘上的事件时每批读取的数量
+SPILL_READ_BATCH = 500
+
+
+class StreamSession:
+    """一次流式生成的事件缓冲区"""
+
+    def __init__(self, stream_id: str, user_id: str, max_events: int, spill_dir: Optional[str] = None,
+                 key: Optional[str] = None):
+        self.stream_id = stream_id
+        self.user_id = user_id
+        # 请求内容的标识，用于合并同一用户重复提交的相同问题
+        self.key = key
+        self.max_events = max_events
+        self.spill_path = os.path.join(spill_dir, f"{stream_id}.jsonl") if spill_dir else None
+
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+        self._events = deque()  # (seq, event)
+        self._first_seq = 1  # 内存中最早事件的序号
+        self._spilled = 0  # 已写入磁盘的事件数量
+        # 已落盘事件在文件中的字节偏移（seq -> offset），回放时直接定位到请求的事件
+        self._spill_offsets: Dict[int, int] = {}
+        self.last_seq = 0
+        self._cond = asyncio.Condition()
+
+        # 当前连接的订阅者数量，降为 0 时通知注册表（用于断开连接后取消生成）
+        self.subscribers = 0
+        self.on_detached: Optional[Callable[['StreamSession'], None]] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def _spill(self, events: List[Tuple[int, Dict[str, Any]]]) -> Dict[int, int]:
+        """把事件追加到磁盘文件（在线程中执行），返回每个事件的字节偏移"""
+        offsets = {}
+        with open(self.spill_path, 'ab') as f:
+            for seq, event in events:
+                offsets[seq] = f.tell()
+                f.write((json.dumps([seq, event], ensure_ascii=False, default=str) + "\n").encode('utf-8'))
+        return offsets
+
+    async def append(self, event: Dict[str, Any]) -> int:
+        """追加一个事件，返回分配的序号（事件只由 _pump 顺序追加）"""
+        async with self._cond:
+            self.last_seq += 1
+            seq = self.last_seq
+            self._events.append((seq, event))
+            overflow = len(self._events) - self.max_events
+            if overflow > 0 and not self.spill_path:
+                for _ in range(overflow):
+                    self._events.popleft()
+                self._first_seq = self._events[0][0]
+                overflow = 0
+            self._cond.notify_all()
+
+        if overflow > 0:
+            # 磁盘写入不占用事件循环，也不持有锁；写完后再从内存中移除，期间读取方仍能从内存读到这些事件
+            spill = [self._events[i] for i in range(overflow)]
+            try:
+                offsets = await asyncio.to_thread(self._spill, spill)
+                self._spill_offsets.update(offsets)
+                self._spilled += len(offsets)
+            except Exception as e:
+                logger.error(f"⚠️ 回放缓冲区溢出写入磁盘失败 ({self.stream_id}): {str(e)}")
+            async with self._cond:
+                for _ in range(overflow):
+                    self._events.popleft()
+                self._first_seq = self._events[0][0]
+        return seq
+
+    async def finish(self):
+        async with self._cond:
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def _read_spilled(self, from_seq: int, count: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """从磁盘读取从 from_seq 开始的最多 count 个事件（在线程中执行），from_seq 未落盘时返回空列表"""
+        events = []
+        offset = self._spill_offsets.get(from_seq)
+        if offset is None or not os.path.exists(self.spill_path):
+            return events
+        with open(self.spill_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                seq, event = json.loads(line)
+                events.append((seq, event))
+                if len(events) >= count:
+                    break
+        return events
+
+    async def subscribe(self, after_seq: int = 0, heartbeat_interval: float = 5.0) -> AsyncIterator[Tuple[Optional[int], Dict[str, Any]]]:
+        """
+        订阅序号大于 after_seq 的事件
+
+        先回放缓冲区中已有的事件，然后等待新事件直到生成结束。
+        等待期间每 heartbeat_interval 秒产生一个不带序号的心跳事件。
+
+        Yields:
+            (seq, event) 元组，心跳和提示事件的 seq 为 None
+        """
+        self.subscribers += 1
+        try:
+            async for item in self._iter_events(after_seq, heartbeat_interval):
+                yield item
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished and self.on_detached:
+                self.on_detached(self)
+
+    async def _iter_events(self, after_seq: int, heartbeat_interval: float):
+        next_seq = after_seq + 1
+        while True:
+            while next_seq < self._first_seq:
+                # 分批回放磁盘上的事件，每批在线程中读取
+                spilled = await asyncio.to_thread(
+                    self._read_spilled, next_seq, min(self._first_seq - next_seq, SPILL_READ_BATCH)
+                )
+                spilled = [item for item in spilled if item[0] < self._first_seq]
+                if not spilled or spilled[0][0] != next_seq:
+                    break
+                for seq, event in spilled:
+                    yield seq, event
+                next_seq = spilled[-1][0] + 1
+            if next_seq < self._first_seq:
+                # 请求的事件已被淘汰且没有落盘，告知客户端存在缺口后从内存中最早的事件继续
+                yield None, {"type": "gap", "from_seq": next_seq, "to_seq": self._first_seq - 1}
+                next_seq = self._first_seq
+
+            while next_seq <= self.last_seq and next_seq >= self._first_seq:
+                seq, event = self._events[next_seq - self._first_seq]
+                yield seq, event
+                next_seq = seq + 1
+
+            if next_seq > self.last_seq and self.finished:
+                return
+
+            async with self._cond:
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: next_seq <= self.last_seq or self.finished),
+                        timeout=heartbeat_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            if next_seq > self.last_seq and not self.finished:
+                yield None, {"type": "heartbeat"}
+
+    def cleanup(self):
+        """删除溢出到磁盘的事件文件"""
+        if self.spill_path and os.path.exists(self.spill_path):
+            try:
+                os.remove(self.spill_path)
+            except OSError as e:
+                logger.warning(f"⚠️ 删除回放文件失败 ({self.spill_path}): {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stream_id": self.stream_id,
+            "last_seq": self.last_seq,
+            "buffered": len(self._events),
+            "spilled": self._spilled,
+            "finished": self.finished,
+        }
+
+
+class StreamRegistry:
+    """
+    进程内的流式生成注册表
+
+    配置项（环境变量）：
+    - STREAM_REPLAY_MAX_EVENTS: 每个流在内存中保留的最大事件数
+    - STREAM_REPLAY_SPILL_DIR: 超出上限的事件写入的目录，不设置则直接丢弃最早的事件
+    - STREAM_REPLAY_TTL: 生成结束后保留回放数据的秒数
+    - STREAM_REPLAY_MAX_STREAMS: 最多保留的流数量
+    - STREAM_DISCONNECT_GRACE: 所有连接断开后等待重连的秒数，超时仍无连接则取消生成
+    """
+
+    def __init__(self):
+        self.max_events = int(os.getenv('STREAM_REPLAY_MAX_EVENTS', 5000))
+        self.spill_dir = os.getenv('STREAM_REPLAY_SPILL_DIR') or None
+        self.ttl = int(os.getenv('STREAM_REPLAY_TTL', 300))
+        self.max_streams = int(os.getenv('STREAM_REPLAY_MAX_STREAMS', 500))
+        self.disconnect_grace = float(os.getenv('STREAM_DISCONNECT_GRACE', 10))
+        if self.spill_dir and not os.path.exists(self.spill_dir):
+            os.makedirs(self.spill_dir)
+        self._streams: Dict[str, StreamSession] = {}
+
+    def _purge(self):
+        """清理过期的已完成流，并在数量超限时淘汰最早完成的流"""
+        now = time.time()
+        expired = [s for s in self._streams.values() if s.finished and now - s.finished_at > self.ttl]
+        finished = sorted((s for s in self._streams.values() if s.finished and s not in expired),
+                          key=lambda s: s.finished_at)
+        overflow = len(self._streams) - len(expired) - self.max_streams
+        if overflow > 0:
+            expired.extend(finished[:overflow])
+        for stream in expired:
+            self._streams.pop(stream.stream_id, None)
+            stream.cleanup()
+
+    async def start(self, user_id: str, events: AsyncIterator[Dict[str, Any]],
+                    preamble: Optional[List[Dict[str, Any]]] = None, key: Optional[str] = None) -> StreamSession:
+        """
+        创建一个新的流并在后台任务中消费 events
+
+        Args:
+            user_id: 流所属的用户，重连时校验
+            events: 事件的异步迭代器（例如 process_query_stream）
+            preamble: 在 stream 事件之后、生成开始前写入缓冲区的事件
+            key: 请求内容的标识，见 find_active()
+        """
+        self._purge()
+        stream = StreamSession(uuid.uuid4().hex, user_id, self.max_events, self.spill_dir, key=key)
+        self._streams[stream.stream_id] = stream
+        stream.on_detached = self._schedule_cancel
+        # 第一个事件告知客户端 stream_id，用于断线重连
+        await stream.append({"type": "stream", "stream_id": stream.stream_id})
+        for event in preamble or []:
+            await stream.append(event)
+        stream.task = asyncio.create_task(self._pump(stream, events))
+        logger.debug(f"📡 创建流 {stream.stream_id} (用户 {user_id})")
+        return stream
+
+    async def _pump(self, stream: StreamSession, events: AsyncIterator[Dict[str, Any]]):
+        """后台消费事件并写入缓冲区，与 SSE 连接是否存在无关"""
+        try:
+            async for event in events:
+                if event.get("type") in TRANSIENT_EVENT_TYPES:
+                    continue
+                await stream.append(event)
+            await stream.append({"type": "end"})
+        except asyncio.CancelledError:
+            logger.info(f"🛑 流 {stream.stream_id} 已取消")
+            await stream.append({"type": "error", "error": "生成已取消"})
+            # 继续抛出，任务保持"已取消"状态，调用方和服务停止流程可以区分取消和正常完成
+            raise
+        except Exception as e:
+            logger.error(f"❌ 流 {stream.stream_id} 生成失败: {str(e)}")
+            await stream.append({"type": "error", "error": str(e)})
+        finally:
+            await stream.finish()
+
+    def _schedule_cancel(self, stream: StreamSession):
+        """所有订阅者断开后，等待一段时间仍无人重连则取消生成"""
+        logger.info(f"🔌 流 {stream.stream_id} 的客户端已断开，{self.disconnect_grace:.0f} 秒内未重连将取消生成")
+        asyncio.get_running_loop().call_later(self.disconnect_grace, self._cancel_if_detached, stream)
+
+    def _cancel_if_detached(self, stream: StreamSession):
+        if stream.subscribers > 0 or stream.finished or stream.task is None or stream.task.done():
+            return
+        logger.info(f"🛑 流 {stream.stream_id} 无人订阅，取消 Agent 生成")
+        metrics.incr("streams.cancelled_on_disconnect")
+        stream.task.cancel()
+
+    def get(self, stream_id: str) -> Optional[StreamSession]:
+        return self._streams.get(stream_id)
+
+    def find_active(self, user_id: str, key: str) -> Optional[StreamSession]:
+        """查找该用户仍在运行、且请求标识相同的流"""
+        for stream in self._streams.values():
+            if stream.user_id == user_id and stream.key == key and not stream.finished:
+                return stream
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len(self._streams),
+            "running": sum(1 for s in self._streams.values() if not s.finished),
+            "max_events": self.max_events,
+            "spill_dir": self.spill_dir,
+            "ttl": self.ttl,
+            "disconnect_grace": self.disconnect_grace,
+        }
@@ -0,0 +1,242 @@
+"""
+工具目录缓存 - 缓存所有 MCP 服务器的工具定义，避免每次请求都调用 list_tools_sync()
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from strands.tools.mcp import MCPAgentTool
+from strands.types.tools import AgentTool
+
+from tool_memo import MemoizedTool
+
+logger = logging.getLogger('emr_assistant')
+
+
+class PooledMCPTool(AgentTool):
+    """
+    绑定到 MCP 连接池而不是某个具体客户端的工具
+
+    工具定义来自缓存，只有真正被调用时才从连接池借用一个客户端，
+    调用结束后立即归还，因此可以被多个 Agent 共享。
+    """
+
+    def __init__(self, agent_tool: MCPAgentTool, pool):
+        super().__init__()
+        self.mcp_tool = agent_tool.mcp_tool
+        self.pool = pool
+        self._tool_name = agent_tool.tool_name
+        self._tool_spec = agent_tool.tool_spec
+        self._tool_type = agent_tool.tool_type
+
+    @property
+    def tool_name(self) -> str:
+        return self._tool_name
+
+    @property
+    def tool_spec(self):
+        return self._tool_spec
+
+    @property
+    def tool_type(self) -> str:
+        return self._tool_type
+
+    async def _acquire(self):
+        """在线程中借用客户端；等待期间被取消时，借到的客户端会被立即归还"""
+        future = asyncio.ensure_future(asyncio.to_thread(self.pool.acquire))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(
+                lambda f: self.pool.release(f.result()) if not f.cancelled() and f.exception() is None else None
+            )
+            raise
+
+    async def stream(self, tool_use, invocation_state, **kwargs):
+        # 请求被取消（例如客户端断开）时，CancelledError 会从这里传入正在进行的 MCP 调用，
+        # finally 保证客户端归还连接池
+        client = await self._acquire()
+        try:
+            async for event in MCPAgentTool(self.mcp_tool, client).stream(tool_use, invocation_state, **kwargs):
+                yield event
+        finally:
+            self.pool.release(client)
+
+
+class _ServerTools:
+    """单个 MCP 服务器的缓存条目"""
+
+    __slots__ = ('tools', 'fingerprint', 'generation', 'refreshed_at', 'error')
+
+    def __init__(self):
+        self.tools: List[PooledMCPTool] = []
+        self.fingerprint = None
+        self.generation = None
+        self.refreshed_at = None
+        self.error = None
+
+
+class ToolCatalog:
+    """
+    MCP 工具目录缓存
+
+    - 首次使用时加载所有服务器的工具定义，之后直接返回合并好的工具列表
+    - 后台线程在 TTL 到期或检测到服务器重启（连接池启动了新的客户端）时刷新
+    - 刷新时比较工具定义的指纹，只在工具发生变化时替换缓存
+    - 单个服务器刷新失败时保留上一次的结果
+    """
+
+    def __init__(self, mcp_pools, servers: List[str], static_tools: Optional[List[Any]] = None,
+                 required: Optional[List[str]] = None, ttl: int = None, check_interval: int = None,
+                 tool_memo=None, memo_servers: Optional[List[str]] = None):
+        self.mcp_pools = mcp_pools
+        self.servers = list(servers)
+        self.static_tools = list(static_tools or [])
+        self.required = set(required or [])
+        # 这些服务器的工具调用结果通过 tool_memo 缓存
+        self.tool_memo = tool_memo
+        self.memo_servers = set(memo_servers or [])
+        self.ttl = ttl if ttl is not None else int(os.getenv('TOOL_CATALOG_TTL', 3600))
+        self.check_interval = check_interval if check_interval is not None else int(os.getenv('TOOL_CATALOG_CHECK_INTERVAL', 30))
+
+        self._entries: Dict[str, _ServerTools] = {name: _ServerTools() for name in self.servers}
+        self._merged: Optional[List[Any]] = None
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.refresh_count = 0
+        # 合并后的工具列表每变化一次加一，缓存的 Agent 可据此判断工具是否过期
+        self.version = 0
+
+    @staticmethod
+    def _fingerprint(tools: List[Any]) -> str:
+        """根据工具名称和参数定义计算指纹，用于检测工具是否发生变化"""
+        specs = sorted((json.dumps(tool.tool_spec, sort_keys=True, default=str) for tool in tools))
+        return hashlib.sha256("\n".join(specs).encode('utf-8')).hexdigest()
+
+    def _refresh_server(self, name: str) -> bool:
+        """刷新单个服务器的工具定义，返回工具是否发生变化"""
+        pool = self.mcp_pools.get(name)
+        entry = self._entries[name]
+        start_time = time.monotonic()
+        try:
+            with pool.borrow() as client:
+                agent_tools = client.list_tools_sync()
+        except Exception as e:
+            entry.error = str(e)
+            if name in self.required and entry.fingerprint is None:
+                raise
+            logger.error(f"⚠️ 刷新 MCP 服务器 [{name}] 的工具失败，保留旧的工具列表: {str(e)}")
+            return False
+
+        fingerprint = self._fingerprint(agent_tools)
+        changed = fingerprint != entry.fingerprint
+        if changed:
+            entry.tools = [PooledMCPTool(tool, pool) for tool in agent_tools]
+            if self.tool_memo is not None and name in self.memo_servers:
+                entry.tools = [MemoizedTool(tool, self.tool_memo) for tool in entry.tools]
+            entry.fingerprint = fingerprint
+            logger.info(f"🔧 MCP 服务器 [{name}] 工具已更新: {len(agent_tools)} 个工具，耗时 {time.monotonic() - start_time:.2f}秒")
+        entry.generation = pool.generation
+        entry.refreshed_at = time.time()
+        entry.error = None
+        return changed
+
+    def refresh(self, servers: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        刷新工具目录
+
+        Args:
+            servers: 需要刷新的服务器列表，默认刷新全部
+
+        Returns:
+            刷新后的目录状态
+        """
+        with self._refresh_lock:
+            changed = False
+            for name in servers or self.servers:
+                changed = self._refresh_server(name) or changed
+            if changed or self._merged is None:
+                self._merged = self._merge()
+                self.version += 1
+            self.refresh_count += 1
+        return self.stats()
+
+    def _merge(self) -> List[Any]:
+        tools = []
+        for name in self.servers:
+            tools.extend(self._entries[name].tools)
+        tools.extend(self.static_tools)
+        return tools
+
+    def get_tools(self) -> List[Any]:
+        """返回合并后的工具列表（MCP 工具 + 静态工具），不产生任何 MCP 调用"""
+        if self._merged is None:
+            self.refresh()
+        return list(self._merged)
+
+    def get_server_tools(self, name: str) -> List[Any]:
+        """返回单个服务器的工具列表"""
+        if self._merged is None:
+            self.refresh()
+        return list(self._entries[name].tools)
+
+    def _stale_servers(self) -> List[str]:
+        now = time.time()
+        stale = []
+        for name in self.servers:
+            entry = self._entries[name]
+            pool = self.mcp_pools.get(name)
+            if (entry.refreshed_at is None
+                    or now - entry.refreshed_at >= self.ttl
+                    or pool.generation != entry.generation):
+                stale.append(name)
+        return stale
+
+    def start(self):
+        """启动后台刷新线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='tool-catalog-refresher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                stale = self._stale_servers()
+                if stale:
+                    self.refresh(stale)
+            except Exception as e:
+                logger.error(f"❌ 后台刷新工具目录失败: {str(e)}")
+            self._stop_event.wait(self.check_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "total_tools": len(self._merged) if self._merged is not None else 0,
+            "version": self.version,
+            "static_tools": len(self.static_tools),
+            "ttl": self.ttl,
+            "refresh_count": self.refresh_count,
+            "servers": {
+                name: {
+                    "tools": len(entry.tools),
+                    "fingerprint": entry.fingerprint[:12] if entry.fingerprint else None,
+                    "generation": entry.generation,
+                    "refreshed_at": datetime.fromtimestamp(entry.refreshed_at).isoformat() if entry.refreshed_at else None,
+                    "error": entry.error,
+                }
+                for name, entry in self._entries.items()
+            },
+        }
+
@@ -0,0 +1,264 @@
+"""
+MCP 工具调用结果缓存 - 对网页抓取、网络搜索和 AWS 文档等工具按"工具名 + 规范化参数"缓存结果
+
+结果保存在 SQLite 文件中（WAL 模式），同一台机器上的多个 worker 进程可以共享；
+总大小超过上限时按最近使用时间淘汰。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from strands.types.tools import AgentTool
+
+from metrics import metrics
+
+try:
+    from strands.types._events import ToolResultEvent
+except ImportError:  # 旧版本 strands 的工具直接产出 ToolResult
+    ToolResultEvent = None
+
+logger = logging.getLogger('emr_assistant')
+
+
+def _canonicalize(value: Any) -> Any:
+    """规范化工具参数：去掉字符串首尾空白、丢弃空值，字典按键排序（由 json.dumps 完成）"""
+    if isinstance(value, dict):
+        return {k: _canonicalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_canonicalize(v) for v in value]
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def memo_key(tool_name: str, arguments: Any) -> str:
+    canonical = json.dumps(_canonicalize(arguments or {}), sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(f"{tool_name}\n{canonical}".encode('utf-8')).hexdigest()
+
+
+def _parse_ttl_overrides(value: str) -> Dict[str, int]:
+    """解析 "web_search_tool=600,crawl_tool=86400" 形式的单工具 TTL 配置"""
+    overrides = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        name, ttl = item.split('=', 1)
+        try:
+            overrides[name.strip()] = int(ttl)
+        except ValueError:
+            logger.warning(f"⚠️ 忽略无效的工具缓存 TTL 配置: {item}")
+    return overrides
+
+
+class ToolMemoStore:
+    """
+    基于 SQLite 的工具结果缓存
+
+    配置项（环境变量）：
+    - TOOL_MEMO_ENABLED: 是否启用（默认 true）
+    - TOOL_MEMO_PATH: SQLite 文件路径，多个 worker 指向同一个文件即可共享缓存
+    - TOOL_MEMO_MAX_BYTES: 缓存结果的总大小上限
+    - TOOL_MEMO_TTL: 默认的结果有效期（秒）
+    - TOOL_MEMO_TTL_OVERRIDES: 单个工具的有效期，例如 "web_search_tool=600,crawl_tool=86400"，
+      0 表示不缓存该工具
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = None, default_ttl: int = None,
+                 ttl_overrides: Optional[Dict[str, int]] = None):
+        self.enabled = os.getenv('TOOL_MEMO_ENABLED', 'true').lower() == 'true'
+        self.path = path or os.getenv('TOOL_MEMO_PATH', os.path.join('cache', 'tool_memo.sqlite3'))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('TOOL_MEMO_MAX_BYTES', 100 * 1024 * 1024))
+        self.default_ttl = default_ttl if default_ttl is not None else int(os.getenv('TOOL_MEMO_TTL', 3600))
+        self.ttl_overrides = ttl_overrides if ttl_overrides is not None else _parse_ttl_overrides(os.getenv('TOOL_MEMO_TTL_OVERRIDES', ''))
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.enabled:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory, exist_ok=True)
+                conn = self._connect()
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS tool_memo (
+                        key TEXT PRIMARY KEY,
+                        tool TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        expires_at REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_tool_memo_last_used ON tool_memo (last_used)")
+                conn.commit()
+            except Exception as e:
+                logger.error(f"❌ 工具结果缓存初始化失败，已禁用: {str(e)}")
+                self.enabled = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def ttl_for(self, tool_name: str) -> int:
+        """工具的缓存有效期，支持按完整名称或名称后缀配置（MCP 工具名可能带有前缀）"""
+        if tool_name in self.ttl_overrides:
+            return self.ttl_overrides[tool_name]
+        for name, ttl in self.ttl_overrides.items():
+            if tool_name.endswith(name):
+                return ttl
+        return self.default_ttl
+
+    def get(self, tool_name: str, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT value, expires_at FROM tool_memo WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] > now:
+                conn.execute("UPDATE tool_memo SET last_used = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self._count(tool_name, hit=True)
+                return json.loads(row[0])
+            if row is not None:
+                conn.execute("DELETE FROM tool_memo WHERE key = ?", (key,))
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ 读取工具结果缓存失败: {str(e)}")
+        self._count(tool_name, hit=False)
+        return None
+
+    def put(self, tool_name: str, key: str, result: Dict[str, Any]):
+        ttl = self.ttl_for(tool_name)
+        if ttl <= 0:
+            return
+        try:
+            value = json.dumps(result, ensure_ascii=False)
+        except (TypeError, ValueError):
+            # 含有二进制内容（如图片）的结果不缓存
+            return
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO tool_memo (key, tool, value, size, expires_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, tool_name, value, size, now + ttl, now)
+            )
+            self._evict(conn, now)
+            conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ 写入工具结果缓存失败: {str(e)}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """删除过期条目，总大小超过上限时从最久未使用的条目开始删除"""
+        conn.execute("DELETE FROM tool_memo WHERE expires_at <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM tool_memo").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in conn.execute("SELECT key, size FROM tool_memo ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM tool_memo WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        with self._lock:
+            self.evictions += evicted
+
+    def _count(self, tool_name: str, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        outcome = 'hit' if hit else 'miss'
+        metrics.incr(f"tool_memo.{outcome}")
+        metrics.incr(f"tool_memo.{outcome}.{tool_name}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "enabled": self.enabled,
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            "default_ttl": self.default_ttl,
+            "ttl_overrides": self.ttl_overrides,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+        if self.enabled:
+            try:
+                entries, total = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tool_memo"
+                ).fetchone()
+                stats.update({"entries": entries, "total_bytes": total})
+            except Exception as e:
+                stats["error"] = str(e)
+        return stats
+
+
+class MemoizedTool(AgentTool):
+    """
+    为工具加上结果缓存的包装
+
+    只缓存成功的结果；命中时以当前调用的 toolUseId 返回缓存的内容，不再调用 MCP 服务器。
+    """
+
+    def __init__(self, tool: AgentTool, store: ToolMemoStore):
+        super().__init__()
+        self.tool = tool
+        self.store = store
+
+    @property
+    def tool_name(self) -> str:
+        return self.tool.tool_name
+
+    @property
+    def tool_spec(self):
+        return self.tool.tool_spec
+
+    @property
+    def tool_type(self) -> str:
+        return self.tool.tool_type
+
+    async def stream(self, tool_use, invocation_state, **kwargs):
+        if not self.store.enabled or self.store.ttl_for(self.tool_name) <= 0:
+            async for event in self.tool.stream(tool_use, invocation_state, **kwargs):
+                yield event
+            return
+
+        key = memo_key(self.tool_name, tool_use.get("input"))
+        cached = await asyncio.to_thread(self.store.get, self.tool_name, key)
+        if cached is not None:
+            logger.debug(f"🎯 工具结果缓存命中: {self.tool_name}")
+            result = dict(cached, toolUseId=tool_use["toolUseId"])
+            yield ToolResultEvent(result) if ToolResultEvent is not None else result
+            return
+
+        last_event = None
+        async for event in self.tool.stream(tool_use, invocation_state, **kwargs):
+            last_event = event
+            yield event
+
+        # 最后一个事件是工具结果
+        result = getattr(last_event, 'tool_result', last_event)
+        if isinstance(result, dict) and result.get("status") == "success":
+            await asyncio.to_thread(self.store.put, self.tool_name, key, result)
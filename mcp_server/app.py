@@ -1,97 +1,346 @@
 import os
-import json
-import boto3
-from botocore.exceptions import ClientError
-from typing import Any
+import sys
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 from dotenv import load_dotenv
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import AsyncOpenSearch, AIOHttpConnection
 from mcp.server.fastmcp import FastMCP
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from release_matrix import ReleaseMatrix
 
 load_dotenv()
 
-def get_secret(secret_name, region_name='us-east-1'):
-    """
-    从 AWS Secrets Manager 获取密钥
-    """
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
-    try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
-    except ClientError as e:
-        print(f"获取密钥失败: {str(e)}")
-        raise e
-    else:
-        if 'SecretString' in get_secret_value_response:
-            return json.loads(get_secret_value_response['SecretString'])
-        else:
-            print("密钥值不是字符串类型")
-            raise ValueError("Secret value is not a string")
+# 凭证提供者等共享工具位于项目根目录的 common 包中
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.credentials import AsyncOpenSearchAuth, get_credentials_provider
+from common.knowledge import extract_query_entities, normalize_query, read_index_version_file
 
-# 从 Secrets Manager 获取 OpenSearch 认证信息
+# 获取 OpenSearch 认证信息：优先使用本地加密缓存（需配置 CREDENTIALS_CACHE_KEY），过期前在后台从 Secrets Manager 刷新
 try:
-    secret_name = os.getenv('OPENSEARCH_SECRET_NAME', 'opensearch_credentials')
-    region_name = os.getenv('AWS_REGION', 'us-east-1')
-    opensearch_credentials = get_secret(secret_name, region_name)
+    credentials_provider = get_credentials_provider()
+    # 启动时先加载一次，凭证不可用时直接失败
+    credentials_provider.get()
 
-    # OpenSearch 客户端配置
-    client = OpenSearch(
+    # OpenSearch 异步客户端配置：aiohttp 连接池保持长连接，多个检索请求可以并发执行
+    client = AsyncOpenSearch(
         hosts=[{'host': os.getenv('OPENSEARCH_HOST', 'localhost'), 'port': int(os.getenv('OPENSEARCH_PORT', 9200))}],
-        http_auth=(opensearch_credentials['username'], opensearch_credentials['password']),
+        # 每次请求时读取当前凭证，后台刷新后无需重建客户端
+        http_auth=AsyncOpenSearchAuth(credentials_provider),
         use_ssl=True,
         verify_certs=False,
         ssl_show_warn=False,
-        connection_class=RequestsHttpConnection,
-        timeout=120
+        connection_class=AIOHttpConnection,
+        maxsize=int(os.getenv('OPENSEARCH_POOL_SIZE', 20)),
+        timeout=float(os.getenv('OPENSEARCH_REQUEST_TIMEOUT', 10)),
+        max_retries=int(os.getenv('OPENSEARCH_MAX_RETRIES', 1)),
+        retry_on_timeout=False
     )
     print("OpenSearch 客户端初始化成功")
 except Exception as e:
     print(f"OpenSearch 客户端初始化失败: {str(e)}")
     raise
 
-mcp = FastMCP("opensearch_mcp_server")
+# 单次检索的总时限（秒），包括重试；超时后取消请求并返回错误信息，不占用连接
+SEARCH_DEADLINE = float(os.getenv('OPENSEARCH_SEARCH_DEADLINE', 15))
+# search_context_batch 一次最多检索的查询数
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv('SEARCH_BATCH_MAX_QUERIES', 10))
 
-@mcp.tool()
-async def search_context(
-    query: str,
-    user_id: str = "",
-    pipeline: str = "hybird-search-pipeline-for-mcp-server"
-) -> str:
+
+# 传输方式：stdio（由客户端以子进程方式启动）、streamable-http 或 sse（作为独立的网络服务，多个客户端共享）
+MCP_TRANSPORT = os.getenv('MCP_TRANSPORT', 'stdio')
+# 服务停止时等待进行中的请求完成的最长秒数
+MCP_SHUTDOWN_TIMEOUT = float(os.getenv('MCP_SHUTDOWN_TIMEOUT', 30))
+# 服务正在停止时就绪检查返回 503，负载均衡器不再转发新的请求
+_shutting_down = False
+
+
+@asynccontextmanager
+async def lifespan(server):
+    try:
+        yield
+    finally:
+        # stdio 模式只有一个会话，会话结束即进程结束；HTTP 模式下每个会话都会进入 lifespan，
+        # 连接池在服务停止时（run_http_server）关闭
+        if MCP_TRANSPORT == 'stdio':
+            await client.close()
+
+
+mcp = FastMCP(
+    "opensearch_mcp_server",
+    lifespan=lifespan,
+    host=os.getenv('MCP_HOST', '127.0.0.1'),
+    port=int(os.getenv('MCP_PORT', 8000))
+)
+
+
+class SearchResultCache:
     """
-    用于检索知识库关于 Amazon EMR 版本升级到的相关内容，包括EMR各个组件 hive,spark,flink,hbase 在每个版本的新增特性和BUG修复。
+    检索结果缓存（LRU + TTL），并合并并发的相同检索
 
-    Args:
-        query: 检索的查询内容，例如：EMR 6.10.0 版本升级到 6.11.0 后，hive 的哪些新增特性？
-        user_id: 用户ID（可选）
-        pipeline: OpenSearch 检索 pipeline 名称（可选）
+    相同的查询（规范化后）、pipeline 和索引共用一次 OpenSearch 请求；
+    索引版本标记变化时清空缓存。检索失败的结果不缓存。
 
-    Returns:
-        answer: 检索结果拼接的字符串
+    配置项（环境变量）：
+    - SEARCH_CACHE_ENABLED: 是否启用（默认 true）
+    - SEARCH_CACHE_TTL: 结果的有效期（秒）
+    - SEARCH_CACHE_MAX_ENTRIES: 最多缓存的结果数，超出时淘汰最久未使用的条目
+    - KNOWLEDGE_INDEX_VERSION_FILE: 索引版本标记文件，重建索引后写入新版本
+    - KNOWLEDGE_INDEX_CHECK_INTERVAL: 检查索引版本的间隔（秒）
     """
-    search_query = {
+
+    def __init__(self):
+        self.enabled = os.getenv('SEARCH_CACHE_ENABLED', 'true').lower() == 'true'
+        self.ttl = int(os.getenv('SEARCH_CACHE_TTL', 600))
+        self.max_entries = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 1000))
+        self.check_interval = float(os.getenv('KNOWLEDGE_INDEX_CHECK_INTERVAL', 30))
+
+        # key -> (answer, expires_at)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # key -> [进行中的检索（任务或批量检索中该查询的 Future）, 等待该结果的调用数]
+        self._inflight: Dict[tuple, list] = {}
+        self._index_version = read_index_version_file()
+        self._version_checked_at = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def _check_index_version(self):
+        now = time.monotonic()
+        if now - self._version_checked_at < self.check_interval:
+            return
+        self._version_checked_at = now
+        try:
+            version = read_index_version_file()
+        except Exception as e:
+            print(f"读取索引版本标记失败: {str(e)}")
+            return
+        if version != self._index_version:
+            print(f"知识库索引版本变化 ({self._index_version} -> {version})，清空 {len(self._entries)} 条检索缓存")
+            self._index_version = version
+            self._entries.clear()
+
+    def _cached(self, key: tuple) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._entries[key]
+        return None
+
+    def _register(self, key: tuple, future: asyncio.Future) -> list:
+        inflight = self._inflight[key] = [future, 0]
+        future.add_done_callback(lambda done: self._finish(key, done))
+        return inflight
+
+    async def get_or_load(self, key: tuple, loader: Callable[[], Awaitable[str]]) -> str:
+        if not self.enabled:
+            return await loader()
+
+        self._check_index_version()
+        answer = self._cached(key)
+        if answer is not None:
+            return answer
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            self.misses += 1
+            inflight = self._register(key, asyncio.create_task(self._load(key, loader)))
+        else:
+            self.shared += 1
+
+        inflight[1] += 1
+        try:
+            return await asyncio.shield(inflight[0])
+        except asyncio.CancelledError:
+            # 最后一个等待者取消时才取消检索，其他调用仍可以拿到结果
+            if inflight[1] == 1:
+                inflight[0].cancel()
+            raise
+        finally:
+            inflight[1] -= 1
+
+    async def get_many_or_load(self, keys: List[tuple],
+                               loader: Callable[[List[tuple]], Awaitable[List[Any]]]) -> Dict[tuple, Any]:
+        """
+        批量获取检索结果：命中缓存的直接返回，已在检索中的等待其结果，其余的通过一次 loader 调用检索
+
+        Args:
+            loader: loader(missing_keys) 返回与 missing_keys 一一对应的结果，单个查询失败时对应位置为异常对象
+
+        Returns:
+            key -> 结果文本或异常对象
+        """
+        keys = list(dict.fromkeys(keys))
+        if not self.enabled:
+            return dict(zip(keys, await loader(keys)))
+
+        self._check_index_version()
+        results: Dict[tuple, Any] = {}
+        waits: Dict[tuple, list] = {}
+        missing = []
+        for key in keys:
+            answer = self._cached(key)
+            if answer is not None:
+                results[key] = answer
+            elif key in self._inflight:
+                self.shared += 1
+                waits[key] = self._inflight[key]
+            else:
+                self.misses += 1
+                missing.append(key)
+
+        batch = None
+        if missing:
+            loop = asyncio.get_running_loop()
+            futures = [loop.create_future() for _ in missing]
+            for key, future in zip(missing, futures):
+                waits[key] = self._register(key, future)
+            batch = asyncio.create_task(self._load_many(missing, futures, loader))
+
+        if not waits:
+            return results
+
+        for inflight in waits.values():
+            inflight[1] += 1
+        try:
+            outcomes = await asyncio.shield(
+                asyncio.gather(*(inflight[0] for inflight in waits.values()), return_exceptions=True)
+            )
+        except asyncio.CancelledError:
+            # 只取消没有其他等待者的检索；批量请求中的查询都被取消后再中止批量请求
+            for inflight in waits.values():
+                if inflight[1] == 1:
+                    inflight[0].cancel()
+            if batch is not None and all(future.cancelled() for future in futures):
+                batch.cancel()
+            raise
+        finally:
+            for inflight in waits.values():
+                inflight[1] -= 1
+
+        results.update(zip(waits.keys(), outcomes))
+        return results
+
+    def _finish(self, key: tuple, task: asyncio.Future):
+        if self._inflight.get(key, [None])[0] is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # 所有等待者都已取消时，读取异常以免 asyncio 报告未处理的异常
+            task.exception()
+
+    async def _load(self, key: tuple, loader: Callable[[], Awaitable[str]]) -> str:
+        version = self._index_version
+        answer = await loader()
+        self._store(key, answer, version)
+        return answer
+
+    async def _load_many(self, keys: List[tuple], futures: List[asyncio.Future],
+                         loader: Callable[[List[tuple]], Awaitable[List[Any]]]):
+        version = self._index_version
+        try:
+            answers = await loader(keys)
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future, answer in zip(keys, futures, answers):
+            if isinstance(answer, Exception):
+                if not future.done():
+                    future.set_exception(answer)
+                continue
+            self._store(key, answer, version)
+            if not future.done():
+                future.set_result(answer)
+
+    def _store(self, key: tuple, answer: str, version: Optional[str]):
+        # 检索期间索引版本发生变化时，结果可能来自旧索引，不缓存
+        if version != self._index_version:
+            return
+        self._entries[key] = (answer, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "index_version": self._index_version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+        }
+
+
+search_cache = SearchResultCache()
+
+
+# 按版本和组件预过滤：从查询中识别 EMR 版本和组件，只在对应的文档块中检索。
+# 文档块需要在写入索引时带上以下字段（字段名可通过环境变量修改）：
+# - emr_release_number（integer）：EMR 版本号编码为 major * 1000000 + minor * 1000 + patch，例如 6.11.0 -> 6011000
+# - component（keyword，可为数组）：文档块涉及的组件名称（小写），例如 ["hive", "spark"]
+# 现有索引的文档块没有这些字段，每次过滤检索都会落空再重试一次，因此默认关闭，字段写入后再开启
+SEARCH_PREFILTER_ENABLED = os.getenv('SEARCH_PREFILTER_ENABLED', 'false').lower() == 'true'
+SEARCH_RELEASE_FIELD = os.getenv('SEARCH_RELEASE_FIELD', 'emr_release_number')
+SEARCH_COMPONENT_FIELD = os.getenv('SEARCH_COMPONENT_FIELD', 'component')
+
+
+def build_search_filters(query: str) -> List[Dict[str, Any]]:
+    """根据查询中的版本和组件生成过滤条件，未识别到时返回空列表"""
+    if not SEARCH_PREFILTER_ENABLED:
+        return []
+    ranges, components = extract_query_entities(query)
+    filters = []
+    if ranges:
+        # 提到多个版本时（如 "6.10.0 升级到 6.11.0"），检索整个区间内各版本的变化
+        gte, lte = min(r[0] for r in ranges), max(r[1] for r in ranges)
+        filters.append({"range": {SEARCH_RELEASE_FIELD: {"gte": gte, "lte": lte}}})
+    if components:
+        filters.append({"terms": {SEARCH_COMPONENT_FIELD: components}})
+    return filters
+
+
+def _build_search_query(query: str, filters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """构造混合检索（neural + BM25）的查询体，filters 同时作用于两个子查询（neural 使用 k-NN 高效过滤）"""
+    neural = {
+        "query_text": query,
+        "model_id": os.getenv('OPENSEARCH_EMBEDDING_MODEL_ID', '-kB2sZUB0LCOh9zdNaiU'),
+        "k": 10
+    }
+    match = {
+        "match": {
+            "text": {
+                "query": query
+            }
+        }
+    }
+    if filters:
+        neural["filter"] = {"bool": {"filter": filters}}
+        match = {"bool": {"must": [match], "filter": filters}}
+    return {
         "query": {
             "hybrid": {
                 "queries": [
                     {
                         "neural": {
-                            "embedding": {
-                                "query_text": query,
-                                "model_id": os.getenv('OPENSEARCH_EMBEDDING_MODEL_ID', '-kB2sZUB0LCOh9zdNaiU'),
-                                "k": 10
-                            }
+                            "embedding": neural
                         }
                     },
-                    {
-                        "match": {
-                            "text": {
-                                "query": query
-                            }
-                        }
-                    }
+                    match
                 ]
             }
         },
@@ -105,21 +354,298 @@ async def search_context(
             "fields": {"text": {}}
         }
     }
+
+
+def _format_hits(hits: List[Dict[str, Any]]) -> str:
+    """取前 3 条结果的文本拼接为回答"""
+    results = [{
+        'text': hit['_source'].get('text', ''),
+        'score': hit['_score']
+    } for hit in hits]
+    return '\n'.join([r['text'] for r in results[:3]])
+
+
+async def _search_once(query: str, filters: List[Dict[str, Any]], pipeline: str, index: str) -> List[Dict[str, Any]]:
+    response = await client.search(
+        body=_build_search_query(query, filters),
+        index=index,
+        params={'search_pipeline': pipeline}
+    )
+    return response['hits']['hits']
+
+
+async def _search(query: str, pipeline: str, index: str) -> str:
+    """执行一次混合检索，返回前 3 条结果拼接的文本"""
+    async def run() -> str:
+        filters = build_search_filters(query)
+        hits = await _search_once(query, filters, pipeline, index)
+        if filters and not hits:
+            # 过滤后没有结果（例如文档块缺少版本或组件字段）时，不加过滤重新检索
+            hits = await _search_once(query, [], pipeline, index)
+        return _format_hits(hits)
+
+    # 过滤检索和不加过滤的重试共用同一个时限；客户端取消调用时，wait_for 所在的任务被取消，进行中的 HTTP 请求随之中止
+    return await asyncio.wait_for(run(), timeout=SEARCH_DEADLINE)
+
+
+async def _msearch_once(queries: List[str], filters: List[List[Dict[str, Any]]], pipeline: str,
+                        index: str) -> List[Dict[str, Any]]:
+    body = []
+    for query, query_filters in zip(queries, filters):
+        body.append({"index": index})
+        body.append(_build_search_query(query, query_filters))
+    response = await client.msearch(body=body, params={'search_pipeline': pipeline})
+    return response['responses']
+
+
+async def _msearch(queries: List[str], pipeline: str, index: str) -> List[Any]:
+    """通过一次 _msearch 请求执行多个混合检索，返回与 queries 一一对应的结果文本（失败的查询为异常对象）"""
+    async def run() -> List[Dict[str, Any]]:
+        filters = [build_search_filters(query) for query in queries]
+        responses = await _msearch_once(queries, filters, pipeline, index)
+
+        # 过滤后没有结果的查询，合并为一次不加过滤的 _msearch 重新检索
+        retry = [i for i, item in enumerate(responses)
+                 if filters[i] and 'error' not in item and not item['hits']['hits']]
+        if retry:
+            retried = await _msearch_once([queries[i] for i in retry], [[] for _ in retry], pipeline, index)
+            for i, item in zip(retry, retried):
+                responses[i] = item
+        return responses
+
+    # 与 _search 相同，重试包含在同一个时限内
+    responses = await asyncio.wait_for(run(), timeout=SEARCH_DEADLINE)
+    results = []
+    for item in responses:
+        if 'error' in item:
+            error = item['error']
+            reason = error.get('reason', error) if isinstance(error, dict) else error
+            results.append(RuntimeError(str(reason)))
+        else:
+            results.append(_format_hits(item['hits']['hits']))
+    return results
+
+
+@mcp.tool()
+async def search_context(
+    query: str,
+    user_id: str = "",
+    pipeline: str = "hybird-search-pipeline-for-mcp-server"
+) -> str:
+    """
+    用于检索知识库关于 Amazon EMR 版本升级到的相关内容，包括EMR各个组件 hive,spark,flink,hbase 在每个版本的新增特性和BUG修复。
+
+    Args:
+        query: 检索的查询内容，例如：EMR 6.10.0 版本升级到 6.11.0 后，hive 的哪些新增特性？
+        user_id: 用户ID（可选）
+        pipeline: OpenSearch 检索 pipeline 名称（可选）
+
+    Returns:
+        answer: 检索结果拼接的字符串
+    """
+    index = os.getenv('OPENSEARCH_INDEX', 'opensearch_kl_index')
+    key = (normalize_query(query), pipeline, index)
+    try:
+        return await search_cache.get_or_load(key, lambda: _search(query, pipeline, index))
+    except asyncio.TimeoutError:
+        return f"检索超时: 超过 {SEARCH_DEADLINE:.0f} 秒未返回结果"
+    except Exception as e:
+        return f"检索失败: {str(e)}"
+
+@mcp.tool()
+async def search_context_batch(
+    queries: List[str],
+    user_id: str = "",
+    pipeline: str = "hybird-search-pipeline-for-mcp-server"
+) -> str:
+    """
+    一次检索多个相关问题，适用于把升级问题拆分为多个子问题（例如同一版本区间内 hive、spark、flink 各自的变化）的场景。
+    所有子问题通过一次请求检索，比多次调用 search_context 更快。
+
+    Args:
+        queries: 检索的查询内容列表，例如：["EMR 6.10.0 升级到 6.11.0 后 hive 的新增特性", "EMR 6.10.0 升级到 6.11.0 后 spark 的新增特性"]
+        user_id: 用户ID（可选）
+        pipeline: OpenSearch 检索 pipeline 名称（可选）
+
+    Returns:
+        answer: 按查询分段的检索结果
+    """
+    queries = [query for query in queries if query and query.strip()]
+    if not queries:
+        return "检索失败: 查询列表为空"
+    if len(queries) > SEARCH_BATCH_MAX_QUERIES:
+        return f"检索失败: 一次最多检索 {SEARCH_BATCH_MAX_QUERIES} 个查询"
+
+    index = os.getenv('OPENSEARCH_INDEX', 'opensearch_kl_index')
+    keys = [(normalize_query(query), pipeline, index) for query in queries]
+    originals = dict(zip(keys, queries))
     try:
-        response = client.search(
-            body=search_query,
-            index=os.getenv('OPENSEARCH_INDEX', 'opensearch_kl_index'),
-            params={'search_pipeline': pipeline}
+        results = await search_cache.get_many_or_load(
+            keys, lambda missing: _msearch([originals[key] for key in missing], pipeline, index)
         )
-        hits = response['hits']['hits']
-        results = [{
-            'text': hit['_source'].get('text', ''),
-            'score': hit['_score']
-        } for hit in hits]
-        answer = '\n'.join([r['text'] for r in results[:3]])
-        return answer
+    except asyncio.TimeoutError:
+        return f"检索超时: 超过 {SEARCH_DEADLINE:.0f} 秒未返回结果"
     except Exception as e:
         return f"检索失败: {str(e)}"
 
+    sections = []
+    for i, (query, key) in enumerate(zip(queries, keys), 1):
+        result = results[key]
+        if isinstance(result, asyncio.TimeoutError):
+            result = f"检索超时: 超过 {SEARCH_DEADLINE:.0f} 秒未返回结果"
+        elif isinstance(result, BaseException):
+            result = f"检索失败: {str(result)}"
+        sections.append(f"## 查询 {i}: {query}\n{result}")
+    return '\n\n'.join(sections)
+
+release_matrix = ReleaseMatrix()
+
+
+def _format_components(components: Dict[str, str], component: str = "") -> str:
+    if component:
+        components = {name: version for name, version in components.items() if name == component}
+    if not components:
+        return "（无组件版本信息）"
+    return '\n'.join(f"- {name}: {version}" for name, version in components.items())
+
+
+@mcp.tool()
+async def emr_release_components(release: str, component: str = "") -> str:
+    """
+    查询 EMR 版本包含的各组件（hive、spark、flink、hbase 等）的版本及主要变化，直接从预先生成的版本矩阵中查找，结果准确且无需检索。
+
+    Args:
+        release: EMR 版本，例如 6.15.0、emr-7.2.0；只给出 6.15 时返回该系列的最新版本
+        component: 组件名称（可选），例如 spark，只返回该组件的信息
+
+    Returns:
+        answer: 组件版本列表和主要变化
+    """
+    if not release_matrix.loaded:
+        return "版本矩阵未生成，请使用 search_context 工具检索"
+    entry = release_matrix.get(release)
+    if entry is None:
+        return f"版本矩阵中没有 EMR {release} 的信息，请使用 search_context 工具检索"
+
+    component = component.strip().lower()
+    lines = [f"## EMR {entry['release']} 组件版本", _format_components(entry.get('components', {}), component)]
+    changes = entry.get('changes', {})
+    for name in ([component] if component else changes.keys()):
+        if changes.get(name):
+            lines.append(f"\n### {name} 主要变化")
+            lines.extend(f"- {change}" for change in changes[name])
+    return '\n'.join(lines)
+
+
+@mcp.tool()
+async def emr_release_diff(from_release: str, to_release: str, component: str = "") -> str:
+    """
+    对比两个 EMR 版本之间组件版本的变化，并列出区间内各版本的主要变化，适用于"从 X 升级到 Y"的问题。
+    直接从预先生成的版本矩阵中查找，结果准确且无需检索。
+
+    Args:
+        from_release: 当前 EMR 版本，例如 6.10.0
+        to_release: 目标 EMR 版本，例如 7.2.0
+        component: 组件名称（可选），例如 hive，只对比该组件
+
+    Returns:
+        answer: 组件版本变化和区间内各版本的主要变化
+    """
+    if not release_matrix.loaded:
+        return "版本矩阵未生成，请使用 search_context 工具检索"
+    source, target = release_matrix.get(from_release), release_matrix.get(to_release)
+    missing = [name for name, entry in ((from_release, source), (to_release, target)) if entry is None]
+    if missing:
+        return f"版本矩阵中没有 EMR {', '.join(missing)} 的信息，请使用 search_context 工具检索"
+
+    component = component.strip().lower()
+    old, new = source.get('components', {}), target.get('components', {})
+    names = [component] if component else sorted(set(old) | set(new))
+    lines = [f"## EMR {source['release']} -> {target['release']} 组件版本变化"]
+    for name in names:
+        before, after = old.get(name), new.get(name)
+        if before == after:
+            if before is not None and component:
+                lines.append(f"- {name}: {before}（未变化）")
+        elif before is None:
+            lines.append(f"- {name}: 新增 {after}")
+        elif after is None:
+            lines.append(f"- {name}: {before} -> 目标版本中未包含")
+        else:
+            lines.append(f"- {name}: {before} -> {after}")
+    if len(lines) == 1:
+        lines.append("（组件版本没有变化）")
+
+    for release in release_matrix.between(source['release'], target['release']):
+        changes = release_matrix.get(release).get('changes', {})
+        entries = [(name, change) for name in names for change in changes.get(name, [])]
+        if entries:
+            lines.append(f"\n### EMR {release} 主要变化")
+            lines.extend(f"- [{name}] {change}" for name, change in entries)
+    return '\n'.join(lines)
+
+
+@mcp.custom_route("/health", methods=["GET"])
+async def health(request: Request) -> JSONResponse:
+    """存活检查：进程正常即返回 200"""
+    return JSONResponse({
+        "status": "stopping" if _shutting_down else "ok",
+        "transport": MCP_TRANSPORT,
+        "search_cache": search_cache.stats(),
+        "release_matrix": release_matrix.stats(),
+        "credentials": credentials_provider.stats(),
+    })
+
+
+@mcp.custom_route("/ready", methods=["GET"])
+async def ready(request: Request) -> JSONResponse:
+    """就绪检查：服务未在停止且 OpenSearch 可以访问时返回 200，否则返回 503"""
+    if _shutting_down:
+        return JSONResponse({"status": "stopping"}, status_code=503)
+    try:
+        reachable = await asyncio.wait_for(client.ping(), timeout=float(os.getenv('MCP_READY_TIMEOUT', 3)))
+    except Exception:
+        reachable = False
+    if not reachable:
+        return JSONResponse({"status": "unavailable", "opensearch": False}, status_code=503)
+    return JSONResponse({"status": "ready", "opensearch": True})
+
+
+def run_http_server():
+    """以 streamable-http 或 sse 方式作为独立服务运行，收到 SIGTERM/SIGINT 后先停止就绪，再等待进行中的请求完成"""
+    import uvicorn
+
+    app = mcp.streamable_http_app() if MCP_TRANSPORT == 'streamable-http' else mcp.sse_app()
+
+    class _Server(uvicorn.Server):
+        def handle_exit(self, sig, frame):
+            global _shutting_down
+            _shutting_down = True
+            super().handle_exit(sig, frame)
+
+    server = _Server(uvicorn.Config(
+        app,
+        host=mcp.settings.host,
+        port=mcp.settings.port,
+        log_level=os.getenv('MCP_LOG_LEVEL', 'info').lower(),
+        timeout_keep_alive=int(os.getenv('MCP_KEEP_ALIVE_TIMEOUT', 75)),
+        timeout_graceful_shutdown=MCP_SHUTDOWN_TIMEOUT
+    ))
+
+    async def serve():
+        try:
+            await server.serve()
+        finally:
+            await client.close()
+
+    print(f"MCP Server 以 {MCP_TRANSPORT} 方式监听 {mcp.settings.host}:{mcp.settings.port}")
+    asyncio.run(serve())
+
+
 if __name__ == "__main__":
-    mcp.run(transport='stdio')
\ No newline at end of file
+    if MCP_TRANSPORT == 'stdio':
+        mcp.run(transport='stdio')
+    elif MCP_TRANSPORT in ('streamable-http', 'sse'):
+        run_http_server()
+    else:
+        raise ValueError(f"不支持的 MCP_TRANSPORT: {MCP_TRANSPORT}（可选 stdio、streamable-http、sse）")
\ No newline at end of file
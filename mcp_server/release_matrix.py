@@ -0,0 +1,239 @@
+"""
+EMR 版本 - 组件版本矩阵
+
+离线任务从知识库中提取每个 EMR 版本包含的组件版本和主要变化，生成 JSON 文件；
+MCP Server 在进程内加载该文件，直接回答"某个 EMR 版本带的 Spark/Hive/Flink 是什么版本"、
+"从 X 升级到 Y 组件版本有哪些变化"之类的问题，不需要调用 OpenSearch 或 Bedrock。
+
+生成矩阵（在 mcp_server 目录下执行，使用与 MCP Server 相同的 .env 配置）：
+
+    python release_matrix.py --output release_matrix.json
+"""
+
+import os
+import re
+import json
+import time
+import sys
+import argparse
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 组件列表与检索预过滤共用，位于项目根目录的 common 包中
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.knowledge import EMR_COMPONENTS
+
+# 每个组件在每个 EMR 版本下最多保留的变化条目数，以及每条的最大长度
+MAX_CHANGES_PER_COMPONENT = 10
+MAX_CHANGE_CHARS = 300
+
+_RELEASE_LABEL_PATTERN = re.compile(r'emr[\s\-_]*(?:release\s*)?v?(\d\.\d{1,2}\.\d{1,2})(?![\d.])', re.IGNORECASE)
+_COMPONENT_VERSION_PATTERN = re.compile(
+    r'(?<![a-z])(?:apache\s+)?(' + '|'.join(EMR_COMPONENTS) + r')(?![a-z])[\s:：|]*(?:version\s*|版本\s*)?v?'
+    r'(\d+\.\d+(?:\.\d+)?(?:-amzn-\d+)?)',
+    re.IGNORECASE
+)
+_COMPONENT_PATTERN = re.compile(r'(?<![a-z])(' + '|'.join(EMR_COMPONENTS) + r')(?![a-z])', re.IGNORECASE)
+_CHANGE_KEYWORDS = re.compile(r'新增|新特性|修复|升级|弃用|不再支持|变更|new feature|feature|fix|upgrade|deprecat|removed|support',
+                              re.IGNORECASE)
+
+
+def parse_release(release: str) -> Optional[Tuple[int, ...]]:
+    """把 "6.15.0"、"emr-6.15"、"EMR 7.2" 解析为版本元组，无法识别时返回 None"""
+    match = re.search(r'(\d+)\.(\d+)(?:\.(\d+))?', release or '')
+    if not match:
+        return None
+    return tuple(int(part) for part in match.groups() if part is not None)
+
+
+def release_from_number(number: int) -> str:
+    """把 emr_release_number 字段（major * 1000000 + minor * 1000 + patch）还原为版本号"""
+    return f"{number // 1000000}.{number // 1000 % 1000}.{number % 1000}"
+
+
+def build_matrix(chunks: Iterable[Dict[str, Any]], source_index: str = '',
+                 release_field: str = 'emr_release_number') -> Dict[str, Any]:
+    """
+    从知识库文档块中提取版本矩阵
+
+    文档块的 EMR 版本优先取 release_field 字段（版本号编码，见 release_from_number），否则取正文中唯一提到的 EMR 版本；
+    同一组件出现多个版本号时取出现次数最多的一个。
+
+    Args:
+        chunks: 文档块（_source），至少包含 text 字段
+    """
+    votes: Dict[str, Dict[str, Counter]] = defaultdict(lambda: defaultdict(Counter))
+    changes: Dict[str, Dict[str, List[str]]] = defaultdict(lambda: defaultdict(list))
+
+    for chunk in chunks:
+        text = chunk.get('text') or ''
+        number = chunk.get(release_field)
+        if isinstance(number, int):
+            release = release_from_number(number)
+        else:
+            labels = set(_RELEASE_LABEL_PATTERN.findall(text))
+            if len(labels) != 1:
+                continue
+            release = labels.pop()
+
+        for line in text.splitlines():
+            line = ' '.join(line.split()).strip(' -*|')
+            if not line:
+                continue
+            if not _CHANGE_KEYWORDS.search(line):
+                # 变化描述中的版本号（如"新增对 Iceberg 1.4 的支持"）不一定是该 EMR 版本自带的组件版本，只从其他行提取
+                for component, version in _COMPONENT_VERSION_PATTERN.findall(line):
+                    votes[release][component.lower()][version] += 1
+                continue
+            for component in dict.fromkeys(c.lower() for c in _COMPONENT_PATTERN.findall(line)):
+                entries = changes[release][component]
+                if len(entries) < MAX_CHANGES_PER_COMPONENT and line[:MAX_CHANGE_CHARS] not in entries:
+                    entries.append(line[:MAX_CHANGE_CHARS])
+
+    releases = {}
+    for release in sorted(set(votes) | set(changes), key=parse_release):
+        releases[release] = {
+            "components": {
+                component: counter.most_common(1)[0][0]
+                for component, counter in sorted(votes[release].items())
+            },
+            "changes": {component: entries for component, entries in sorted(changes[release].items())},
+        }
+
+    built_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    return {
+        "version": built_at,
+        "built_at": built_at,
+        "source_index": source_index,
+        "releases": releases,
+    }
+
+
+class ReleaseMatrix:
+    """
+    进程内的版本矩阵，文件更新后自动重新加载
+
+    配置项（环境变量）：
+    - RELEASE_MATRIX_PATH: 矩阵文件路径（默认为本目录下的 release_matrix.json）
+    - RELEASE_MATRIX_CHECK_INTERVAL: 检查文件是否更新的间隔（秒）
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv(
+            'RELEASE_MATRIX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'release_matrix.json')
+        )
+        self.check_interval = float(os.getenv('RELEASE_MATRIX_CHECK_INTERVAL', 30))
+        self.version: Optional[str] = None
+        self._releases: Dict[str, Dict[str, Any]] = {}
+        self._ordered: List[Tuple[Tuple[int, ...], str]] = []
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked_at and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"加载版本矩阵失败: {str(e)}")
+            return
+        self._releases = data.get('releases', {})
+        self._ordered = sorted((parse_release(release), release) for release in self._releases)
+        self.version = data.get('version')
+        self._mtime = mtime
+        print(f"版本矩阵已加载: {len(self._releases)} 个 EMR 版本 (version={self.version})")
+
+    @property
+    def loaded(self) -> bool:
+        self._refresh()
+        return bool(self._releases)
+
+    def resolve(self, release: str) -> Optional[str]:
+        """把用户输入的版本解析为矩阵中的版本；只给出 major.minor 时取该系列的最新补丁版本"""
+        self._refresh()
+        parsed = parse_release(release)
+        if parsed is None:
+            return None
+        matches = [name for key, name in self._ordered if key[:len(parsed)] == parsed]
+        return matches[-1] if matches else None
+
+    def get(self, release: str) -> Optional[Dict[str, Any]]:
+        resolved = self.resolve(release)
+        return dict(self._releases[resolved], release=resolved) if resolved else None
+
+    def between(self, from_release: str, to_release: str) -> List[str]:
+        """返回 (from_release, to_release] 区间内的所有版本（按版本号排序）"""
+        low, high = self.resolve(from_release), self.resolve(to_release)
+        if low is None or high is None:
+            return []
+        low_key, high_key = parse_release(low), parse_release(high)
+        return [name for key, name in self._ordered if low_key < key <= high_key]
+
+    def stats(self) -> Dict[str, Any]:
+        self._refresh()
+        return {"path": self.path, "version": self.version, "releases": len(self._releases)}
+
+
+def _scan_chunks(client, index: str, release_field: str, batch_size: int = 500) -> Iterable[Dict[str, Any]]:
+    """使用 scroll 遍历索引中的全部文档块"""
+    response = client.search(
+        index=index,
+        body={"query": {"match_all": {}}, "_source": ["text", release_field], "size": batch_size},
+        scroll='2m'
+    )
+    scroll_id = response.get('_scroll_id')
+    try:
+        while response['hits']['hits']:
+            for hit in response['hits']['hits']:
+                yield hit['_source']
+            response = client.scroll(scroll_id=scroll_id, scroll='2m')
+            scroll_id = response.get('_scroll_id')
+    finally:
+        if scroll_id:
+            client.clear_scroll(scroll_id=scroll_id)
+
+
+def main():
+    from dotenv import load_dotenv
+    from opensearchpy import OpenSearch, RequestsHttpConnection
+
+    load_dotenv()
+    from common.credentials import OpenSearchAuth, get_credentials_provider
+
+    parser = argparse.ArgumentParser(description='从知识库生成 EMR 版本 - 组件版本矩阵')
+    parser.add_argument('--index', default=os.getenv('OPENSEARCH_INDEX', 'opensearch_kl_index'))
+    parser.add_argument('--output', default=os.getenv('RELEASE_MATRIX_PATH', 'release_matrix.json'))
+    args = parser.parse_args()
+
+    client = OpenSearch(
+        hosts=[{'host': os.getenv('OPENSEARCH_HOST', 'localhost'), 'port': int(os.getenv('OPENSEARCH_PORT', 9200))}],
+        http_auth=OpenSearchAuth(get_credentials_provider()),
+        use_ssl=True,
+        verify_certs=False,
+        ssl_show_warn=False,
+        connection_class=RequestsHttpConnection,
+        timeout=120
+    )
+
+    release_field = os.getenv('SEARCH_RELEASE_FIELD', 'emr_release_number')
+    matrix = build_matrix(_scan_chunks(client, args.index, release_field), source_index=args.index,
+                          release_field=release_field)
+    # 先写临时文件再替换，避免 MCP Server 读到写了一半的文件
+    tmp_path = f"{args.output}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(matrix, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, args.output)
+    print(f"版本矩阵已生成: {args.output}，共 {len(matrix['releases'])} 个 EMR 版本 (version={matrix['version']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,16 @@ import json
 from datetime import datetime, timedelta
 import json as json_module
 import secrets
-import boto3
-from botocore.exceptions import ClientError
 import logging
 from logging.handlers import RotatingFileHandler
 import sys
 
 load_dotenv()
 
+# 凭证提供者位于项目根目录的 common 包中
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.credentials import OpenSearchAuth, get_credentials_provider
+
 # 应用版本
 APP_VERSION = "v0.1"
 
@@ -60,45 +62,22 @@ def custom_jsonify(data):
         mimetype='application/json; charset=utf-8'
     )
 
-def get_secret(secret_name, region_name='us-east-1'):
-    """
-    从 AWS Secrets Manager 获取密钥
-    """
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
-    logger.info(f"正在获取密钥: {secret_name}")
-    try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
-    except ClientError as e:
-        logger.error(f"获取密钥失败: {str(e)}")
-        raise e
-    else:
-        if 'SecretString' in get_secret_value_response:
-            return json.loads(get_secret_value_response['SecretString'])
-        else:
-            logger.error("密钥值不是字符串类型")
-            raise ValueError("Secret value is not a string")
-
 # 应用配置
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'opensearch-rag-demo-secret-key')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)  # 设置session过期时间
 
-# 从 Secrets Manager 获取 OpenSearch 认证信息
+# 获取 OpenSearch 认证信息：优先使用本地加密缓存（需配置 CREDENTIALS_CACHE_KEY），过期前在后台从 Secrets Manager 刷新
 try:
-    secret_name = os.getenv('OPENSEARCH_SECRET_NAME', 'opensearch_credentials')
-    region_name = os.getenv('AWS_REGION', 'us-east-1')
-    opensearch_credentials = get_secret(secret_name, region_name)
+    credentials_provider = get_credentials_provider()
+    # 启动时先加载一次，凭证不可用时直接失败
+    credentials_provider.get()
     
     # OpenSearch 客户端配置
     client = OpenSearch(
         hosts=[{'host': os.getenv('OPENSEARCH_HOST', 'localhost'), 'port': int(os.getenv('OPENSEARCH_PORT', 9200))}],
-        http_auth=(opensearch_credentials['username'], opensearch_credentials['password']),
+        # 每次请求时读取当前凭证，后台刷新后无需重建客户端
+        http_auth=OpenSearchAuth(credentials_provider),
         use_ssl=True,
         verify_certs=False,
         ssl_show_warn=False,
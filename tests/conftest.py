@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 问答应用的模块以 emr_upgrade_assistant 目录为导入根目录（与 app.py 运行时一致）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emr_upgrade_assistant'))
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_per_user_cap_rejects_second_request():
+    controller = AdmissionController(max_concurrent=4, max_queue=4, max_per_user=1, queue_timeout=1)
+    ticket = controller.enqueue("alice")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.enqueue("alice")
+    assert rejected.value.reason == "user_busy"
+
+    controller.enqueue("bob")
+    ticket.release()
+    controller.enqueue("alice")
+    assert controller.stats()["rejected"] == 1
+
+
+def test_queue_full_is_rejected():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, max_per_user=0, queue_timeout=1)
+    controller.enqueue("a")
+    controller.enqueue("b")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.enqueue("c")
+    assert rejected.value.reason == "queue_full"
+
+
+def test_queue_positions_advance_on_release():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=4, max_per_user=0, queue_timeout=5)
+        running = controller.enqueue("a")
+        second = controller.enqueue("b")
+        third = controller.enqueue("c")
+        assert (running.position, second.position, third.position) == (0, 1, 2)
+
+        positions = []
+
+        async def wait_third():
+            async for position in third.wait():
+                positions.append(position)
+
+        waiter = asyncio.create_task(wait_third())
+        await asyncio.sleep(0)
+        running.release()
+        await asyncio.sleep(0.01)
+        assert second.granted and third.position == 1
+        second.release()
+        await asyncio.wait_for(waiter, timeout=5)
+        return controller, third, positions
+
+    controller, third, positions = run(scenario())
+    assert positions == [2, 1]
+    assert third.granted
+    assert controller.stats()["running"] == 1
+    assert controller.stats()["queued"] == 0
+
+
+def test_queue_timeout_rejects_and_leaves_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=4, max_per_user=1, queue_timeout=0.05)
+        controller.enqueue("a")
+        ticket = controller.enqueue("b")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await ticket.acquire()
+        return controller, rejected.value
+
+    controller, rejected = run(scenario())
+    assert rejected.reason == "timeout"
+    assert controller.stats()["queued"] == 0
+    controller.enqueue("b")
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=4, max_per_user=0, queue_timeout=5)
+        running = controller.enqueue("a")
+        waiting = asyncio.create_task(controller.enqueue("b").acquire())
+        last = controller.enqueue("c")
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert last.position == 1
+        running.release()
+        return last
+
+    assert run(scenario()).granted
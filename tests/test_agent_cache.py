@@ -0,0 +1,112 @@
+import time
+
+from agent_cache import AgentCache, estimate_agent_size
+
+
+class FakeAgent:
+    def __init__(self, text=""):
+        self.messages = [{"role": "user", "content": [{"text": text}]}] if text else []
+
+
+class FakeSessionManager:
+    def __init__(self):
+        self.synced = []
+
+    def sync_agent(self, agent):
+        self.synced.append(agent)
+
+
+def make_cache(**kwargs):
+    options = dict(max_bytes=10 * 1024 * 1024, max_agents=10, idle_ttl=3600, reap_interval=3600)
+    options.update(kwargs)
+    return AgentCache(**options)
+
+
+def test_checkout_removes_agent_until_checkin():
+    cache = make_cache()
+    agent = FakeAgent("hello")
+    cache.checkin("alice", agent, FakeSessionManager())
+    assert cache.checkout("alice") is agent
+    assert cache.checkout("alice") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_tools_version_mismatch_evicts():
+    cache = make_cache()
+    session = FakeSessionManager()
+    agent = FakeAgent("hello")
+    cache.checkin("alice", agent, session, tools_version=1)
+    assert cache.checkout("alice", tools_version=2) is None
+    assert session.synced == [agent]
+
+
+def test_lru_evicts_least_recently_used():
+    cache = make_cache(max_agents=2)
+    sessions = {name: FakeSessionManager() for name in ("a", "b", "c")}
+    agents = {name: FakeAgent(name) for name in sessions}
+    cache.checkin("a", agents["a"], sessions["a"])
+    cache.checkin("b", agents["b"], sessions["b"])
+    cache.checkin("a", cache.checkout("a"), sessions["a"])
+    cache.checkin("c", agents["c"], sessions["c"])
+
+    assert sessions["b"].synced == [agents["b"]]
+    assert sessions["a"].synced == [] and sessions["c"].synced == []
+    assert cache.stats()["agents"] == 2
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_budget_evicts_oldest():
+    big = FakeAgent("x" * 1000)
+    size = estimate_agent_size(big)
+    cache = make_cache(max_bytes=size * 2)
+    sessions = [FakeSessionManager() for _ in range(3)]
+    for i, session in enumerate(sessions):
+        cache.checkin(f"user{i}", FakeAgent("x" * 1000), session)
+
+    assert len(sessions[0].synced) == 1
+    assert sessions[1].synced == [] and sessions[2].synced == []
+    assert cache.stats()["total_bytes"] == size * 2
+
+
+def test_agent_larger_than_budget_is_not_kept():
+    cache = make_cache(max_bytes=10)
+    session = FakeSessionManager()
+    cache.checkin("alice", FakeAgent("x" * 100), session)
+    assert cache.stats()["agents"] == 0
+    assert cache.stats()["total_bytes"] == 0
+    assert len(session.synced) == 1
+
+
+def test_idle_agents_are_reaped_in_background():
+    cache = make_cache(idle_ttl=0.05, reap_interval=0.02)
+    session = FakeSessionManager()
+    agent = FakeAgent("hello")
+    cache.checkin("alice", agent, session)
+    cache.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not session.synced and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        cache.close()
+    assert session.synced == [agent]
+    assert cache.stats()["agents"] == 0
+
+
+def test_discard_does_not_sync():
+    cache = make_cache()
+    session = FakeSessionManager()
+    cache.checkin("alice", FakeAgent("hello"), session)
+    cache.discard("alice")
+    cache.close()
+    assert session.synced == []
+
+
+def test_close_syncs_all_agents():
+    cache = make_cache()
+    session = FakeSessionManager()
+    agents = [FakeAgent("a"), FakeAgent("b")]
+    cache.checkin("a", agents[0], session)
+    cache.checkin("b", agents[1], session)
+    cache.close()
+    assert session.synced == agents
@@ -0,0 +1,85 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from answer_cache import AnswerCache
+
+
+class FakeEmbedder:
+    """按问题中的关键词返回固定向量"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        for keyword, vector in self.vectors.items():
+            if keyword in text:
+                return vector
+        return [0.0, 0.0, 1.0]
+
+
+@pytest.fixture
+def index_version():
+    return {"value": "v1"}
+
+
+@pytest.fixture
+def cache(monkeypatch, index_version):
+    monkeypatch.setenv('KNOWLEDGE_INDEX_CHECK_INTERVAL', '0')
+    embedder = FakeEmbedder({"spark": [1.0, 0.0, 0.0], "hive": [0.0, 1.0, 0.0]})
+    return AnswerCache(embedder=embedder, index_version_source=lambda: index_version["value"])
+
+
+def test_exact_match_ignores_case_and_trailing_punctuation(cache):
+    cache.store("EMR 6.10 升级 Spark 要注意什么", "A1", [1.0, 0.0, 0.0])
+    assert cache.lookup_exact("emr 6.10 升级 spark 要注意什么？").answer == "A1"
+    assert cache.embedder.calls == 0
+
+
+def test_semantic_match_above_threshold(cache):
+    cache.store("emr 6.10 升级 spark 要注意什么", "A1", [1.0, 0.0, 0.0])
+    entry, embedding = cache.lookup("emr 6.10 spark 升级注意事项")
+    assert entry.answer == "A1"
+    assert entry.similarity == pytest.approx(1.0)
+    assert embedding == [1.0, 0.0, 0.0]
+
+
+def test_semantic_match_below_threshold_misses(cache):
+    cache.store("emr 6.10 升级 spark 要注意什么", "A1", [1.0, 0.0, 0.0])
+    entry, _ = cache.lookup("emr 6.10 hive 升级注意事项")
+    assert entry is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_semantic_match_requires_same_releases_and_components(cache):
+    cache.store("emr 6.10 升级 spark 要注意什么", "A1", [1.0, 0.0, 0.0])
+    assert cache.lookup("emr 6.12 升级 spark 要注意什么")[0] is None
+    assert cache.lookup("emr 6.10 to 6.11 spark 要注意什么")[0] is None
+    assert cache.lookup("emr 6.10 spark 升级要注意什么")[0].answer == "A1"
+
+
+def test_index_version_change_invalidates(cache, index_version):
+    cache.store("emr 6.10 升级 spark 要注意什么", "A1", [1.0, 0.0, 0.0])
+    assert cache.lookup_exact("emr 6.10 升级 spark 要注意什么") is not None
+    index_version["value"] = "v2"
+    assert cache.lookup_exact("emr 6.10 升级 spark 要注意什么") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_short_queries_are_not_cached(cache):
+    cache.store("spark?", "A1", [1.0, 0.0, 0.0])
+    assert cache.stats()["entries"] == 0
+    assert cache.embed("spark?") is None
+
+
+def test_max_entries_evicts_least_recently_hit(monkeypatch, index_version):
+    monkeypatch.setenv('ANSWER_CACHE_MAX_ENTRIES', '2')
+    cache = AnswerCache(embedder=FakeEmbedder({}), index_version_source=lambda: index_version["value"])
+    cache.store("question number one", "A1")
+    cache.store("question number two", "A2")
+    cache.lookup_exact("question number one")
+    cache.store("question number three", "A3")
+    assert cache.lookup_exact("question number two") is None
+    assert cache.lookup_exact("question number one").answer == "A1"
@@ -0,0 +1,140 @@
+import json
+import time
+
+import pytest
+
+from common import credentials
+from common.credentials import CredentialsProvider, FileSource
+
+
+def write_secret(path, password):
+    path.write_text(json.dumps({"username": "admin", "password": password}), encoding="utf-8")
+
+
+@pytest.fixture
+def secret(tmp_path):
+    path = tmp_path / "secret.json"
+    write_secret(path, "first")
+    return path
+
+
+@pytest.fixture
+def fast_kdf(monkeypatch):
+    pytest.importorskip("cryptography")
+    monkeypatch.setattr(credentials, "KDF_ITERATIONS", 1000)
+
+
+def make_provider(secret, tmp_path, **kwargs):
+    options = dict(ttl=3600, refresh_margin=0, cache_path=str(tmp_path / "cache" / "credentials.enc"), cache_key="")
+    options.update(kwargs)
+    provider = CredentialsProvider(FileSource(str(secret)), **options)
+    provider._start_refresher = lambda: None
+    return provider
+
+
+def test_first_load_reads_source(secret, tmp_path):
+    provider = make_provider(secret, tmp_path)
+    assert provider.get() == {"username": "admin", "password": "first"}
+    assert provider.stats()["fetches"] == 1
+    assert not (tmp_path / "cache").exists()
+
+
+def test_first_load_without_source_or_cache_raises(tmp_path):
+    provider = make_provider(tmp_path / "missing.json", tmp_path)
+    with pytest.raises(OSError):
+        provider.get()
+
+
+def test_encrypted_cache_round_trip(secret, tmp_path, fast_kdf):
+    make_provider(secret, tmp_path, cache_key="passphrase").get()
+    cache_file = tmp_path / "cache" / "credentials.enc"
+    envelope = json.loads(cache_file.read_bytes())
+    assert envelope["kdf"] == "pbkdf2-sha256"
+    assert len(envelope["salt"]) > 0
+    assert "first" not in envelope["token"]
+
+    write_secret(secret, "second")
+    provider = make_provider(secret, tmp_path, cache_key="passphrase")
+    assert provider.get()["password"] == "first"
+    assert provider.stats()["cache_loads"] == 1
+    assert provider.stats()["fetches"] == 0
+
+
+def test_cache_with_wrong_passphrase_is_ignored(secret, tmp_path, fast_kdf):
+    make_provider(secret, tmp_path, cache_key="passphrase").get()
+    write_secret(secret, "second")
+    provider = make_provider(secret, tmp_path, cache_key="other")
+    assert provider.get()["password"] == "second"
+    assert provider.stats()["cache_loads"] == 0
+
+
+def test_salt_is_random_per_cache_file(secret, tmp_path, fast_kdf):
+    make_provider(secret, tmp_path, cache_key="passphrase").get()
+    make_provider(secret, tmp_path / "other", cache_key="passphrase").get()
+    first = json.loads((tmp_path / "cache" / "credentials.enc").read_bytes())
+    second = json.loads((tmp_path / "other" / "cache" / "credentials.enc").read_bytes())
+    assert first["salt"] != second["salt"]
+
+
+def test_stale_cache_is_used_when_source_fails(secret, tmp_path, fast_kdf):
+    make_provider(secret, tmp_path, cache_key="passphrase", ttl=0).get()
+    secret.unlink()
+
+    provider = make_provider(secret, tmp_path, cache_key="passphrase")
+    assert provider.get()["password"] == "first"
+    assert provider.stats()["failures"] == 1
+    assert provider.stats()["expires_in"] <= 0
+
+
+def test_expired_cache_is_refetched(secret, tmp_path, fast_kdf):
+    make_provider(secret, tmp_path, cache_key="passphrase", ttl=0).get()
+    write_secret(secret, "second")
+    provider = make_provider(secret, tmp_path, cache_key="passphrase")
+    assert provider.get()["password"] == "second"
+    assert provider.stats()["fetches"] == 1
+
+
+def test_refresh_failure_keeps_current_credentials(secret, tmp_path):
+    provider = make_provider(secret, tmp_path)
+    provider.get()
+    secret.write_text("not json", encoding="utf-8")
+    with pytest.raises(ValueError):
+        provider.refresh()
+    assert provider.get()["password"] == "first"
+
+
+class RecordingSource(FileSource):
+    def __init__(self, path):
+        super().__init__(path)
+        self.calls = []
+
+    def fetch(self):
+        self.calls.append(time.monotonic())
+        return super().fetch()
+
+
+def test_background_refresh_backs_off_after_failures(secret, tmp_path, monkeypatch):
+    monkeypatch.setattr(credentials, "REFRESH_RETRY_DELAY", 0.05)
+    monkeypatch.setattr(credentials, "REFRESH_RETRY_MAX_DELAY", 0.1)
+    source = RecordingSource(str(secret))
+    provider = CredentialsProvider(source, ttl=0, refresh_margin=0, cache_key="")
+    provider._start_refresher = lambda: None
+    provider.get()
+    secret.unlink()
+    del provider._start_refresher
+    provider.get()
+
+    deadline = time.monotonic() + 5
+    while len(source.calls) < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    write_secret(secret, "second")
+    provider.ttl = 3600
+    while provider.get()["password"] != "second" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    provider.close()
+
+    gaps = [b - a for a, b in zip(source.calls[1:4], source.calls[2:5])]
+    assert gaps[0] >= 0.05
+    assert gaps[1] >= 0.1 and gaps[2] >= 0.1
+    assert provider.stats()["failures"] >= 4
+    assert provider.get()["password"] == "second"
@@ -0,0 +1,51 @@
+from common.knowledge import extract_query_entities, normalize_query
+
+
+def test_release_followed_by_period():
+    assert extract_query_entities("What changed in emr-6.15.0. Any spark changes?") == ([(6015000, 6015000)], ["spark"])
+    assert extract_query_entities("emr 6.10. 之后 hive 有什么变化") == ([(6010000, 6010999)], ["hive"])
+
+
+def test_release_at_end_of_query():
+    assert extract_query_entities("What changed in emr-6.15.0.")[0] == [(6015000, 6015000)]
+
+
+def test_upgrade_from_to():
+    ranges, components = extract_query_entities("Upgrade from EMR 6.10.0 to 7.2.0.")
+    assert (min(r[0] for r in ranges), max(r[1] for r in ranges)) == (6010000, 7002000)
+    assert components == []
+
+
+def test_range_target_without_emr_prefix():
+    assert extract_query_entities("what changes in Spark from EMR 6.10 to 6.11") == (
+        [(6010000, 6010999), (6011000, 6011999)], ["spark"]
+    )
+    assert extract_query_entities("EMR 6.10 升级到 6.11")[0] == [(6010000, 6010999), (6011000, 6011999)]
+    assert extract_query_entities("EMR 6.15 vs 7.2")[0] == [(6015000, 6015999), (7002000, 7002999)]
+
+
+def test_range_targets_are_distinguished():
+    assert extract_query_entities("EMR 6.10 to 6.11") != extract_query_entities("EMR 6.10 to 6.12")
+
+
+def test_bare_major_minor_requires_emr_release_or_range():
+    assert extract_query_entities("升级后 6.10 的配置")[0] == []
+    assert extract_query_entities("hive 6.1 配置")[0] == []
+
+
+def test_bare_release_requires_emr_or_upgrade_context():
+    assert extract_query_entities("6.10.0 升级到 7.2.0 需要注意什么")[0] == [(6010000, 6010000), (7002000, 7002000)]
+    assert extract_query_entities("python 3.9 和 numpy 5.1.3 兼容吗")[0] == []
+    assert extract_query_entities("spark 6.1.0 的配置")[0] == []
+
+
+def test_component_version_is_not_a_release():
+    assert extract_query_entities("升级 emr 时 phoenix 5.1.3 是否兼容") == ([], ["phoenix"])
+
+
+def test_release_with_extra_version_part_is_ignored():
+    assert extract_query_entities("emr 6.10.0.1 升级")[0] == []
+
+
+def test_normalize_query():
+    assert normalize_query("  ＥＭＲ   6.15 升级？ ") == "emr 6.15 升级"
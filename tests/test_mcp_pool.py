@@ -0,0 +1,119 @@
+import threading
+
+import pytest
+
+from mcp_pool import MCPClientPool, MCPPoolExhaustedError
+
+
+class FakeThread:
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+
+class FakeClient:
+    def __init__(self):
+        self._background_thread = FakeThread()
+        self.started = False
+        self.stopped = False
+
+    def start(self):
+        self.started = True
+
+    def stop(self, *exc_info):
+        self.stopped = True
+        self._background_thread.alive = False
+
+
+def make_pool(**kwargs):
+    clients = []
+
+    def factory():
+        client = FakeClient()
+        clients.append(client)
+        return client
+
+    options = dict(min_size=0, max_size=2, max_concurrency=2, acquire_timeout=0)
+    options.update(kwargs)
+    return MCPClientPool("test", factory, **options), clients
+
+
+def test_concurrent_calls_share_a_session():
+    pool, clients = make_pool()
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is second
+    assert len(clients) == 1
+    assert pool.stats()["in_flight"] == 2
+
+
+def test_scales_up_when_sessions_are_saturated_without_bumping_generation():
+    pool, clients = make_pool()
+    borrowed = [pool.acquire() for _ in range(4)]
+    assert len(clients) == 2
+    assert {id(c) for c in borrowed} == {id(c) for c in clients}
+    assert pool.generation == 0
+
+    with pytest.raises(MCPPoolExhaustedError):
+        pool.acquire()
+
+    pool.release(borrowed[0])
+    assert pool.acquire() is borrowed[0]
+
+
+def test_warm_up_does_not_bump_generation():
+    pool, clients = make_pool(min_size=2)
+    pool.warm_up()
+    assert len(clients) == 2
+    assert pool.generation == 0
+
+
+def test_dead_client_is_replaced_and_bumps_generation():
+    pool, clients = make_pool()
+    client = pool.acquire()
+    pool.release(client)
+    client._background_thread.alive = False
+
+    replacement = pool.acquire()
+    assert replacement is not client
+    assert client.stopped
+    assert pool.generation == 1
+    assert pool.discarded_total == 1
+
+
+def test_discarded_client_stops_after_last_call_returns():
+    pool, clients = make_pool()
+    first = pool.acquire()
+    second = pool.acquire()
+    pool.release(first, discard=True)
+    assert pool.generation == 1
+    assert not first.stopped
+    assert pool.acquire() is not first
+
+    pool.release(second)
+    assert first.stopped
+
+
+def test_evict_idle_keeps_min_size_and_busy_clients():
+    pool, clients = make_pool(min_size=1, max_concurrency=1, idle_timeout=0)
+    a = pool.acquire()
+    b = pool.acquire()
+    pool.release(b)
+    assert pool.evict_idle() == 1
+    assert b.stopped and not a.stopped
+    pool.release(a)
+    assert pool.evict_idle() == 0
+    assert pool.generation == 0
+
+
+def test_waiter_is_woken_on_release():
+    pool, clients = make_pool(max_size=1, max_concurrency=1, acquire_timeout=5)
+    client = pool.acquire()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(pool.acquire()))
+    waiter.start()
+    pool.release(client)
+    waiter.join(5)
+    assert result == [client]
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from memory_writer import MemoryWriter
+
+
+class FakeMem0:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.batches = []
+        self.attempts = 0
+        self.written = threading.Event()
+
+    def add_memories(self, batch):
+        self.attempts += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("opensearch unavailable")
+        self.batches.append([turn["user_query"] for turn in batch])
+        self.written.set()
+
+
+@pytest.fixture
+def writer_env(monkeypatch):
+    monkeypatch.setenv('MEMORY_WRITE_QUEUE_SIZE', '3')
+    monkeypatch.setenv('MEMORY_WRITE_BATCH_SIZE', '2')
+    monkeypatch.setenv('MEMORY_WRITE_BATCH_DELAY', '0.05')
+    monkeypatch.setenv('MEMORY_WRITE_MAX_RETRIES', '2')
+    monkeypatch.setenv('MEMORY_WRITE_RETRY_BACKOFF', '0.01')
+    monkeypatch.setenv('MEMORY_WRITE_DRAIN_TIMEOUT', '5')
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_turns_of_one_user_are_batched_in_order(writer_env):
+    writer = MemoryWriter()
+    mem0 = FakeMem0()
+    for query in ("q1", "q2", "q3"):
+        writer.submit("alice", mem0, query, "answer")
+    writer.start()
+    assert wait_until(lambda: writer.stats()["written"] == 3)
+    writer.close()
+    assert mem0.batches == [["q1", "q2"], ["q3"]]
+
+
+def test_full_queue_drops_new_turns(writer_env):
+    writer = MemoryWriter()
+    mem0 = FakeMem0()
+    results = [writer.submit("alice", mem0, f"q{i}", "answer") for i in range(4)]
+    assert results == [True, True, True, False]
+    assert writer.stats()["dropped"] == 1
+
+
+def test_failed_write_is_retried_with_same_turns(writer_env):
+    writer = MemoryWriter()
+    mem0 = FakeMem0(failures=2)
+    writer.submit("alice", mem0, "q1", "answer")
+    writer.start()
+    assert wait_until(lambda: writer.stats()["written"] == 1)
+    writer.close()
+    assert mem0.attempts == 3
+    assert mem0.batches == [["q1"]]
+    assert writer.stats()["failed"] == 0
+
+
+def test_batch_is_dropped_after_max_retries(writer_env):
+    writer = MemoryWriter()
+    mem0 = FakeMem0(failures=10)
+    writer.submit("alice", mem0, "q1", "answer")
+    writer.start()
+    assert wait_until(lambda: writer.stats()["failed"] == 1)
+    writer.close()
+    assert mem0.attempts == 3
+    assert writer.stats()["queued"] == 0
+
+
+def test_close_drains_pending_turns_without_waiting_for_batch_delay(writer_env, monkeypatch):
+    monkeypatch.setenv('MEMORY_WRITE_BATCH_DELAY', '60')
+    writer = MemoryWriter()
+    alice, bob = FakeMem0(), FakeMem0()
+    writer.submit("alice", alice, "q1", "answer")
+    writer.submit("bob", bob, "q2", "answer")
+    writer.start()
+    writer.close()
+    assert alice.batches == [["q1"]] and bob.batches == [["q2"]]
+    assert writer.stats()["queued"] == 0
+    assert not writer.submit("alice", alice, "q3", "answer")
@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from stream_registry import StreamRegistry, StreamSession
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _fill(stream, count):
+    for i in range(count):
+        await stream.append({"type": "content", "content": str(i)})
+    await stream.finish()
+
+
+async def _collect(stream, after_seq=0):
+    return [item async for item in stream.subscribe(after_seq, heartbeat_interval=0.05)]
+
+
+def test_replay_from_memory_after_last_event_id():
+    async def scenario():
+        stream = StreamSession('s1', 'u1', max_events=10)
+        await _fill(stream, 5)
+        return await _collect(stream, after_seq=2)
+
+    items = run(scenario())
+    assert [seq for seq, _ in items] == [3, 4, 5]
+    assert [event["content"] for _, event in items] == ["2", "3", "4"]
+
+
+def test_overflow_without_spill_dir_reports_gap():
+    async def scenario():
+        stream = StreamSession('s1', 'u1', max_events=3)
+        await _fill(stream, 10)
+        return await _collect(stream)
+
+    items = run(scenario())
+    assert items[0] == (None, {"type": "gap", "from_seq": 1, "to_seq": 7})
+    assert [seq for seq, _ in items[1:]] == [8, 9, 10]
+
+
+def test_overflow_spills_to_disk_and_resumes_by_offset(tmp_path, monkeypatch):
+    monkeypatch.setattr('stream_registry.SPILL_READ_BATCH', 7)
+
+    async def scenario():
+        stream = StreamSession('s1', 'u1', max_events=3, spill_dir=str(tmp_path))
+        await _fill(stream, 50)
+        return stream, await _collect(stream, after_seq=20)
+
+    stream, items = run(scenario())
+    assert [seq for seq, _ in items] == list(range(21, 51))
+    assert [event["content"] for _, event in items] == [str(i) for i in range(20, 50)]
+    assert stream.stats()["spilled"] == 47
+    assert stream.stats()["buffered"] == 3
+    stream.cleanup()
+    assert not list(tmp_path.iterdir())
+
+
+def test_live_subscriber_receives_events_and_heartbeats():
+    async def scenario():
+        stream = StreamSession('s1', 'u1', max_events=10)
+
+        async def produce():
+            await asyncio.sleep(0.12)
+            await stream.append({"type": "content", "content": "x"})
+            await stream.finish()
+
+        producer = asyncio.create_task(produce())
+        items = await _collect(stream)
+        await producer
+        return items
+
+    items = run(scenario())
+    assert (None, {"type": "heartbeat"}) in items
+    assert items[-1] == (1, {"type": "content", "content": "x"})
+
+
+def test_cancelled_pump_appends_error_and_stays_cancelled(monkeypatch):
+    monkeypatch.setenv('STREAM_DISCONNECT_GRACE', '60')
+
+    async def scenario():
+        registry = StreamRegistry()
+
+        async def events():
+            yield {"type": "content", "content": "a"}
+            await asyncio.sleep(60)
+
+        stream = await registry.start('u1', events())
+        await asyncio.sleep(0.01)
+        stream.task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await stream.task
+        return stream, await _collect(stream)
+
+    stream, items = run(scenario())
+    assert stream.task.cancelled()
+    assert stream.finished
+    assert items[-1][1] == {"type": "error", "error": "生成已取消"}
+
+
+async def _take_and_disconnect(stream, count):
+    subscription = stream.subscribe(heartbeat_interval=0.05)
+    items = [await subscription.__anext__() for _ in range(count)]
+    await subscription.aclose()
+    return items
+
+
+async def _endless():
+    yield {"type": "content", "content": "a"}
+    await asyncio.sleep(60)
+
+
+def test_generation_is_cancelled_after_disconnect_grace(monkeypatch):
+    monkeypatch.setenv('STREAM_DISCONNECT_GRACE', '0.05')
+
+    async def scenario():
+        registry = StreamRegistry()
+        stream = await registry.start('u1', _endless())
+        await _take_and_disconnect(stream, 2)
+        assert not stream.task.done()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(stream.task, timeout=5)
+        return stream
+
+    stream = run(scenario())
+    assert stream.task.cancelled()
+    assert stream.finished
+
+
+def test_reconnect_within_grace_keeps_generation_running(monkeypatch):
+    monkeypatch.setenv('STREAM_DISCONNECT_GRACE', '0.05')
+
+    async def scenario():
+        registry = StreamRegistry()
+        stream = await registry.start('u1', _endless())
+        await _take_and_disconnect(stream, 2)
+        subscription = stream.subscribe(after_seq=2, heartbeat_interval=0.05)
+        await subscription.__anext__()
+        await asyncio.sleep(0.15)
+        running = not stream.task.done()
+        await subscription.aclose()
+        stream.task.cancel()
+        return running
+
+    assert run(scenario())
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("strands")
+
+import tool_memo
+from strands.types.tools import AgentTool
+from tool_memo import MemoizedTool, ToolMemoStore, memo_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(tool_memo, "time", clock)
+    return clock
+
+
+def make_store(tmp_path, **kwargs):
+    options = dict(path=str(tmp_path / "tool_memo.sqlite3"), max_bytes=1024 * 1024, default_ttl=60, ttl_overrides={})
+    options.update(kwargs)
+    return ToolMemoStore(**options)
+
+
+def result(text, status="success"):
+    return {"toolUseId": "t1", "status": status, "content": [{"text": text}]}
+
+
+def test_memo_key_ignores_whitespace_and_empty_arguments():
+    assert memo_key("crawl", {"url": " https://a ", "depth": None}) == memo_key("crawl", {"url": "https://a"})
+    assert memo_key("crawl", {"url": "https://a"}) != memo_key("search", {"url": "https://a"})
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    store = make_store(tmp_path, ttl_overrides={"web_search_tool": 10})
+    store.put("main___web_search_tool", "k1", result("a"))
+    store.put("crawl_tool", "k2", result("b"))
+
+    clock.now += 11
+    assert store.get("main___web_search_tool", "k1") is None
+    assert store.get("crawl_tool", "k2") == result("b")
+    clock.now += 50
+    assert store.get("crawl_tool", "k2") is None
+
+
+def test_zero_ttl_disables_caching(tmp_path, clock):
+    store = make_store(tmp_path, ttl_overrides={"crawl_tool": 0})
+    store.put("crawl_tool", "k1", result("a"))
+    assert store.get("crawl_tool", "k1") is None
+
+
+def test_size_budget_evicts_least_recently_used(tmp_path, clock):
+    size = len(tool_memo.json.dumps(result("x" * 100), ensure_ascii=False).encode("utf-8"))
+    store = make_store(tmp_path, max_bytes=size * 2)
+    store.put("tool", "a", result("x" * 100))
+    clock.now += 1
+    store.put("tool", "b", result("x" * 100))
+    clock.now += 1
+    assert store.get("tool", "a") is not None
+    clock.now += 1
+    store.put("tool", "c", result("x" * 100))
+
+    assert store.get("tool", "b") is None
+    assert store.get("tool", "a") is not None
+    assert store.get("tool", "c") is not None
+    assert store.stats()["evictions"] == 1
+
+
+class FakeTool(AgentTool):
+    def __init__(self, results):
+        super().__init__()
+        self.results = list(results)
+        self.calls = 0
+
+    @property
+    def tool_name(self):
+        return "crawl_tool"
+
+    @property
+    def tool_spec(self):
+        return {"name": "crawl_tool", "description": "", "inputSchema": {"json": {}}}
+
+    @property
+    def tool_type(self):
+        return "python"
+
+    async def stream(self, tool_use, invocation_state, **kwargs):
+        self.calls += 1
+        yield dict(self.results.pop(0), toolUseId=tool_use["toolUseId"])
+
+
+def call(tool, tool_use_id):
+    async def scenario():
+        events = [event async for event in tool.stream({"toolUseId": tool_use_id, "input": {"url": "https://a"}}, {})]
+        last = events[-1]
+        return getattr(last, "tool_result", last)
+
+    return asyncio.run(scenario())
+
+
+def test_memoized_tool_serves_cached_success_with_new_tool_use_id(tmp_path):
+    inner = FakeTool([result("page")])
+    tool = MemoizedTool(inner, make_store(tmp_path))
+    assert call(tool, "t1")["content"] == [{"text": "page"}]
+    cached = call(tool, "t2")
+    assert cached["toolUseId"] == "t2"
+    assert cached["content"] == [{"text": "page"}]
+    assert inner.calls == 1
+
+
+def test_memoized_tool_does_not_cache_errors(tmp_path):
+    inner = FakeTool([result("timeout", status="error"), result("page")])
+    tool = MemoizedTool(inner, make_store(tmp_path))
+    assert call(tool, "t1")["status"] == "error"
+    assert call(tool, "t2")["content"] == [{"text": "page"}]
+    assert inner.calls == 2